@@ -1,12 +1,19 @@
 from django import forms
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.db.models import Case, F, Value, When
 from django.http import HttpResponseRedirect
 from django.shortcuts import reverse
+from django.template.response import TemplateResponse
 from django.templatetags.static import static
 from django.utils.html import format_html
 from django.utils.http import url_has_allowed_host_and_scheme
 
 from star_burger import settings
+from .assignment import apply_assignments, propose_assignments
+from .capabilities import capability_index
+from .dispatch import update_orders
+from .locations import update_restaurants_coordinates
 from .models import Product
 from .models import ProductCategory
 from .models import Restaurant
@@ -15,15 +22,33 @@ from .models import Order
 from .models import OrderItem
 
 
-class RestaurantMenuItemInline(admin.TabularInline):
+class CachedChoicesInline(admin.TabularInline):
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        # every inline row renders the same select, so its choices are fetched once per request
+        cached_choices = request.__dict__.setdefault('cached_inline_choices', {})
+        cache_key = (self.model, db_field.name)
+        if cache_key not in cached_choices:
+            cached_choices[cache_key] = list(formfield.choices)
+        formfield.choices = cached_choices[cache_key]
+        return formfield
+
+
+class RestaurantMenuItemInline(CachedChoicesInline):
     model = RestaurantMenuItem
     extra = 0
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('restaurant', 'product')
+
 
-class OrderItemInline(admin.TabularInline):
+class OrderItemInline(CachedChoicesInline):
     model = OrderItem
     extra = 0
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
 
 @admin.register(Restaurant)
 class RestaurantAdmin(admin.ModelAdmin):
@@ -36,10 +61,35 @@ class RestaurantAdmin(admin.ModelAdmin):
         'name',
         'address',
         'contact_phone',
+        'geocode_status',
+    ]
+    list_filter = [
+        'geocode_status',
+    ]
+    readonly_fields = [
+        'geocode_status',
     ]
     inlines = [
         RestaurantMenuItemInline
     ]
+    actions = [
+        'update_coordinates',
+    ]
+
+    def save_model(self, request, obj, form, change):
+        if {'lat', 'lng'} & set(form.changed_data):
+            obj.geocode_status = obj.MANUAL if None not in obj.coordinates else obj.PENDING
+        elif 'address' in form.changed_data and obj.geocode_status == obj.MANUAL:
+            obj.geocode_status = obj.PENDING
+        super().save_model(request, obj, form, change)
+
+    def update_coordinates(self, request, queryset):
+        restaurants = list(queryset.exclude(geocode_status=Restaurant.MANUAL))
+        update_restaurants_coordinates(restaurants)
+        found = sum(restaurant.geocode_status == Restaurant.FOUND for restaurant in restaurants)
+        self.message_user(request, f'Координаты найдены для {found} из {len(restaurants)} ресторанов')
+
+    update_coordinates.short_description = 'Обновить координаты по адресу'
 
 
 @admin.register(Product)
@@ -121,16 +171,33 @@ class OrderAdminForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if self.instance.id:
-            all_restaurants = Restaurant.objects.prefetch_related('menu_items__product')
-            self.fields['cook_in'].queryset = Order.objects.get_suitable_restaurants(self.instance, all_restaurants)
+            self.fields['cook_in'].queryset = Order.objects.get_suitable_restaurants(self.instance)
+            self.fields['cook_in'].choices = [('', '---------')] + [
+                (
+                    suitable_restaurant['restaurant'].id,
+                    f"{suitable_restaurant['restaurant']} — {suitable_restaurant['distance']:.2f} км"
+                    if suitable_restaurant['distance'] is not None
+                    else str(suitable_restaurant['restaurant']),
+                )
+                for suitable_restaurant in Order.objects.get_nearest_restaurants(self.instance)
+            ]
         else:
             self.fields['cook_in'].queryset = Restaurant.objects.none()
 
 
+class OrderActionForm(helpers.ActionForm):
+    restaurant = forms.ModelChoiceField(
+        label='Ресторан',
+        queryset=Restaurant.objects.order_by('name'),
+        required=False,
+    )
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
 
     form = OrderAdminForm
+    action_form = OrderActionForm
 
     inlines = [
         OrderItemInline
@@ -142,13 +209,21 @@ class OrderAdmin(admin.ModelAdmin):
               'status',
               'payment_method',
               'comment',
+              'cost',
               'registration_date',
               'call_date',
               'delivery_date',
               'cook_in',
+              'dispatch_status',
               ]
 
-    readonly_fields = ['registration_date']
+    readonly_fields = ['registration_date', 'cost', 'dispatch_status']
+    actions = [
+        'assign_restaurant',
+        'mark_processed',
+        'reset_to_raw',
+        'assign_optimal_restaurants',
+    ]
 
     def response_change(self, request, obj):
         res = super().response_change(request, obj)
@@ -158,11 +233,109 @@ class OrderAdmin(admin.ModelAdmin):
         else:
             return res
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Order.objects.filter(pk=form.instance.pk).recalculate_cost()
+
     def save_model(self, request, obj, form, change):
         if 'cook_in' in form.changed_data:
+            obj.dispatch_status = obj.DISPATCH_MANUAL
             if obj.status == obj.RAW:
                 obj.status = obj.DURING
             elif not obj.cook_in:
                 obj.status = obj.RAW
         super().save_model(request, obj, form, change)
 
+    def assign_optimal_restaurants(self, request, queryset):
+        if not request.POST.get('apply'):
+            proposal = propose_assignments(queryset)
+            return TemplateResponse(request, 'admin/foodcartapp/order/assignment_proposal.html', {
+                **self.admin_site.each_context(request),
+                'title': 'Назначение ресторанов',
+                'opts': self.model._meta,
+                'queryset': queryset,
+                'proposal': proposal,
+                'total_distance': sum(distance for _, _, distance in proposal if distance is not None),
+                'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            })
+
+        # the plan the manager has seen is applied as it is, not computed again
+        selected_orders_ids = set(queryset.values_list('id', flat=True))
+        restaurants_ids_by_order = {}
+        for pair in request.POST.getlist('assignment'):
+            order_id, _, restaurant_id = pair.partition(':')
+            if order_id.isdigit() and restaurant_id.isdigit() and int(order_id) in selected_orders_ids:
+                restaurants_ids_by_order[int(order_id)] = int(restaurant_id)
+        assigned_count, rejected = apply_assignments(restaurants_ids_by_order)
+        self.message_user(request, f'Рестораны назначены {assigned_count} заказам из {len(restaurants_ids_by_order)}')
+
+        rejection_reasons = {
+            'taken': 'уже обработаны или получили ресторан',
+            'unsuitable': 'ресторан больше не может приготовить',
+            'overloaded': 'у ресторана не осталось свободных мест',
+        }
+        for reason, orders_ids in rejected.items():
+            if orders_ids:
+                self.message_user(
+                    request,
+                    f'Не назначены заказы {", ".join(map(str, sorted(orders_ids)))}: {rejection_reasons[reason]}. '
+                    'Запустите подбор ещё раз',
+                    messages.WARNING,
+                )
+
+    assign_optimal_restaurants.short_description = 'Назначить рестораны с наименьшим общим расстоянием'
+
+    def assign_restaurant(self, request, queryset):
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        restaurant = form.cleaned_data['restaurant'] if form.is_valid() else None
+        if not restaurant:
+            self.message_user(request, 'Выберите ресторан рядом со списком действий', messages.ERROR)
+            return
+
+        products_ids_by_order = {order_id: [] for order_id in queryset.values_list('id', flat=True)}
+        for order_id, product_id in OrderItem.objects.filter(order__in=products_ids_by_order).values_list(
+            'order_id', 'product_id',
+        ):
+            products_ids_by_order[order_id].append(product_id)
+        unsuitable_orders_ids = [
+            order_id
+            for order_id, products_ids in products_ids_by_order.items()
+            if not capability_index.is_suitable(restaurant.id, products_ids)
+        ]
+        if unsuitable_orders_ids:
+            self.message_user(
+                request,
+                f'{restaurant} не может приготовить заказы: {", ".join(map(str, sorted(unsuitable_orders_ids)))}',
+                messages.ERROR,
+            )
+            return
+
+        # the same rules as in save_model: a new order goes to cooking once it has a restaurant
+        changed_count = update_orders(
+            queryset,
+            cook_in=restaurant.id,
+            status=Case(When(status=Order.RAW, then=Value(Order.DURING)), default=F('status')),
+            dispatch_status=Order.DISPATCH_MANUAL,
+        )
+        self.message_user(request, f'{restaurant} назначен {changed_count} заказам')
+
+    assign_restaurant.short_description = 'Назначить выбранный ресторан'
+
+    def mark_processed(self, request, queryset):
+        changed_count = update_orders(queryset, status=Order.PROCESSED)
+        self.message_user(request, f'Обработано заказов: {changed_count}')
+
+    mark_processed.short_description = 'Отметить обработанными'
+
+    def reset_to_raw(self, request, queryset):
+        # as in save_model, an order without a restaurant is new again
+        changed_count = update_orders(
+            queryset,
+            status=Order.RAW,
+            cook_in=None,
+            dispatch_status=Order.DISPATCH_MANUAL,
+        )
+        self.message_user(request, f'Возвращено в необработанные: {changed_count}')
+
+    reset_to_raw.short_description = 'Вернуть в необработанные без ресторана'
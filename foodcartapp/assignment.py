@@ -0,0 +1,174 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from place.geocoding import geocoding_cache
+
+from .capabilities import capability_index
+from .dispatch import assign_restaurants
+from .loads import get_restaurants_load
+from .models import Order, OrderItem, Restaurant, RestaurantLoad
+
+
+UNASSIGNED = -1
+
+
+def solve_assignment(costs, capacities):
+    """Restaurant column for every order row with the least total cost, UNASSIGNED where none fits.
+
+    costs is an orders × restaurants matrix with np.inf for restaurants that
+    can not take the order. As many orders as the capacities allow are
+    assigned. This is min-cost flow by successive shortest paths: every step
+    assigns one more order along the cheapest augmenting path, where an
+    order goes to a restaurant, an order of that restaurant may move to
+    another one and so on until a restaurant with free capacity. The graph
+    of such moves has restaurants only, its edge j → k weighs the least
+    extra cost of moving an order from j to k, so Bellman-Ford runs over a
+    few dozen nodes whatever the number of orders.
+    """
+    costs = np.asarray(costs, dtype=float)
+    orders_count, restaurants_count = costs.shape
+    free_capacities = np.array(capacities, dtype=int)
+    assignment = np.full(orders_count, UNASSIGNED)
+    move_costs = np.full((restaurants_count, restaurants_count), np.inf)
+    move_orders = np.zeros((restaurants_count, restaurants_count), dtype=int)
+    columns = np.arange(restaurants_count)
+
+    def update_moves(restaurant):
+        orders = np.flatnonzero(assignment == restaurant)
+        move_costs[restaurant] = np.inf
+        if len(orders):
+            extra_costs = costs[orders] - costs[orders, restaurant][:, None]
+            cheapest = extra_costs.argmin(axis=0)
+            move_costs[restaurant] = extra_costs[cheapest, columns]
+            move_orders[restaurant] = orders[cheapest]
+        move_costs[restaurant, restaurant] = np.inf
+
+    while free_capacities.any():
+        unassigned_orders = np.flatnonzero(assignment == UNASSIGNED)
+        if not len(unassigned_orders):
+            break
+        unassigned_costs = costs[unassigned_orders]
+        cheapest = unassigned_costs.argmin(axis=0)
+        starting_orders = unassigned_orders[cheapest]
+        distances = unassigned_costs[cheapest, columns]
+        previous = np.full(restaurants_count, UNASSIGNED)
+        for _ in range(restaurants_count):
+            through = distances[:, None] + move_costs
+            best_previous = through.argmin(axis=0)
+            best_distances = through[best_previous, columns]
+            improved = best_distances < distances - 1e-9
+            if not improved.any():
+                break
+            distances[improved] = best_distances[improved]
+            previous[improved] = best_previous[improved]
+
+        reachable = np.where(free_capacities > 0, distances, np.inf)
+        target = int(reachable.argmin())
+        if not np.isfinite(reachable[target]):
+            break
+
+        free_capacities[target] -= 1
+        changed_restaurants = {target}
+        while previous[target] != UNASSIGNED:
+            source = int(previous[target])
+            assignment[move_orders[source, target]] = target
+            changed_restaurants.add(source)
+            target = source
+        assignment[starting_orders[target]] = target
+        for restaurant in changed_restaurants:
+            update_moves(restaurant)
+    return assignment
+
+
+def get_free_capacities(restaurants, orders_count):
+    if not settings.RESTAURANT_MAX_ACTIVE_ORDERS:
+        return [orders_count] * len(restaurants)
+    loads = get_restaurants_load()
+    return [
+        max(settings.RESTAURANT_MAX_ACTIVE_ORDERS - loads.get(restaurant.id, 0), 0)
+        for restaurant in restaurants
+    ]
+
+
+def propose_assignments(orders):
+    """Restaurants for new orders without one, that keep the total distance least within capacities.
+
+    Returns a list of (order, restaurant, distance) with restaurant and
+    distance None for orders no restaurant can take.
+    """
+    orders = list(
+        orders
+        .filter(status=Order.RAW, cook_in__isnull=True)
+        .order_by('registration_date', 'id')
+        .prefetch_related('items')
+    )
+    coordinates = geocoding_cache.prefetch([order.address for order in orders], fetch_missing=False)
+    restaurants = list(Restaurant.objects.order_by('id'))
+    positions = {restaurant.id: position for position, restaurant in enumerate(restaurants)}
+
+    costs = np.full((len(orders), len(restaurants)), np.inf)
+    for row, order in enumerate(orders):
+        for nearest in Order.objects.get_nearest_restaurants(
+            order,
+            coordinates=coordinates[order.address],
+            radius_km=settings.DELIVERY_RADIUS_KM or None,
+        ):
+            if nearest['distance'] is not None:
+                costs[row, positions[nearest['restaurant'].id]] = nearest['distance']
+
+    assignment = solve_assignment(costs, get_free_capacities(restaurants, len(orders)))
+    return [
+        (order, restaurants[column], float(costs[row, column])) if column != UNASSIGNED else (order, None, None)
+        for row, (order, column) in enumerate(zip(orders, assignment))
+    ]
+
+
+def apply_assignments(restaurants_ids_by_order):
+    """Assign exactly the planned restaurants, return the number of assigned orders and ids of rejected ones.
+
+    Between the proposal and its confirmation orders may be taken, menus
+    changed and restaurants loaded, so an order is rejected when it is no
+    longer new and without a restaurant, when the restaurant can not cook it
+    any more or when the restaurant has no free capacity left for it.
+    Rejected orders are returned as {'taken': [...], 'unsuitable': [...],
+    'overloaded': [...]} and are not planned anew.
+    """
+    rejected = {'taken': [], 'unsuitable': [], 'overloaded': []}
+    with transaction.atomic():
+        new_orders_ids = set(
+            Order.objects
+            .select_for_update()
+            .filter(id__in=restaurants_ids_by_order, status=Order.RAW, cook_in__isnull=True)
+            .values_list('id', flat=True)
+        )
+        products_ids_by_order = {order_id: [] for order_id in new_orders_ids}
+        for order_id, product_id in OrderItem.objects.filter(order__in=new_orders_ids).values_list(
+            'order_id', 'product_id',
+        ):
+            products_ids_by_order[order_id].append(product_id)
+
+        orders_ids_by_restaurant = {}
+        for order_id, restaurant_id in restaurants_ids_by_order.items():
+            if order_id not in new_orders_ids:
+                rejected['taken'].append(order_id)
+            elif not capability_index.is_suitable(restaurant_id, products_ids_by_order[order_id]):
+                rejected['unsuitable'].append(order_id)
+            else:
+                orders_ids_by_restaurant.setdefault(restaurant_id, []).append(order_id)
+
+        capacity = settings.RESTAURANT_MAX_ACTIVE_ORDERS
+        if capacity:
+            loads = dict(
+                RestaurantLoad.objects
+                .select_for_update()
+                .filter(restaurant_id__in=orders_ids_by_restaurant)
+                .values_list('restaurant_id', 'active_orders')
+            )
+            for restaurant_id, orders_ids in orders_ids_by_restaurant.items():
+                free_capacity = max(capacity - loads.get(restaurant_id, 0), 0)
+                rejected['overloaded'].extend(orders_ids[free_capacity:])
+                del orders_ids[free_capacity:]
+
+        assigned_count = assign_restaurants(orders_ids_by_restaurant, Order.DISPATCH_MANUAL)
+    return assigned_count, rejected
@@ -0,0 +1,128 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.dispatch import receiver
+
+from .menus import menu_changed
+from .models import RestaurantMenuItem
+
+
+GENERATION_CACHE_KEY = 'foodcartapp:availability:generation'
+CHANGE_CACHE_KEY = 'foodcartapp:availability:change:{}'
+CHANGE_TIMEOUT = 60 * 60
+MAX_REPLAYED_CHANGES = 500
+
+
+class AvailabilityMatrix:
+    """Products × restaurants availability as a bytearray per product.
+
+    Every restaurant gets an ordinal, the cell of a restaurant in a product
+    row is 1 when the product is on sale there. The matrix is built from one
+    query and then patched cell by cell: every change of a menu item is
+    stored in the cache under the next generation number, so other
+    processes replay the missed changes instead of rebuilding. When a change
+    has been evicted they rebuild.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._restaurant_ordinals = {}
+        self._rows = {}
+        self._generation = None
+
+    def _get_shared_generation(self):
+        # when the counter is evicted it restarts from the clock, so it never goes back to a used value
+        return cache.get_or_set(GENERATION_CACHE_KEY, time.time_ns, timeout=None)
+
+    def _next_generation(self):
+        try:
+            return cache.incr(GENERATION_CACHE_KEY)
+        except ValueError:
+            generation = time.time_ns()
+            cache.set(GENERATION_CACHE_KEY, generation, timeout=None)
+            return generation
+
+    def _set_cell(self, restaurant_id, product_id, available):
+        ordinal = self._restaurant_ordinals.setdefault(restaurant_id, len(self._restaurant_ordinals))
+        row = self._rows.setdefault(product_id, bytearray())
+        if len(row) <= ordinal:
+            row.extend(bytes(ordinal + 1 - len(row)))
+        row[ordinal] = available
+
+    def rebuild(self):
+        with self._lock:
+            generation = self._get_shared_generation()
+            self._restaurant_ordinals = {}
+            self._rows = {}
+            menu_items = (
+                RestaurantMenuItem.objects
+                .filter(availability=True)
+                .values_list('restaurant_id', 'product_id')
+            )
+            for restaurant_id, product_id in menu_items:
+                self._set_cell(restaurant_id, product_id, True)
+            self._generation = generation
+
+    def reset(self):
+        """Drop the index of this process, the next read rebuilds it. Other processes are not told."""
+        with self._lock:
+            self._generation = None
+
+    def _ensure_fresh(self):
+        shared_generation = self._get_shared_generation()
+        if shared_generation == self._generation:
+            return
+        if self._generation is None or not 0 < shared_generation - self._generation <= MAX_REPLAYED_CHANGES:
+            self.rebuild()
+            return
+
+        changes_keys = [
+            CHANGE_CACHE_KEY.format(generation)
+            for generation in range(self._generation + 1, shared_generation + 1)
+        ]
+        changes = cache.get_many(changes_keys)
+        if len(changes) != len(changes_keys):
+            self.rebuild()
+            return
+        for change_key in changes_keys:
+            for cell in changes[change_key]:
+                self._set_cell(*cell)
+        self._generation = shared_generation
+
+    def change_cells(self, cells):
+        """Record changed cells as (restaurant_id, product_id, available) for all processes."""
+        with self._lock:
+            generation = self._next_generation()
+            cache.set(CHANGE_CACHE_KEY.format(generation), cells, timeout=CHANGE_TIMEOUT)
+            if self._generation is not None and generation == self._generation + 1:
+                for cell in cells:
+                    self._set_cell(*cell)
+                self._generation = generation
+
+    def invalidate(self):
+        with self._lock:
+            self._next_generation()
+            self._generation = None
+
+    def get_rows(self, products_ids, restaurants_ids):
+        """Availability of products in restaurants as lists of booleans in the order of restaurants_ids."""
+        with self._lock:
+            self._ensure_fresh()
+            ordinals = [self._restaurant_ordinals.get(restaurant_id) for restaurant_id in restaurants_ids]
+            rows = {}
+            for product_id in products_ids:
+                row = self._rows.get(product_id, b'')
+                rows[product_id] = [
+                    ordinal is not None and ordinal < len(row) and row[ordinal] == 1
+                    for ordinal in ordinals
+                ]
+            return rows
+
+
+availability_matrix = AvailabilityMatrix()
+
+
+@receiver(menu_changed)
+def update_availability_on_menu_change(sender, changes, **kwargs):
+    availability_matrix.change_cells(changes)
@@ -0,0 +1,121 @@
+import threading
+
+from django.core.cache import cache
+from django.dispatch import receiver
+
+from .menus import menu_changed
+from .models import RestaurantMenuItem
+
+
+GENERATION_CACHE_KEY = 'foodcartapp:capabilities:generation'
+
+
+class CapabilityIndex:
+    """Bitmask of available products for every restaurant.
+
+    Every known product gets its own bit, so checking that a restaurant
+    can cook the whole order is a single AND per restaurant. The index is
+    kept in memory of the process and patched incrementally on menu
+    changes. Other processes notice the change through the generation
+    counter stored in the cache and rebuild on the next read.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._product_bits = {}
+        self._restaurant_masks = {}
+        self._generation = None
+
+    def _get_product_bit(self, product_id):
+        if product_id not in self._product_bits:
+            self._product_bits[product_id] = 1 << len(self._product_bits)
+        return self._product_bits[product_id]
+
+    def _get_shared_generation(self):
+        return cache.get_or_set(GENERATION_CACHE_KEY, 0, timeout=None)
+
+    def rebuild(self):
+        with self._lock:
+            generation = self._get_shared_generation()
+            self._product_bits = {}
+            self._restaurant_masks = {}
+            menu_items = (
+                RestaurantMenuItem.objects
+                .filter(availability=True)
+                .order_by('product_id')
+                .values_list('restaurant_id', 'product_id')
+            )
+            for restaurant_id, product_id in menu_items:
+                self._restaurant_masks[restaurant_id] = (
+                    self._restaurant_masks.get(restaurant_id, 0) | self._get_product_bit(product_id)
+                )
+            self._generation = generation
+
+    def reset(self):
+        """Drop the index of this process, the next read rebuilds it. Other processes are not told."""
+        with self._lock:
+            self._generation = None
+
+    def _ensure_fresh(self):
+        if self._generation is None or self._generation != self._get_shared_generation():
+            self.rebuild()
+
+    def _bump_generation(self):
+        try:
+            generation = cache.incr(GENERATION_CACHE_KEY)
+        except ValueError:
+            cache.set(GENERATION_CACHE_KEY, 1, timeout=None)
+            generation = 1
+        if self._generation is not None and generation == self._generation + 1:
+            self._generation = generation
+        else:
+            self._generation = None
+
+    def get_products_mask(self, product_ids):
+        mask = 0
+        with self._lock:
+            for product_id in product_ids:
+                bit = self._product_bits.get(product_id)
+                if bit is None:
+                    return None
+                mask |= bit
+        return mask
+
+    def get_suitable_restaurant_ids(self, product_ids):
+        with self._lock:
+            self._ensure_fresh()
+            order_mask = self.get_products_mask(product_ids)
+            if order_mask is None:
+                return []
+            return [
+                restaurant_id
+                for restaurant_id, restaurant_mask in self._restaurant_masks.items()
+                if restaurant_mask & order_mask == order_mask
+            ]
+
+    def is_suitable(self, restaurant_id, product_ids):
+        with self._lock:
+            self._ensure_fresh()
+            order_mask = self.get_products_mask(product_ids)
+            restaurant_mask = self._restaurant_masks.get(restaurant_id, 0)
+            return order_mask is not None and restaurant_mask & order_mask == order_mask
+
+    def update_menu_item(self, restaurant_id, product_id, available):
+        with self._lock:
+            if self._generation is not None:
+                restaurant_mask = self._restaurant_masks.get(restaurant_id, 0)
+                if available:
+                    restaurant_mask |= self._get_product_bit(product_id)
+                elif product_id in self._product_bits:
+                    restaurant_mask &= ~self._product_bits[product_id]
+                self._restaurant_masks[restaurant_id] = restaurant_mask
+            self._bump_generation()
+
+
+capability_index = CapabilityIndex()
+
+
+@receiver(menu_changed)
+def update_capabilities_on_menu_change(sender, changes, **kwargs):
+    for restaurant_id, product_id, available in changes:
+        capability_index.update_menu_item(restaurant_id, product_id, available)
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from django.templatetags.static import static
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Product, ProductCategory, RestaurantMenuItem
+
+
+CATALOG_VERSION_CACHE_KEY = 'foodcartapp:catalog:version'
+# a snapshot left by a process that missed the invalidation expires anyway
+CATALOG_SNAPSHOT_TIMEOUT = 24 * 60 * 60
+
+catalog_changed = Signal()
+
+
+def dump_banners():
+    # FIXME move data to db?
+    return [
+        {
+            'title': 'Burger',
+            'src': static('burger.jpg'),
+            'text': 'Tasty Burger at your door step',
+        },
+        {
+            'title': 'Spices',
+            'src': static('food.jpg'),
+            'text': 'All Cuisines',
+        },
+        {
+            'title': 'New York',
+            'src': static('tasty.jpg'),
+            'text': 'Food is incomplete without a tasty dessert',
+        }
+    ]
+
+
+def dump_products():
+    products = Product.objects.select_related('category').available()
+
+    dumped_products = []
+    for product in products:
+        dumped_product = {
+            'id': product.id,
+            'name': product.name,
+            'price': product.price,
+            'special_status': product.special_status,
+            'description': product.description,
+            'category': {
+                'id': product.category.id,
+                'name': product.category.name,
+            } if product.category else None,
+            'image': product.image.url,
+            'restaurant': {
+                'id': product.id,
+                'name': product.name,
+            }
+        }
+        dumped_products.append(dumped_product)
+    return dumped_products
+
+
+def build_catalog_snapshot():
+    body = json.dumps(
+        dump_products(),
+        cls=JSONEncoder,
+        ensure_ascii=False,
+        separators=(',', ':'),
+    ).encode()
+    return {
+        'body': body,
+        'etag': hashlib.sha1(body).hexdigest(),
+        'last_modified': timezone.now(),
+    }
+
+
+def get_catalog_version():
+    # when the counter is evicted it restarts from the clock, never from an already used value
+    return cache.get_or_set(CATALOG_VERSION_CACHE_KEY, time.time_ns, timeout=None)
+
+
+def get_catalog_snapshot_key(version):
+    return f'foodcartapp:catalog:{version}'
+
+
+def get_catalog_snapshot():
+    # a snapshot built from old data lands under the old version key
+    # and can not overwrite the fresh one after invalidation
+    cache_key = get_catalog_snapshot_key(get_catalog_version())
+    snapshot = cache.get(cache_key)
+    if snapshot is None:
+        snapshot = build_catalog_snapshot()
+        cache.set(cache_key, snapshot, timeout=CATALOG_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+_available_products = {'version': None, 'products': {}}
+# threads of one process share the products, so only one of them reloads them after a change
+_available_products_lock = threading.Lock()
+
+
+def get_available_products(products_ids):
+    if not settings.CACHE_AVAILABLE_PRODUCTS:
+        return Product.objects.available().in_bulk(products_ids)
+
+    version = get_catalog_version()
+    with _available_products_lock:
+        if _available_products['version'] != version:
+            _available_products['products'] = Product.objects.available().in_bulk()
+            _available_products['version'] = version
+        products = _available_products['products']
+    return {
+        product_id: products[product_id]
+        for product_id in products_ids
+        if product_id in products
+    }
+
+
+def reset_available_products():
+    with _available_products_lock:
+        _available_products['version'] = None
+        _available_products['products'] = {}
+
+
+_catalog_invalidation = threading.local()
+
+
+def invalidate_pending_catalog():
+    if getattr(_catalog_invalidation, 'pending', False):
+        _catalog_invalidation.pending = False
+        invalidate_catalog()
+
+
+def invalidate_catalog():
+    try:
+        version = cache.incr(CATALOG_VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+    else:
+        cache.delete(get_catalog_snapshot_key(version - 1))
+    catalog_changed.send(sender=None)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def invalidate_catalog_on_change(sender, **kwargs):
+    # a transaction changing many rows, e.g. a product with inline menu items,
+    # queues a callback per row, only the first one to run invalidates
+    _catalog_invalidation.pending = True
+    transaction.on_commit(invalidate_pending_catalog)
@@ -0,0 +1,129 @@
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from place.geocoding import geocoding_cache
+
+from .events import record_order_events
+from .loads import change_restaurants_load, get_loaded_restaurant_id, get_restaurants_load
+from .models import Order
+
+
+def assign_restaurants(orders_ids_by_restaurant, dispatch_status, orders=None):
+    """Give restaurants to the orders that are still new and without one, return the number of assigned.
+
+    Takes one UPDATE per restaurant, the load counters are changed in the same transaction.
+    """
+    orders = Order.objects.all() if orders is None else orders
+    new_orders = orders.filter(status=Order.RAW, cook_in__isnull=True)
+    with transaction.atomic():
+        assigned_counts = {
+            restaurant_id: new_orders.filter(id__in=orders_ids).update(
+                cook_in=restaurant_id,
+                status=Order.DURING,
+                dispatch_status=dispatch_status,
+            )
+            for restaurant_id, orders_ids in orders_ids_by_restaurant.items()
+        }
+        change_restaurants_load(assigned_counts)
+        record_order_events(
+            order_id for orders_ids in orders_ids_by_restaurant.values() for order_id in orders_ids
+        )
+    return sum(assigned_counts.values())
+
+
+def update_orders(orders, **fields):
+    """Change orders with one UPDATE, return the number of changed ones.
+
+    Counters of orders in progress are recounted from the states of the
+    orders before and after the UPDATE, in the same transaction.
+    """
+    with transaction.atomic():
+        orders_ids = list(orders.values_list('id', flat=True))
+        orders = Order.objects.filter(id__in=orders_ids)
+        previous_states = list(orders.select_for_update().values_list('status', 'cook_in_id'))
+        changed_count = orders.update(**fields)
+
+        deltas = Counter(
+            get_loaded_restaurant_id(*state) for state in orders.values_list('status', 'cook_in_id')
+        )
+        deltas.subtract(get_loaded_restaurant_id(*state) for state in previous_states)
+        change_restaurants_load(deltas)
+        record_order_events(orders_ids)
+    return changed_count
+
+
+def choose_restaurant(nearest_restaurants, loads):
+    """The restaurant with the least distance, every order in progress there counting as extra kilometres.
+
+    Restaurants with unknown distance or no free capacity are skipped.
+    """
+    capacity = settings.RESTAURANT_MAX_ACTIVE_ORDERS
+    candidates = [
+        (nearest['distance'] + loads.get(nearest['restaurant'].id, 0) * settings.DISPATCH_KM_PER_ACTIVE_ORDER,
+         nearest['restaurant'])
+        for nearest in nearest_restaurants
+        if nearest['distance'] is not None
+        and (not capacity or loads.get(nearest['restaurant'].id, 0) < capacity)
+    ]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda candidate: candidate[0])[1]
+
+
+def dispatch_orders(batch_size=100):
+    """Assign restaurants to new orders, return numbers of assigned orders and orders left to managers.
+
+    An order waits for the coordinates of its address and for a restaurant
+    with free capacity up to DISPATCH_MAX_WAIT_SECONDS, an order no
+    restaurant can cook goes to managers at once. The update is conditional,
+    so an order a manager has taken meanwhile is not overwritten.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        orders = list(
+            Order.objects
+            .select_for_update(skip_locked=True)
+            .filter(dispatch_status=Order.DISPATCH_PENDING)
+            .order_by('registration_date', 'id')
+            .prefetch_related('items')[:batch_size]
+        )
+        if not orders:
+            return 0, 0
+
+        coordinates = geocoding_cache.prefetch([order.address for order in orders], fetch_missing=False)
+        loads = get_restaurants_load()
+        wait_deadline = now - datetime.timedelta(seconds=settings.DISPATCH_MAX_WAIT_SECONDS)
+        assigned_orders_ids = {}
+        manual_orders_ids = []
+        for order in orders:
+            if order.status != Order.RAW or order.cook_in_id:
+                manual_orders_ids.append(order.id)
+                continue
+            nearest_restaurants = Order.objects.get_nearest_restaurants(
+                order,
+                coordinates=coordinates[order.address],
+                radius_km=settings.DELIVERY_RADIUS_KM or None,
+            )
+            restaurant = choose_restaurant(nearest_restaurants, loads)
+            if restaurant:
+                loads[restaurant.id] = loads.get(restaurant.id, 0) + 1
+                assigned_orders_ids.setdefault(restaurant.id, []).append(order.id)
+            elif not nearest_restaurants or order.registration_date < wait_deadline:
+                manual_orders_ids.append(order.id)
+
+        assigned_count = assign_restaurants(
+            assigned_orders_ids,
+            Order.DISPATCH_AUTO,
+            orders=Order.objects.filter(dispatch_status=Order.DISPATCH_PENDING),
+        )
+        manual_count = (
+            Order.objects
+            .filter(id__in=manual_orders_ids, dispatch_status=Order.DISPATCH_PENDING)
+            .update(dispatch_status=Order.DISPATCH_MANUAL)
+        )
+        record_order_events(manual_orders_ids)
+    return assigned_count, manual_count
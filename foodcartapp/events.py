@@ -0,0 +1,78 @@
+import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Order, OrderEvent, OrderItem
+
+
+LAST_EVENT_CACHE_KEY = 'foodcartapp:order_events:last'
+MAX_CHANGES_PER_RESPONSE = 500
+ORDER_EVENTS_GRACE = datetime.timedelta(seconds=2)
+
+
+def record_order_events(orders_ids):
+    """Append changed orders to the change log once the transaction is committed.
+
+    Events are written after commit, so a rolled back change is not logged
+    and a reader never sees an event before the change itself.
+    """
+    orders_ids = set(orders_ids)
+    if not orders_ids:
+        return
+
+    def record():
+        OrderEvent.objects.bulk_create([OrderEvent(order_id=order_id) for order_id in orders_ids])
+        cache.set(LAST_EVENT_CACHE_KEY, OrderEvent.objects.aggregate(last=Max('id'))['last'], timeout=None)
+
+    transaction.on_commit(record)
+
+
+def get_last_order_event_id():
+    last_event_id = cache.get(LAST_EVENT_CACHE_KEY)
+    if last_event_id is None:
+        last_event_id = OrderEvent.objects.aggregate(last=Max('id'))['last'] or 0
+        cache.set(LAST_EVENT_CACHE_KEY, last_event_id, timeout=None)
+    return last_event_id
+
+
+def get_changed_orders_ids(after):
+    """Ids of orders changed after the event with id after and the cursor to read on from.
+
+    An event id is taken on insert but seen on commit, so a lower id may show
+    up after a higher one was read. The cursor stays before events younger
+    than ORDER_EVENTS_GRACE, they are read again by the next call.
+    """
+    events = list(
+        OrderEvent.objects
+        .filter(id__gt=after)
+        .order_by('id')
+        .values_list('id', 'order_id', 'created_at')[:MAX_CHANGES_PER_RESPONSE]
+    )
+    settled_before = timezone.now() - ORDER_EVENTS_GRACE
+    cursor = after
+    for event_id, _, created_at in events:
+        if created_at > settled_before:
+            break
+        cursor = event_id
+    return {order_id for _, order_id, _ in events}, cursor
+
+
+def delete_old_order_events(older_than):
+    return OrderEvent.objects.filter(created_at__lt=timezone.now() - older_than).delete()[0]
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def record_order_change(sender, instance, **kwargs):
+    record_order_events([instance.id])
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def record_order_item_change(sender, instance, **kwargs):
+    record_order_events([instance.order_id])
@@ -0,0 +1,126 @@
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Order, RestaurantLoad
+
+
+def change_restaurants_load(deltas):
+    """Add deltas by restaurant id to the numbers of orders in progress.
+
+    The counters are changed in the current transaction, so they are rolled
+    back together with the change of orders.
+    """
+    deltas = {restaurant_id: delta for restaurant_id, delta in deltas.items() if restaurant_id and delta}
+    if not deltas:
+        return
+    RestaurantLoad.objects.bulk_create(
+        [RestaurantLoad(restaurant_id=restaurant_id) for restaurant_id in deltas],
+        ignore_conflicts=True,
+    )
+    for restaurant_id, delta in deltas.items():
+        RestaurantLoad.objects.filter(restaurant_id=restaurant_id).update(active_orders=F('active_orders') + delta)
+
+
+def get_restaurant_load(restaurant_id):
+    """Number of orders in progress in the restaurant."""
+    return (
+        RestaurantLoad.objects
+        .filter(restaurant_id=restaurant_id)
+        .values_list('active_orders', flat=True)
+        .first()
+    ) or 0
+
+
+def get_restaurants_load():
+    """Numbers of orders in progress by restaurant id."""
+    return dict(RestaurantLoad.objects.values_list('restaurant_id', 'active_orders'))
+
+
+def count_restaurants_load():
+    return dict(
+        Order.objects
+        .filter(status=Order.DURING, cook_in__isnull=False)
+        .values_list('cook_in')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+
+def reconcile_restaurants_load():
+    """Recount orders in progress and fix the counters, return {restaurant_id: (stored, counted)} of fixed ones.
+
+    The counters are locked before orders are counted, so an order changed
+    meanwhile waits and applies its delta on top of the recounted value.
+    """
+    with transaction.atomic():
+        stored_loads = dict(
+            RestaurantLoad.objects
+            .select_for_update()
+            .values_list('restaurant_id', 'active_orders')
+        )
+        counted_loads = count_restaurants_load()
+        mismatches = {
+            restaurant_id: (stored_loads.get(restaurant_id), counted_loads.get(restaurant_id, 0))
+            for restaurant_id in stored_loads.keys() | counted_loads.keys()
+            if stored_loads.get(restaurant_id) != counted_loads.get(restaurant_id, 0)
+        }
+        RestaurantLoad.objects.bulk_create(
+            [
+                RestaurantLoad(restaurant_id=restaurant_id, active_orders=counted)
+                for restaurant_id, (stored, counted) in mismatches.items()
+                if stored is None
+            ],
+            ignore_conflicts=True,
+        )
+        RestaurantLoad.objects.bulk_update(
+            [
+                RestaurantLoad(restaurant_id=restaurant_id, active_orders=counted)
+                for restaurant_id, (stored, counted) in mismatches.items()
+                if stored is not None
+            ],
+            ['active_orders'],
+            batch_size=500,
+        )
+    return mismatches
+
+
+def get_loaded_restaurant_id(status, cook_in_id):
+    return cook_in_id if status == Order.DURING else None
+
+
+LOAD_FIELDS = {'status', 'cook_in', 'cook_in_id'}
+
+
+def changes_load(update_fields):
+    return update_fields is None or bool(LOAD_FIELDS & set(update_fields))
+
+
+@receiver(pre_save, sender=Order)
+def remember_previous_loaded_restaurant(sender, instance, update_fields=None, **kwargs):
+    instance._previous_loaded_restaurant_id = None
+    if instance.pk and changes_load(update_fields):
+        orders = sender.objects.filter(pk=instance.pk)
+        # the row is locked, so two saves of one order do not both count it;
+        # Order.save opens the transaction, only a bare save_base comes here without one
+        if connection.in_atomic_block:
+            orders = orders.select_for_update()
+        previous_state = orders.values_list('status', 'cook_in_id').first()
+        if previous_state:
+            instance._previous_loaded_restaurant_id = get_loaded_restaurant_id(*previous_state)
+
+
+@receiver(post_save, sender=Order)
+def update_load_on_order_save(sender, instance, update_fields=None, **kwargs):
+    if not changes_load(update_fields):
+        return
+    previous_restaurant_id = instance._previous_loaded_restaurant_id
+    restaurant_id = get_loaded_restaurant_id(instance.status, instance.cook_in_id)
+    if previous_restaurant_id != restaurant_id:
+        change_restaurants_load({previous_restaurant_id: -1, restaurant_id: 1})
+
+
+@receiver(post_delete, sender=Order)
+def update_load_on_order_delete(sender, instance, **kwargs):
+    change_restaurants_load({get_loaded_restaurant_id(instance.status, instance.cook_in_id): -1})
@@ -0,0 +1,172 @@
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from place.addresses import normalize_address
+from place.distance import get_distance_matrix
+from place.geocoding import coordinates_changed, geocoding_cache
+from place.models import Place
+from place.spatial import GridIndex
+
+from .models import Restaurant
+
+
+GENERATION_CACHE_KEY = 'foodcartapp:locations:generation'
+
+
+class RestaurantLocationIndex:
+    """Restaurants on a grid by their coordinates for nearest restaurant queries.
+
+    The index is kept in memory of the process and rebuilt on the next read
+    after a restaurant changes. Other processes
+    learn about changes through the generation counter stored in the cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._generation = None
+        self._grid = GridIndex([])
+        self._located_restaurants = []
+        self._located_positions = {}
+        self._unlocated_restaurants = []
+
+    def _get_shared_generation(self):
+        return cache.get_or_set(GENERATION_CACHE_KEY, 0, timeout=None)
+
+    def rebuild(self):
+        with self._lock:
+            generation = self._get_shared_generation()
+            restaurants = list(Restaurant.objects.order_by('id'))
+            located_restaurants = [
+                restaurant for restaurant in restaurants
+                if None not in restaurant.coordinates
+            ]
+            self._grid = GridIndex(
+                [restaurant.coordinates for restaurant in located_restaurants],
+                cell_km=settings.RESTAURANTS_GRID_CELL_KM,
+            )
+            self._located_restaurants = located_restaurants
+            self._located_positions = {
+                restaurant.id: position for position, restaurant in enumerate(located_restaurants)
+            }
+            self._unlocated_restaurants = [
+                restaurant for restaurant in restaurants
+                if None in restaurant.coordinates
+            ]
+            self._generation = generation
+
+    def reset(self):
+        """Drop the index of this process, the next read rebuilds it. Other processes are not told."""
+        with self._lock:
+            self._generation = None
+
+    def _ensure_fresh(self):
+        if self._generation is None or self._generation != self._get_shared_generation():
+            self.rebuild()
+
+    def invalidate(self):
+        try:
+            cache.incr(GENERATION_CACHE_KEY)
+        except ValueError:
+            cache.set(GENERATION_CACHE_KEY, 1, timeout=None)
+        self._generation = None
+
+    def get_nearest(self, coordinates, restaurants_ids, count=None, radius_km=None):
+        """Restaurants from restaurants_ids closest to the point first, with distances in km.
+
+        Restaurants with unknown coordinates go last with distance None,
+        without coordinates of the point every restaurant does.
+        """
+        with self._lock:
+            self._ensure_fresh()
+            restaurants_ids = set(restaurants_ids)
+            if None in coordinates:
+                return [
+                    (restaurant, None)
+                    for restaurant in self._located_restaurants + self._unlocated_restaurants
+                    if restaurant.id in restaurants_ids
+                ]
+
+            allowed = np.zeros(len(self._grid), dtype=bool)
+            allowed[[
+                self._located_positions[restaurant_id]
+                for restaurant_id in restaurants_ids
+                if restaurant_id in self._located_positions
+            ]] = True
+            positions, distances = self._grid.nearest(*coordinates, count=count, radius_km=radius_km, allowed=allowed)
+            if settings.PRECISE_DISTANCES and len(positions):
+                distances = get_distance_matrix(
+                    [coordinates],
+                    self._grid.coordinates[positions].tolist(),
+                    precise=True,
+                )[0]
+                order = np.argsort(distances, kind='stable')
+                positions, distances = positions[order], distances[order]
+            return [
+                (self._located_restaurants[position], float(distance))
+                for position, distance in zip(positions, distances)
+            ] + [
+                (restaurant, None)
+                for restaurant in self._unlocated_restaurants
+                if restaurant.id in restaurants_ids
+            ]
+
+
+restaurant_locations = RestaurantLocationIndex()
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_locations_on_restaurant_change(sender, **kwargs):
+    transaction.on_commit(restaurant_locations.invalidate)
+
+
+def resolve_restaurants_coordinates(restaurants, fetch_missing=True):
+    """Fill coordinates and geocode status of restaurants from their addresses, without saving."""
+    coordinates = geocoding_cache.prefetch(
+        [restaurant.address for restaurant in restaurants],
+        fetch_missing=fetch_missing,
+    )
+    unresolved_keys = {
+        normalize_address(restaurant.address)
+        for restaurant in restaurants
+        if None in coordinates[restaurant.address]
+    }
+    # a place without coordinates is the geocoder's answer, no place means it was not asked yet
+    not_found_keys = set(
+        Place.objects
+        .filter(normalized_address__in=unresolved_keys, request_date__isnull=False)
+        .values_list('normalized_address', flat=True)
+    ) if unresolved_keys else set()
+
+    for restaurant in restaurants:
+        restaurant.lat, restaurant.lng = coordinates[restaurant.address]
+        if restaurant.lat is not None and restaurant.lng is not None:
+            restaurant.geocode_status = Restaurant.FOUND
+        elif normalize_address(restaurant.address) in not_found_keys:
+            restaurant.geocode_status = Restaurant.NOT_FOUND
+        else:
+            restaurant.geocode_status = Restaurant.PENDING
+
+
+def update_restaurants_coordinates(restaurants, fetch_missing=True):
+    resolve_restaurants_coordinates(restaurants, fetch_missing=fetch_missing)
+    Restaurant.objects.bulk_update(restaurants, ['lat', 'lng', 'geocode_status'], batch_size=500)
+    transaction.on_commit(restaurant_locations.invalidate)
+
+
+@receiver(coordinates_changed)
+def update_restaurants_on_coordinates_change(sender, keys, **kwargs):
+    # the geocoding worker answers addresses of restaurants saved while the geocoder was not available
+    restaurants = [
+        restaurant
+        for restaurant in Restaurant.objects.filter(geocode_status__in=[Restaurant.PENDING, Restaurant.NOT_FOUND])
+        if normalize_address(restaurant.address) in keys
+    ]
+    if restaurants:
+        update_restaurants_coordinates(restaurants, fetch_missing=False)
@@ -0,0 +1,16 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.events import delete_old_order_events
+
+
+class Command(BaseCommand):
+    help = 'Удаляет старые записи журнала изменений заказов, по которому обновляется страница заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Удалить записи старше стольких часов')
+
+    def handle(self, *args, **options):
+        deleted = delete_old_order_events(datetime.timedelta(hours=options['hours']))
+        self.stdout.write(f'Удалено записей: {deleted}')
@@ -0,0 +1,41 @@
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from foodcartapp.capabilities import capability_index
+from foodcartapp.dispatch import dispatch_orders
+from foodcartapp.locations import restaurant_locations
+
+
+def is_cache_shared():
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+class Command(BaseCommand):
+    help = 'Назначает новым заказам ближайший подходящий ресторан в фоне'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Разобрать новые заказы один раз и выйти')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=3, help='Пауза в секундах между пачками заказов')
+
+    def handle(self, *args, **options):
+        # with a per-process cache changes of menus and addresses made by the
+        # site are not seen here, so the indexes are rebuilt for every batch
+        rebuild_indexes = not is_cache_shared()
+        if rebuild_indexes:
+            self.stderr.write('Кэш не общий с сайтом, индексы ресторанов будут пересобираться для каждой пачки')
+        while True:
+            if rebuild_indexes:
+                capability_index.reset()
+                restaurant_locations.reset()
+            assigned, manual = dispatch_orders(options['batch_size'])
+            if assigned or manual:
+                self.stdout.write(f'Назначено заказов: {assigned}, оставлено менеджерам: {manual}')
+            if options['once']:
+                return
+            if assigned + manual < options['batch_size']:
+                time.sleep(options['interval'])
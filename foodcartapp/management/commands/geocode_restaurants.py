@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.locations import update_restaurants_coordinates
+from foodcartapp.models import Restaurant
+
+
+class Command(BaseCommand):
+    help = 'Заполняет координаты ресторанов по их адресам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Обновить и уже найденные координаты, кроме указанных вручную')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        restaurants = Restaurant.objects.exclude(geocode_status=Restaurant.MANUAL).order_by('id')
+        if not options['all']:
+            restaurants = restaurants.filter(geocode_status__in=[Restaurant.PENDING, Restaurant.NOT_FOUND])
+        restaurants = list(restaurants)
+
+        for start in range(0, len(restaurants), options['batch_size']):
+            update_restaurants_coordinates(restaurants[start:start + options['batch_size']])
+
+        statuses = dict(Restaurant.GEOCODE_STATUS_CHOICES)
+        for status in [Restaurant.FOUND, Restaurant.NOT_FOUND, Restaurant.PENDING]:
+            count = sum(restaurant.geocode_status == status for restaurant in restaurants)
+            self.stdout.write(f'{statuses[status]}: {count}')
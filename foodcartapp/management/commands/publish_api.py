@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.publishing import get_published_root, publish_api
+
+
+class Command(BaseCommand):
+    help = 'Сохраняет JSON меню и баннеров в статику, сжатые gzip и brotli'
+
+    def handle(self, *args, **options):
+        manifest = publish_api()
+        for name, artifact in manifest.items():
+            self.stdout.write(f'{name}: {artifact["filename"]}')
+        self.stdout.write(self.style.SUCCESS(f'Файлы сохранены в {get_published_root()}'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from foodcartapp.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сохранённую стоимость заказов по их позициям'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только проверить стоимость заказов, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        mismatched_orders = (
+            Order.objects
+            .with_items_cost()
+            .exclude(cost=F('items_cost'))
+            .order_by('id')
+        )
+        if options['verify']:
+            mismatched = list(mismatched_orders.values_list('id', 'cost', 'items_cost'))
+            for order_id, cost, items_cost in mismatched:
+                self.stdout.write(f'Заказ #{order_id}: сохранено {cost}, по позициям {items_cost}')
+            if mismatched:
+                raise CommandError(f'Неверная стоимость у заказов: {len(mismatched)}')
+            self.stdout.write(self.style.SUCCESS('Стоимость всех заказов верна'))
+            return
+
+        with transaction.atomic():
+            updated = Order.objects.filter(
+                id__in=mismatched_orders.values('id'),
+            ).recalculate_cost()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитана стоимость заказов: {updated}'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.loads import reconcile_restaurants_load
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает, сколько заказов готовится в каждом ресторане, и исправляет счётчики'
+
+    def handle(self, *args, **options):
+        mismatches = reconcile_restaurants_load()
+        for restaurant_id, (stored, counted) in sorted(mismatches.items()):
+            self.stdout.write(f'Ресторан {restaurant_id}: было {stored}, стало {counted}')
+        self.stdout.write(f'Исправлено счётчиков: {len(mismatches)}')
@@ -0,0 +1,42 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from .models import RestaurantMenuItem
+
+
+# sent after commit with changes, a list of (restaurant_id, product_id, available)
+menu_changed = Signal()
+
+
+def send_menu_changes(changes):
+    """Tell the in-memory menu indexes about changed menu items once the transaction commits."""
+    changes = list(changes)
+    if changes:
+        transaction.on_commit(lambda: menu_changed.send(sender=RestaurantMenuItem, changes=changes))
+
+
+@receiver(pre_save, sender=RestaurantMenuItem)
+def remember_previous_menu_pair(sender, instance, **kwargs):
+    instance._previous_menu_pair = None
+    if instance.pk:
+        instance._previous_menu_pair = (
+            sender.objects
+            .filter(pk=instance.pk)
+            .values_list('restaurant_id', 'product_id')
+            .first()
+        )
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+def send_menu_changes_on_save(sender, instance, **kwargs):
+    changes = [(instance.restaurant_id, instance.product_id, instance.availability)]
+    previous_pair = instance._previous_menu_pair
+    if previous_pair and previous_pair != (instance.restaurant_id, instance.product_id):
+        changes.insert(0, (*previous_pair, False))
+    send_menu_changes(changes)
+
+
+@receiver(post_delete, sender=RestaurantMenuItem)
+def send_menu_changes_on_delete(sender, instance, **kwargs):
+    send_menu_changes([(instance.restaurant_id, instance.product_id, False)])
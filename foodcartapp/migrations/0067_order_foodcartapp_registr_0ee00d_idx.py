@@ -0,0 +1,17 @@
+# Generated by Django 3.2 on 2026-10-18 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0066_alter_order_cook_in'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['registration_date', 'id'], name='foodcartapp_registr_0ee00d_idx'),
+        ),
+    ]
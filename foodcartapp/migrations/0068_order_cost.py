@@ -0,0 +1,19 @@
+# Generated by Django 3.2 on 2026-10-18 01:34
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0067_order_foodcartapp_registr_0ee00d_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='cost',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Стоимость'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2 on 2026-10-18 01:51
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+
+# places have the keys written by place 0005 by the time this runs
+normalize_address = import_module('place.migrations.0005_renormalize_addresses').normalize_address
+
+
+def fill_restaurants_coordinates(apps, schema_editor):
+    Restaurant = apps.get_model('foodcartapp', 'Restaurant')
+    Place = apps.get_model('place', 'Place')
+    restaurants = list(Restaurant.objects.all())
+    places = Place.objects.in_bulk(
+        [normalize_address(restaurant.address) for restaurant in restaurants],
+        field_name='normalized_address',
+    )
+    for restaurant in restaurants:
+        place = places.get(normalize_address(restaurant.address))
+        if place and place.lat is not None and place.lng is not None:
+            restaurant.lat, restaurant.lng = place.lat, place.lng
+            restaurant.geocode_status = 'FD'
+        elif place and place.request_date:
+            restaurant.geocode_status = 'NF'
+    Restaurant.objects.bulk_update(restaurants, ['lat', 'lng', 'geocode_status'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0068_order_cost'),
+        ('place', '0005_renormalize_addresses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='geocode_status',
+            field=models.CharField(choices=[('PD', 'Ожидает геокодера'), ('FD', 'Найден'), ('NF', 'Не найден'), ('MN', 'Указан вручную')], db_index=True, default='PD', max_length=2, verbose_name='координаты'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='lat',
+            field=models.DecimalField(blank=True, decimal_places=15, max_digits=18, null=True, verbose_name='широта'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='lng',
+            field=models.DecimalField(blank=True, decimal_places=15, max_digits=18, null=True, verbose_name='долгота'),
+        ),
+        migrations.RunPython(fill_restaurants_coordinates, migrations.RunPython.noop),
+    ]
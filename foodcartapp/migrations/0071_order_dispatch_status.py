@@ -0,0 +1,24 @@
+# Generated by Django 3.2 on 2026-10-18 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0070_orderevent'),
+    ]
+
+    operations = [
+        # orders placed before the dispatcher are already in the hands of managers
+        migrations.AddField(
+            model_name='order',
+            name='dispatch_status',
+            field=models.CharField(choices=[('PD', 'Ждёт диспетчера'), ('AT', 'Автоматически'), ('MN', 'Менеджером')], db_index=True, default='MN', max_length=2, verbose_name='Назначение ресторана'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='dispatch_status',
+            field=models.CharField(choices=[('PD', 'Ждёт диспетчера'), ('AT', 'Автоматически'), ('MN', 'Менеджером')], db_index=True, default='PD', max_length=2, verbose_name='Назначение ресторана'),
+        ),
+    ]
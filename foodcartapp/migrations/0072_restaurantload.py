@@ -0,0 +1,43 @@
+# Generated by Django 3.2 on 2026-10-18 02:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_restaurants_load(apps, schema_editor):
+    Order = apps.get_model('foodcartapp', 'Order')
+    Restaurant = apps.get_model('foodcartapp', 'Restaurant')
+    RestaurantLoad = apps.get_model('foodcartapp', 'RestaurantLoad')
+    active_orders = dict(
+        Order.objects
+        .filter(status='DR', cook_in__isnull=False)
+        .values_list('cook_in')
+        .annotate(count=models.Count('id'))
+        .order_by()
+    )
+    RestaurantLoad.objects.bulk_create([
+        RestaurantLoad(restaurant_id=restaurant_id, active_orders=active_orders.get(restaurant_id, 0))
+        for restaurant_id in Restaurant.objects.values_list('id', flat=True)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0071_order_dispatch_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestaurantLoad',
+            fields=[
+                ('restaurant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='load', serialize=False, to='foodcartapp.restaurant', verbose_name='ресторан')),
+                ('active_orders', models.IntegerField(default=0, verbose_name='заказов готовится')),
+            ],
+            options={
+                'verbose_name': 'загрузка ресторана',
+                'verbose_name_plural': 'загрузка ресторанов',
+            },
+        ),
+        migrations.RunPython(fill_restaurants_load, migrations.RunPython.noop),
+    ]
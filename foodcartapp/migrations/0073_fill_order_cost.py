@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_orders_cost(apps, schema_editor):
+    Order = apps.get_model('foodcartapp', 'Order')
+    OrderItem = apps.get_model('foodcartapp', 'OrderItem')
+    items_cost = (
+        OrderItem.objects
+        .filter(order=OuterRef('pk'))
+        .values('order')
+        .annotate(cost=Sum(F('quantity') * F('price')))
+        .values('cost')
+    )
+    Order.objects.update(cost=Coalesce(
+        Subquery(items_cost),
+        Value(0),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0072_restaurantload'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_orders_cost, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 02:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0073_fill_order_cost'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='foodcartapp_registr_0ee00d_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-status', 'registration_date', 'id'], name='foodcartapp_status_5a4f6f_idx'),
+        ),
+    ]
@@ -1,11 +1,25 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
 from phonenumber_field.modelfields import PhoneNumberField
 
-from place.models import add_distance_to_restaurants
+from star_burger.metrics import RESTAURANT_MATCHING_DURATION
 
 
 class Restaurant(models.Model):
+    PENDING = 'PD'
+    FOUND = 'FD'
+    NOT_FOUND = 'NF'
+    MANUAL = 'MN'
+    GEOCODE_STATUS_CHOICES = [
+        (PENDING, 'Ожидает геокодера'),
+        (FOUND, 'Найден'),
+        (NOT_FOUND, 'Не найден'),
+        (MANUAL, 'Указан вручную'),
+    ]
+
     name = models.CharField(
         'название',
         max_length=50
@@ -20,6 +34,27 @@ class Restaurant(models.Model):
         max_length=50,
         blank=True,
     )
+    lat = models.DecimalField(
+        'широта',
+        max_digits=18,
+        decimal_places=15,
+        blank=True,
+        null=True,
+    )
+    lng = models.DecimalField(
+        'долгота',
+        max_digits=18,
+        decimal_places=15,
+        blank=True,
+        null=True,
+    )
+    geocode_status = models.CharField(
+        'координаты',
+        max_length=2,
+        choices=GEOCODE_STATUS_CHOICES,
+        default=PENDING,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'ресторан'
@@ -28,6 +63,29 @@ class Restaurant(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        restaurant = super().from_db(db, field_names, values)
+        restaurant._loaded_address = restaurant.__dict__.get('address')
+        return restaurant
+
+    @property
+    def coordinates(self):
+        if self.lat is None or self.lng is None:
+            return None, None
+        return float(self.lat), float(self.lng)
+
+    def save(self, *args, **kwargs):
+        # coordinates entered by hand stay, others follow the address
+        address_changed = self.address != getattr(self, '_loaded_address', None)
+        unresolved = self.geocode_status == self.PENDING and None in self.coordinates
+        if self.geocode_status != self.MANUAL and (address_changed or unresolved):
+            from .locations import resolve_restaurants_coordinates
+
+            resolve_restaurants_coordinates([self])
+        super().save(*args, **kwargs)
+        self._loaded_address = self.address
+
 
 class ProductQuerySet(models.QuerySet):
     def available(self):
@@ -93,6 +151,54 @@ class Product(models.Model):
         return self.name
 
 
+class RestaurantMenuItemQuerySet(models.QuerySet):
+    """Menu items whose bulk changes reach the menu indexes and the catalog cache.
+
+    update and bulk_create send no model signals, so they send the changes
+    to the menu_changed receivers and invalidate the catalog themselves.
+    """
+
+    def _notify_menu_changes(self, changes):
+        from .catalog import invalidate_catalog_on_change
+        from .menus import send_menu_changes
+
+        send_menu_changes(changes)
+        invalidate_catalog_on_change(sender=RestaurantMenuItem)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            # with ignore_conflicts some items are not inserted, so the stored states are read back
+            pairs = {(item.restaurant_id, item.product_id) for item in objs}
+            stored_states = (
+                RestaurantMenuItem.objects
+                .filter(
+                    restaurant_id__in={restaurant_id for restaurant_id, _ in pairs},
+                    product_id__in={product_id for _, product_id in pairs},
+                )
+                .values_list('restaurant_id', 'product_id', 'availability')
+            )
+            self._notify_menu_changes(state for state in stored_states if state[:2] in pairs)
+        return objs
+
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db):
+            previous_pairs = {
+                item_id: (restaurant_id, product_id)
+                for item_id, restaurant_id, product_id in self.values_list('id', 'restaurant_id', 'product_id')
+            }
+            updated_count = super().update(**kwargs)
+            changes = []
+            for item_id, *state in RestaurantMenuItem.objects.filter(id__in=previous_pairs).values_list(
+                'id', 'restaurant_id', 'product_id', 'availability',
+            ):
+                if previous_pairs[item_id] != tuple(state[:2]):
+                    changes.insert(0, (*previous_pairs[item_id], False))
+                changes.append(tuple(state))
+            self._notify_menu_changes(changes)
+        return updated_count
+
+
 class RestaurantMenuItem(models.Model):
     restaurant = models.ForeignKey(
         Restaurant,
@@ -112,6 +218,8 @@ class RestaurantMenuItem(models.Model):
         db_index=True
     )
 
+    objects = RestaurantMenuItemQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'пункт меню ресторана'
         verbose_name_plural = 'пункты меню ресторана'
@@ -124,25 +232,83 @@ class RestaurantMenuItem(models.Model):
 
 
 class ExtendedQuerySet(models.QuerySet):
-    def get_suitable_restaurants(self, order, all_restaurants):
-        order_products_ids = [item.product.id for item in order.items.all()]
+    def get_items_cost(self):
+        items_cost = (
+            OrderItem.objects
+            .filter(order=OuterRef('pk'))
+            .values('order')
+            .annotate(cost=Sum(F('quantity') * F('price')))
+            .values('cost')
+        )
+        return Coalesce(
+            Subquery(items_cost),
+            Value(0),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        )
+
+    def with_items_cost(self):
+        return self.annotate(items_cost=self.get_items_cost())
 
-        suitable_restaurants_ids = []
-        for restaurant in all_restaurants:
-            restaurant_products_ids = [item.product.id for item in restaurant.menu_items.all()]
+    def recalculate_cost(self):
+        return self.update(cost=self.get_items_cost())
 
-            if set(order_products_ids).issubset(restaurant_products_ids):
-                suitable_restaurants_ids.append(restaurant.id)
-        suitable_restaurants = all_restaurants.filter(id__in=suitable_restaurants_ids)
-        return suitable_restaurants
+    def order_by_status(self):
+        # by status code descending: new (RW), processed (PR), cooking (DR), each group in registration order;
+        # processed orders are filtered out on the manager page unless asked for alone
+        return self.order_by('-status', 'registration_date', 'id')
+
+    def after(self, status, registration_date, order_id):
+        """Orders that follow the given one in order_by_status order."""
+        return self.filter(
+            models.Q(status__lt=status)
+            | models.Q(status=status, registration_date__gt=registration_date)
+            | models.Q(status=status, registration_date=registration_date, id__gt=order_id)
+        )
+
+    def get_suitable_restaurants(self, order):
+        from .capabilities import capability_index
+
+        order_products_ids = [item.product_id for item in order.items.all()]
+        suitable_restaurants_ids = capability_index.get_suitable_restaurant_ids(order_products_ids)
+        return Restaurant.objects.filter(id__in=suitable_restaurants_ids)
+
+    def get_nearest_restaurants(self, order, coordinates=None, count=None, radius_km=None):
+        from place.geocoding import geocoding_cache
+
+        from .capabilities import capability_index
+        from .locations import restaurant_locations
+
+        if coordinates is None:
+            coordinates = geocoding_cache.prefetch([order.address], fetch_missing=False)[order.address]
+        order_products_ids = [item.product_id for item in order.items.all()]
+        return [
+            {'restaurant': restaurant, 'distance': distance}
+            for restaurant, distance in restaurant_locations.get_nearest(
+                coordinates,
+                capability_index.get_suitable_restaurant_ids(order_products_ids),
+                count=count,
+                radius_km=radius_km,
+            )
+        ]
 
     def add_restaurants_with_distance(self):
-        all_restaurants = Restaurant.objects.prefetch_related('menu_items__product')
-        for order in self:
-            suitable_restaurants = self.get_suitable_restaurants(order, all_restaurants)
-            restaurants_with_distance = add_distance_to_restaurants(suitable_restaurants, order)
-            order.suitable_restaurants = restaurants_with_distance
-        return self
+        orders = list(self)
+        with RESTAURANT_MATCHING_DURATION.time():
+            self._add_restaurants_with_distance(orders)
+        return orders
+
+    def _add_restaurants_with_distance(self, orders):
+        from place.geocoding import geocoding_cache
+
+        coordinates = geocoding_cache.prefetch([order.address for order in orders], fetch_missing=False)
+        for order in orders:
+            order.has_coordinates = None not in coordinates[order.address]
+            order.suitable_restaurants = self.get_nearest_restaurants(
+                order,
+                coordinates=coordinates[order.address],
+                count=settings.NEAREST_RESTAURANTS_COUNT or None,
+                radius_km=settings.DELIVERY_RADIUS_KM or None,
+            )
 
 
 class Order(models.Model):
@@ -160,6 +326,14 @@ class Order(models.Model):
         (CASH, 'Налич.'),
         (ELECTRONIC, 'Элект.'),
     ]
+    DISPATCH_PENDING = 'PD'
+    DISPATCH_AUTO = 'AT'
+    DISPATCH_MANUAL = 'MN'
+    DISPATCH_CHOICES = [
+        (DISPATCH_PENDING, 'Ждёт диспетчера'),
+        (DISPATCH_AUTO, 'Автоматически'),
+        (DISPATCH_MANUAL, 'Менеджером'),
+    ]
 
     firstname = models.CharField(
         'Имя',
@@ -221,16 +395,47 @@ class Order(models.Model):
         blank=True,
         null=True,
     )
+    dispatch_status = models.CharField(
+        'Назначение ресторана',
+        max_length=2,
+        choices=DISPATCH_CHOICES,
+        default=DISPATCH_PENDING,
+        db_index=True,
+    )
+    cost = models.DecimalField(
+        'Стоимость',
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        db_index=True,
+        validators=[MinValueValidator(0)],
+    )
 
     objects = ExtendedQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'заказ'
         verbose_name_plural = 'заказы'
+        indexes = [
+            models.Index(fields=['-status', 'registration_date', 'id']),
+        ]
 
     def __str__(self):
         return f'Заказ #{self.id}'
 
+    def save(self, *args, **kwargs):
+        # the previous state is read, the order saved and the load counters changed in one transaction, see loads.py
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # the counter is decreased for the stored state, the one in memory may be stale
+            stored_state = Order.objects.select_for_update().filter(pk=self.pk).values_list('status', 'cook_in').first()
+            if stored_state:
+                self.status, self.cook_in_id = stored_state
+            return super().delete(*args, **kwargs)
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(
@@ -262,3 +467,43 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.product.name}"
+
+
+class OrderEvent(models.Model):
+    order_id = models.PositiveIntegerField(
+        'заказ',
+        db_index=True,
+    )
+    created_at = models.DateTimeField(
+        'создано в',
+        auto_now_add=True,
+        db_index=True,
+    )
+
+    class Meta:
+        verbose_name = 'изменение заказа'
+        verbose_name_plural = 'изменения заказов'
+
+    def __str__(self):
+        return f'Изменение заказа #{self.order_id}'
+
+
+class RestaurantLoad(models.Model):
+    restaurant = models.OneToOneField(
+        Restaurant,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='load',
+        verbose_name='ресторан',
+    )
+    active_orders = models.IntegerField(
+        'заказов готовится',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'загрузка ресторана'
+        verbose_name_plural = 'загрузка ресторанов'
+
+    def __str__(self):
+        return f'{self.restaurant_id}: {self.active_orders}'
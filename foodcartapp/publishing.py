@@ -0,0 +1,144 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+import brotli
+from django.conf import settings
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseRedirect
+from django.utils.http import parse_etags
+
+from .catalog import catalog_changed, dump_banners, get_catalog_snapshot
+
+
+PUBLISHED_API_DIR = 'api'
+MANIFEST_NAME = 'manifest.json'
+ENCODINGS = [
+    ('br', '.br', lambda body: brotli.compress(body, quality=11)),
+    ('gzip', '.gz', lambda body: gzip.compress(body, compresslevel=9, mtime=0)),
+]
+
+_manifest_cache = {'mtime': None, 'manifest': {}}
+
+
+def get_published_root():
+    return os.path.join(settings.STATIC_ROOT, PUBLISHED_API_DIR)
+
+
+def write_file(path, content):
+    # a unique temporary file, so two processes publishing at once do not write into one
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(path),
+        prefix=f'.{os.path.basename(path)}.',
+        suffix='.tmp',
+        delete=False,
+    ) as file:
+        file.write(content)
+    try:
+        os.chmod(file.name, 0o644)
+        os.replace(file.name, path)
+    except OSError:
+        os.remove(file.name)
+        raise
+
+
+def read_manifest():
+    manifest_path = os.path.join(get_published_root(), MANIFEST_NAME)
+    try:
+        mtime = os.stat(manifest_path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    if _manifest_cache['mtime'] != mtime:
+        with open(manifest_path) as file:
+            _manifest_cache['manifest'] = json.load(file)
+        _manifest_cache['mtime'] = mtime
+    return _manifest_cache['manifest']
+
+
+def publish_artifact(name, body):
+    published_root = get_published_root()
+    os.makedirs(published_root, exist_ok=True)
+    content_hash = hashlib.sha256(body).hexdigest()[:16]
+    filename = f'{name}.{content_hash}.json'
+
+    write_file(os.path.join(published_root, filename), body)
+    for _, extension, compress in ENCODINGS:
+        write_file(os.path.join(published_root, filename + extension), compress(body))
+    return {'filename': filename, 'hash': content_hash}
+
+
+def remove_stale_artifacts(manifest, previous_manifest):
+    # files of the previous publication are kept for clients that got a redirect to them a moment ago
+    kept_filenames = {
+        artifact['filename']
+        for artifact in [*manifest.values(), *previous_manifest.values()]
+    }
+    published_root = get_published_root()
+    for filename in os.listdir(published_root):
+        if filename == MANIFEST_NAME or not filename.endswith(('.json', '.json.br', '.json.gz')):
+            continue
+        if filename.split('.json')[0] + '.json' not in kept_filenames:
+            os.remove(os.path.join(published_root, filename))
+
+
+def publish_api():
+    previous_manifest = dict(read_manifest())
+    manifest = {
+        'products': publish_artifact('products', get_catalog_snapshot()['body']),
+        'banners': publish_artifact(
+            'banners',
+            json.dumps(dump_banners(), ensure_ascii=False, indent=4).encode(),
+        ),
+    }
+    write_file(
+        os.path.join(get_published_root(), MANIFEST_NAME),
+        json.dumps(manifest, indent=2).encode(),
+    )
+    remove_stale_artifacts(manifest, previous_manifest)
+    return manifest
+
+
+def choose_encoding(request):
+    accepted_encodings = {
+        encoding.split(';')[0].strip()
+        for encoding in request.headers.get('Accept-Encoding', '').split(',')
+    }
+    for encoding, extension, _ in ENCODINGS:
+        if encoding in accepted_encodings:
+            return encoding, extension
+    return None, ''
+
+
+def get_published_response(request, name):
+    mode = settings.PUBLISHED_API_MODE
+    if not mode:
+        return None
+    artifact = read_manifest().get(name)
+    if not artifact:
+        return None
+
+    if mode == 'redirect':
+        return HttpResponseRedirect(f'{settings.STATIC_URL}{PUBLISHED_API_DIR}/{artifact["filename"]}')
+
+    encoding, extension = choose_encoding(request)
+    # compressed bodies differ byte for byte, so each encoding has its own ETag
+    etag = f'"{artifact["hash"]}{extension}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        with open(os.path.join(get_published_root(), artifact['filename'] + extension), 'rb') as file:
+            response = HttpResponse(file.read(), content_type='application/json')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@receiver(catalog_changed)
+def publish_api_on_catalog_change(sender, **kwargs):
+    if settings.PUBLISHED_API_MODE:
+        publish_api()
@@ -0,0 +1,796 @@
+import datetime
+import io
+import itertools
+import json
+import os
+import random
+import tempfile
+import unittest
+from decimal import Decimal
+from importlib import import_module
+
+import numpy as np
+from django.apps import apps
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from foodcartapp.assignment import UNASSIGNED, solve_assignment
+from foodcartapp.availability import AvailabilityMatrix, availability_matrix
+from foodcartapp.capabilities import CapabilityIndex, capability_index
+from foodcartapp.catalog import (
+    catalog_changed,
+    get_catalog_snapshot,
+    get_catalog_snapshot_key,
+    get_available_products,
+    get_catalog_version,
+    invalidate_catalog,
+    reset_available_products,
+)
+from foodcartapp.dispatch import assign_restaurants, dispatch_orders
+from foodcartapp.loads import get_restaurant_load, get_restaurants_load, reconcile_restaurants_load
+from foodcartapp.locations import restaurant_locations
+from foodcartapp.menus import menu_changed
+from foodcartapp.models import Order, OrderItem, Product, Restaurant, RestaurantLoad, RestaurantMenuItem
+from foodcartapp.publishing import get_published_root, publish_api, write_file
+from place.geocoding import geocoding_cache
+from place.models import Place
+from star_burger.metrics import REQUEST_SQL_QUERIES, REQUESTS
+
+
+class RestaurantCoordinatesTest(TestCase):
+    def setUp(self):
+        geocoding_cache.clear()
+
+    def test_coordinates_are_resolved_on_save(self):
+        Place.objects.create(address='ул. Ленина, 5', lat=56.01, lng=92.85)
+        restaurant = Restaurant.objects.create(name='Ленина', address='Ленина 5')
+        restaurant.refresh_from_db()
+        self.assertEqual(restaurant.geocode_status, Restaurant.FOUND)
+        self.assertEqual(restaurant.coordinates, (56.01, 92.85))
+
+    def test_manual_coordinates_are_kept(self):
+        restaurant = Restaurant.objects.create(
+            name='Мира',
+            address='проспект Мира, 10',
+            lat=56.02,
+            lng=92.87,
+            geocode_status=Restaurant.MANUAL,
+        )
+        restaurant.address = 'проспект Мира, 12'
+        restaurant.save()
+        restaurant.refresh_from_db()
+        self.assertEqual(restaurant.coordinates, (56.02, 92.87))
+
+    def test_pending_restaurants_get_coordinates_from_geocoder(self):
+        Restaurant.objects.bulk_create([Restaurant(name='Ленина', address='Ленина 5')])
+        geocoding_cache.store('ул. Ленина, 5', 56.01, 92.85)
+        restaurant = Restaurant.objects.get()
+        self.assertEqual(restaurant.geocode_status, Restaurant.FOUND)
+        self.assertEqual(restaurant.coordinates, (56.01, 92.85))
+
+
+class AvailabilityMatrixTest(TestCase):
+    def setUp(self):
+        Restaurant.objects.bulk_create([
+            Restaurant(name='Первый', geocode_status=Restaurant.MANUAL),
+            Restaurant(name='Второй', geocode_status=Restaurant.MANUAL),
+        ])
+        self.restaurants = list(Restaurant.objects.order_by('id'))
+        Product.objects.bulk_create([Product(name='Бургер', price=100, image='burger.jpg')])
+        self.product = Product.objects.get()
+        availability_matrix.invalidate()
+
+    def get_row(self, matrix):
+        restaurants_ids = [restaurant.id for restaurant in self.restaurants]
+        return matrix.get_rows([self.product.id], restaurants_ids)[self.product.id]
+
+    def test_changed_cells_reach_other_processes(self):
+        other_process_matrix = AvailabilityMatrix()
+        self.assertEqual(self.get_row(availability_matrix), [False, False])
+        self.assertEqual(self.get_row(other_process_matrix), [False, False])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item = RestaurantMenuItem.objects.create(restaurant=self.restaurants[1], product=self.product)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_row(availability_matrix), [False, True])
+            self.assertEqual(self.get_row(other_process_matrix), [False, True])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item.restaurant = self.restaurants[0]
+            menu_item.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_row(other_process_matrix), [True, False])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_row(other_process_matrix), [False, False])
+
+    def test_menu_changes_are_sent_after_commit(self):
+        sent_changes = []
+
+        def remember_changes(sender, changes, **kwargs):
+            sent_changes.append(changes)
+
+        menu_changed.connect(remember_changes)
+        self.addCleanup(menu_changed.disconnect, remember_changes)
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item = RestaurantMenuItem.objects.create(restaurant=self.restaurants[1], product=self.product)
+            self.assertEqual(sent_changes, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item.restaurant = self.restaurants[0]
+            menu_item.availability = False
+            menu_item.save()
+        self.assertEqual(sent_changes, [
+            [(self.restaurants[1].id, self.product.id, True)],
+            [(self.restaurants[1].id, self.product.id, False), (self.restaurants[0].id, self.product.id, False)],
+        ])
+
+
+class CapabilityIndexTest(TestCase):
+    def setUp(self):
+        Restaurant.objects.bulk_create([
+            Restaurant(name='Бургерная', geocode_status=Restaurant.MANUAL),
+            Restaurant(name='Фудкорт', geocode_status=Restaurant.MANUAL),
+        ])
+        self.burger_restaurant, self.food_court = Restaurant.objects.order_by('id')
+        Product.objects.bulk_create([
+            Product(name='Бургер', price=100, image='burger.jpg'),
+            Product(name='Шаурма', price=100, image='shawarma.jpg'),
+            Product(name='Суп', price=100, image='soup.jpg'),
+        ])
+        self.burger, self.shawarma, self.soup = Product.objects.order_by('id')
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.bulk_create([
+                RestaurantMenuItem(restaurant=self.burger_restaurant, product=self.burger),
+                RestaurantMenuItem(restaurant=self.food_court, product=self.burger),
+                RestaurantMenuItem(restaurant=self.food_court, product=self.shawarma),
+                RestaurantMenuItem(restaurant=self.food_court, product=self.soup, availability=False),
+            ])
+        capability_index.rebuild()
+
+    def get_suitable(self, index, *products):
+        return sorted(index.get_suitable_restaurant_ids([product.id for product in products]))
+
+    def test_suitable_restaurants(self):
+        self.assertEqual(self.get_suitable(capability_index, self.burger), [self.burger_restaurant.id, self.food_court.id])
+        self.assertEqual(self.get_suitable(capability_index, self.burger, self.shawarma), [self.food_court.id])
+        self.assertEqual(self.get_suitable(capability_index, self.soup), [])
+        self.assertTrue(capability_index.is_suitable(self.food_court.id, [self.burger.id, self.shawarma.id]))
+        self.assertFalse(capability_index.is_suitable(self.burger_restaurant.id, [self.shawarma.id]))
+
+    def test_saved_and_deleted_items_reach_other_processes(self):
+        other_process_index = CapabilityIndex()
+        self.assertEqual(self.get_suitable(other_process_index, self.soup), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.create(restaurant=self.burger_restaurant, product=self.soup)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_suitable(capability_index, self.soup), [self.burger_restaurant.id])
+        self.assertEqual(self.get_suitable(other_process_index, self.soup), [self.burger_restaurant.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.filter(product=self.burger, restaurant=self.food_court).delete()
+        self.assertEqual(self.get_suitable(other_process_index, self.burger), [self.burger_restaurant.id])
+
+    def test_bulk_changes_reach_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.filter(product=self.soup).update(availability=True)
+        self.assertEqual(self.get_suitable(capability_index, self.soup), [self.food_court.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.filter(product=self.shawarma).update(restaurant=self.burger_restaurant)
+        self.assertEqual(self.get_suitable(capability_index, self.shawarma), [self.burger_restaurant.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.bulk_create(
+                [RestaurantMenuItem(restaurant=self.food_court, product=self.shawarma, availability=False)],
+            )
+        self.assertEqual(self.get_suitable(capability_index, self.shawarma), [self.burger_restaurant.id])
+        self.assertEqual(self.get_suitable(CapabilityIndex(), self.shawarma), [self.burger_restaurant.id])
+
+
+@override_settings(RESTAURANT_MAX_ACTIVE_ORDERS=1, DISPATCH_KM_PER_ACTIVE_ORDER=0, DELIVERY_RADIUS_KM=0)
+class DispatchTest(TestCase):
+    def setUp(self):
+        Restaurant.objects.bulk_create([
+            Restaurant(name='Ближний', lat=56.01, lng=92.85, geocode_status=Restaurant.MANUAL),
+            Restaurant(name='Дальний', lat=56.05, lng=92.95, geocode_status=Restaurant.MANUAL),
+        ])
+        self.near_restaurant, self.far_restaurant = Restaurant.objects.order_by('id')
+        Product.objects.bulk_create([
+            Product(name='Бургер', price=100, image='burger.jpg'),
+            Product(name='Шаурма', price=100, image='shawarma.jpg'),
+        ])
+        self.burger, self.shawarma = Product.objects.order_by('id')
+        RestaurantMenuItem.objects.bulk_create([
+            RestaurantMenuItem(restaurant=self.near_restaurant, product=self.burger),
+            RestaurantMenuItem(restaurant=self.far_restaurant, product=self.burger),
+        ])
+        geocoding_cache.clear()
+        geocoding_cache.store('Ленина, 5', 56.011, 92.851)
+        capability_index.rebuild()
+        restaurant_locations.invalidate()
+
+    def create_order(self, product, address='Ленина, 5'):
+        order = Order.objects.create(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79123456789',
+            address=address,
+            payment_method=Order.CASH,
+        )
+        OrderItem.objects.create(order=order, product=product, quantity=1, price=100)
+        return order
+
+    def test_nearest_restaurant_with_free_capacity(self):
+        first_order = self.create_order(self.burger)
+        second_order = self.create_order(self.burger)
+        self.assertEqual(dispatch_orders(), (2, 0))
+
+        first_order.refresh_from_db()
+        second_order.refresh_from_db()
+        self.assertEqual((first_order.cook_in, first_order.status), (self.near_restaurant, Order.DURING))
+        self.assertEqual(first_order.dispatch_status, Order.DISPATCH_AUTO)
+        self.assertEqual(second_order.cook_in, self.far_restaurant)
+
+    def test_orders_without_restaurant_go_to_managers(self):
+        impossible_order = self.create_order(self.shawarma)
+        waiting_order = self.create_order(self.burger, address='Неизвестная, 1')
+        self.assertEqual(dispatch_orders(), (0, 1))
+        self.assertEqual(Order.objects.get(id=impossible_order.id).dispatch_status, Order.DISPATCH_MANUAL)
+        self.assertEqual(Order.objects.get(id=waiting_order.id).dispatch_status, Order.DISPATCH_PENDING)
+
+        Order.objects.filter(id=waiting_order.id).update(registration_date=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(dispatch_orders(), (0, 1))
+        self.assertEqual(Order.objects.get(id=waiting_order.id).dispatch_status, Order.DISPATCH_MANUAL)
+
+    def test_command_sees_menus_changed_by_other_processes(self):
+        order = self.create_order(self.shawarma)
+        # the callbacks of a test transaction never run, as those of another process do not run here
+        RestaurantMenuItem.objects.bulk_create([RestaurantMenuItem(restaurant=self.far_restaurant, product=self.shawarma)])
+        call_command('dispatch_orders', '--once', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Order.objects.get(id=order.id).cook_in, self.far_restaurant)
+
+
+class SolveAssignmentTest(SimpleTestCase):
+    def test_moves_order_to_free_nearest_restaurant(self):
+        costs = np.array([[1, 2], [1, 10]], dtype=float)
+        self.assertEqual(solve_assignment(costs, [1, 1]).tolist(), [1, 0])
+
+    def test_matches_brute_force(self):
+        rand = random.Random(0)
+        for _ in range(100):
+            orders_count, restaurants_count = rand.randint(1, 5), rand.randint(1, 3)
+            costs = np.array([
+                [rand.choice([np.inf, rand.uniform(0, 10)]) for _ in range(restaurants_count)]
+                for _ in range(orders_count)
+            ])
+            capacities = [rand.randint(0, 2) for _ in range(restaurants_count)]
+
+            best = None
+            for columns in itertools.product(range(UNASSIGNED, restaurants_count), repeat=orders_count):
+                if any(columns.count(column) > capacity for column, capacity in enumerate(capacities)):
+                    continue
+                assigned_costs = [costs[row, column] for row, column in enumerate(columns) if column != UNASSIGNED]
+                if np.isinf(assigned_costs).any():
+                    continue
+                score = (len(assigned_costs), -sum(assigned_costs))
+                best = score if best is None or score > best else best
+
+            assignment = solve_assignment(costs, capacities)
+            assigned_costs = [costs[row, column] for row, column in enumerate(assignment) if column != UNASSIGNED]
+            self.assertEqual(len(assigned_costs), best[0])
+            self.assertAlmostEqual(sum(assigned_costs), -best[1])
+
+
+class RestaurantLoadTest(TestCase):
+    def setUp(self):
+        Restaurant.objects.bulk_create([
+            Restaurant(name='Первый', geocode_status=Restaurant.MANUAL),
+            Restaurant(name='Второй', geocode_status=Restaurant.MANUAL),
+        ])
+        self.first_restaurant, self.second_restaurant = Restaurant.objects.order_by('id')
+        self.order = Order.objects.create(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79123456789',
+            address='Ленина, 5',
+            payment_method=Order.CASH,
+        )
+
+    def test_counters_follow_order_changes(self):
+        self.order.cook_in = self.first_restaurant
+        self.order.status = Order.DURING
+        self.order.save()
+        self.assertEqual(get_restaurant_load(self.first_restaurant.id), 1)
+
+        self.order.cook_in = self.second_restaurant
+        self.order.save()
+        self.assertEqual(get_restaurants_load(), {self.first_restaurant.id: 0, self.second_restaurant.id: 1})
+
+        self.order.status = Order.PROCESSED
+        self.order.save()
+        self.assertEqual(get_restaurant_load(self.second_restaurant.id), 0)
+
+    def test_bulk_assignment_and_delete(self):
+        self.assertEqual(assign_restaurants({self.first_restaurant.id: [self.order.id]}, Order.DISPATCH_MANUAL), 1)
+        self.assertEqual(get_restaurant_load(self.first_restaurant.id), 1)
+        Order.objects.all().delete()
+        self.assertEqual(get_restaurant_load(self.first_restaurant.id), 0)
+
+    def test_save_of_other_fields_keeps_counters(self):
+        self.order.cook_in = self.first_restaurant
+        self.order.status = Order.DURING
+        self.order.comment = 'Без лука'
+        self.order.save(update_fields=['comment'])
+        self.assertEqual(get_restaurants_load(), {})
+
+        self.order.save(update_fields=['status', 'cook_in'])
+        self.assertEqual(get_restaurant_load(self.first_restaurant.id), 1)
+
+    def test_delete_of_stale_order(self):
+        assign_restaurants({self.first_restaurant.id: [self.order.id]}, Order.DISPATCH_MANUAL)
+        self.assertEqual(self.order.status, Order.RAW)
+        self.order.delete()
+        self.assertEqual(get_restaurant_load(self.first_restaurant.id), 0)
+
+    def test_reconcile(self):
+        Order.objects.filter(id=self.order.id).update(cook_in=self.first_restaurant, status=Order.DURING)
+        RestaurantLoad.objects.create(restaurant=self.second_restaurant, active_orders=3)
+        self.assertEqual(
+            reconcile_restaurants_load(),
+            {self.first_restaurant.id: (None, 1), self.second_restaurant.id: (3, 0)},
+        )
+        self.assertEqual(get_restaurants_load(), {self.first_restaurant.id: 1, self.second_restaurant.id: 0})
+        self.assertEqual(reconcile_restaurants_load(), {})
+
+
+class OrderAdminActionsTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('manager', password='manager'))
+        Restaurant.objects.bulk_create([
+            Restaurant(name='Бургерная', geocode_status=Restaurant.MANUAL),
+            Restaurant(name='Шаурмичная', geocode_status=Restaurant.MANUAL),
+        ])
+        self.burger_restaurant, self.shawarma_restaurant = Restaurant.objects.order_by('id')
+        Product.objects.bulk_create([
+            Product(name='Бургер', price=100, image='burger.jpg'),
+            Product(name='Шаурма', price=100, image='shawarma.jpg'),
+        ])
+        burger, shawarma = Product.objects.order_by('id')
+        RestaurantMenuItem.objects.bulk_create([
+            RestaurantMenuItem(restaurant=self.burger_restaurant, product=burger),
+            RestaurantMenuItem(restaurant=self.shawarma_restaurant, product=shawarma),
+        ])
+        capability_index.rebuild()
+        self.orders = []
+        for product in [burger, burger]:
+            order = Order.objects.create(
+                firstname='Иван',
+                lastname='Петров',
+                phonenumber='+79123456789',
+                address='Ленина, 5',
+                payment_method=Order.CASH,
+            )
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=100)
+            self.orders.append(order)
+
+    def run_action(self, action, follow=False, **data):
+        return self.client.post('/admin/foodcartapp/order/', {
+            'action': action,
+            '_selected_action': [order.id for order in self.orders],
+            **data,
+        }, follow=follow)
+
+    def get_states(self):
+        return list(Order.objects.order_by('id').values_list('status', 'cook_in_id'))
+
+    def test_assign_restaurant(self):
+        self.run_action('assign_restaurant', restaurant=self.shawarma_restaurant.id)
+        self.assertEqual(self.get_states(), [(Order.RAW, None)] * 2)
+
+        self.run_action('assign_restaurant', restaurant=self.burger_restaurant.id)
+        self.assertEqual(self.get_states(), [(Order.DURING, self.burger_restaurant.id)] * 2)
+        self.assertEqual(get_restaurant_load(self.burger_restaurant.id), 2)
+
+    def test_mark_processed_and_reset(self):
+        self.run_action('assign_restaurant', restaurant=self.burger_restaurant.id)
+        self.run_action('mark_processed')
+        self.assertEqual(self.get_states(), [(Order.PROCESSED, self.burger_restaurant.id)] * 2)
+        self.assertEqual(get_restaurant_load(self.burger_restaurant.id), 0)
+
+        self.run_action('reset_to_raw')
+        self.assertEqual(self.get_states(), [(Order.RAW, None)] * 2)
+        self.assertEqual(reconcile_restaurants_load(), {})
+
+    def test_optimal_assignment_applies_shown_plan(self):
+        Restaurant.objects.update(lat=56.01, lng=92.85)
+        restaurant_locations.invalidate()
+        geocoding_cache.clear()
+        geocoding_cache.store('Ленина, 5', 56.011, 92.851)
+        response = self.run_action('assign_optimal_restaurants')
+        pairs = [f'{order.id}:{self.burger_restaurant.id}' for order in self.orders]
+        for pair in pairs:
+            self.assertContains(response, f'name="assignment" value="{pair}"')
+
+        # a manager takes the first order while the plan is on the screen
+        Order.objects.filter(id=self.orders[0].id).update(cook_in=self.shawarma_restaurant, status=Order.DURING)
+        response = self.run_action('assign_optimal_restaurants', apply='yes', assignment=pairs, follow=True)
+        self.assertEqual(self.get_states(), [
+            (Order.DURING, self.shawarma_restaurant.id),
+            (Order.DURING, self.burger_restaurant.id),
+        ])
+        self.assertContains(response, f'Не назначены заказы {self.orders[0].id}: уже обработаны')
+
+    @override_settings(RESTAURANT_MAX_ACTIVE_ORDERS=1)
+    def test_optimal_assignment_rejects_unsuitable_and_overloaded(self):
+        pairs = [
+            f'{self.orders[0].id}:{self.shawarma_restaurant.id}',
+            f'{self.orders[1].id}:{self.burger_restaurant.id}',
+        ]
+        extra_order = Order.objects.create(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79123456789',
+            address='Ленина, 5',
+            payment_method=Order.CASH,
+            status=Order.DURING,
+            cook_in=self.burger_restaurant,
+        )
+        self.run_action('assign_optimal_restaurants', apply='yes', assignment=[*pairs, f'{extra_order.id}:1'])
+        self.assertEqual(self.get_states()[:2], [(Order.RAW, None), (Order.RAW, None)])
+        self.assertEqual(get_restaurant_load(self.burger_restaurant.id), 1)
+
+
+@override_settings(ORDERS_BATCH_THROTTLE_RATE='1000/min')
+class RegisterOrdersBatchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        restaurant = Restaurant.objects.create(name='Бургерная', geocode_status=Restaurant.MANUAL)
+        self.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        RestaurantMenuItem.objects.create(restaurant=restaurant, product=self.burger)
+        partner = User.objects.create_user('partner')
+        partner.user_permissions.add(Permission.objects.get(codename='add_order'))
+        self.token = Token.objects.create(user=partner)
+
+    def make_order(self, **fields):
+        return {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79123456789',
+            'address': 'Ленина, 5',
+            'products': [{'product': self.burger.id, 'quantity': 2}],
+            **fields,
+        }
+
+    def post(self, body, content_type='application/json', token=None):
+        token = token or self.token
+        return self.client.post(
+            '/api/orders/batch/',
+            body,
+            content_type=content_type,
+            HTTP_AUTHORIZATION=f'Token {token.key}',
+        )
+
+    def test_json_batch(self):
+        response = self.post(json.dumps([self.make_order(), self.make_order(firstname='')]))
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get()
+        self.assertEqual(response.json()['created'], [{'index': 0, 'id': order.id}])
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1])
+        self.assertEqual(list(order.items.values_list('product', 'quantity', 'price')), [(self.burger.id, 2, 100)])
+
+    def test_ndjson_batch(self):
+        body = '\n'.join(json.dumps(self.make_order()) for _ in range(3))
+        response = self.post(body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['created']), 3)
+        self.assertEqual(OrderItem.objects.count(), 3)
+
+        response = self.post('{"firstname": "Иван"}\n{', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('line 2', response.json()['detail'])
+
+    def test_batch_errors(self):
+        response = self.post('[]')
+        self.assertEqual(response.json(), {'non_field_errors': ['Список заказов пуст.']})
+        response = self.post('{}')
+        self.assertEqual(response.json(), {'non_field_errors': ['Ожидается список заказов.']})
+
+        bad_products = [3.7, True, '3.0', None, self.burger.id + 1]
+        response = self.post(json.dumps([
+            self.make_order(products=[{'product': bad_product, 'quantity': 1}])
+            for bad_product in [self.burger.id + 0.5, *bad_products]
+        ]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), len(bad_products) + 1)
+        self.assertFalse(Order.objects.exists())
+
+    def test_partner_token_is_required(self):
+        response = self.client.post('/api/orders/batch/', '[]', content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+        stranger = User.objects.create_user('stranger')
+        response = self.post(json.dumps([self.make_order()]), token=Token.objects.create(user=stranger))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Order.objects.exists())
+
+    @override_settings(ORDERS_BATCH_THROTTLE_RATE='2/min')
+    def test_batches_are_throttled(self):
+        statuses = [self.post(json.dumps([self.make_order()])).status_code for _ in range(3)]
+        self.assertEqual(statuses, [201, 201, 429])
+
+    @unittest.skipUnless(connection.features.can_return_rows_from_bulk_insert, 'ids are not returned by bulk insert')
+    def test_orders_are_inserted_at_once(self):
+        body = json.dumps([self.make_order() for _ in range(10)])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(body)
+        self.assertEqual(response.status_code, 201)
+        order_inserts = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith(f'INSERT INTO "{Order._meta.db_table}"')
+        ]
+        self.assertEqual(len(order_inserts), 1)
+
+
+class PublishedApiTest(TestCase):
+    def setUp(self):
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        settings_override = override_settings(STATIC_ROOT=static_root.name, PUBLISHED_API_MODE='stream')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        # bulk_create, so no catalog change is pending before the test
+        Restaurant.objects.bulk_create([
+            Restaurant(name=name, geocode_status=Restaurant.MANUAL) for name in ['Первый', 'Второй', 'Третий']
+        ])
+        self.restaurants = list(Restaurant.objects.order_by('id'))
+        Product.objects.bulk_create([Product(name='Бургер', price=100, image='burger.jpg')])
+        self.burger = Product.objects.get()
+        self.catalog_changes = []
+        catalog_changed.connect(self.count_catalog_change)
+        self.addCleanup(catalog_changed.disconnect, self.count_catalog_change)
+
+    def count_catalog_change(self, **kwargs):
+        self.catalog_changes.append(kwargs)
+
+    def test_catalog_is_published_once_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for restaurant in self.restaurants:
+                    RestaurantMenuItem.objects.create(restaurant=restaurant, product=self.burger)
+        self.assertEqual(len(self.catalog_changes), 1)
+        self.assertTrue(os.path.exists(os.path.join(get_published_root(), 'manifest.json')))
+
+    def test_encodings_have_own_etags(self):
+        publish_api()
+        etags = {}
+        for encoding in ['br', 'gzip', '']:
+            response = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING=encoding)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get('Content-Encoding'), encoding or None)
+            etags[encoding] = response['ETag']
+        self.assertEqual(len(set(etags.values())), 3)
+
+        response = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etags['gzip'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etags['br'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_files_are_replaced_atomically(self):
+        published_root = get_published_root()
+        os.makedirs(published_root)
+        path = os.path.join(published_root, 'products.json')
+        write_file(path, b'[]')
+        write_file(path, b'[1]')
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), b'[1]')
+        self.assertEqual(os.listdir(published_root), ['products.json'])
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+
+
+class CatalogSnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        restaurant = Restaurant.objects.create(name='Бургерная', geocode_status=Restaurant.MANUAL)
+        burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        RestaurantMenuItem.objects.create(restaurant=restaurant, product=burger)
+
+    def test_old_snapshot_is_deleted_on_invalidation(self):
+        snapshot = get_catalog_snapshot()
+        old_key = get_catalog_snapshot_key(get_catalog_version())
+        self.assertEqual(cache.get(old_key), snapshot)
+
+        invalidate_catalog()
+        self.assertIsNone(cache.get(old_key))
+        self.assertEqual(get_catalog_snapshot()['body'], snapshot['body'])
+
+    def test_available_products_follow_menu_changes(self):
+        reset_available_products()
+        burger = Product.objects.get()
+        shawarma = Product.objects.create(name='Шаурма', price=100, image='shawarma.jpg')
+        self.assertEqual(list(get_available_products([burger.id, shawarma.id, 0])), [burger.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(list(get_available_products([burger.id])), [burger.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.create(restaurant=Restaurant.objects.get(), product=shawarma)
+        self.assertEqual(sorted(get_available_products([burger.id, shawarma.id])), [burger.id, shawarma.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.filter(product=burger).update(availability=False)
+        self.assertEqual(list(get_available_products([burger.id, shawarma.id])), [shawarma.id])
+
+    def test_products_api_supports_head_and_conditional_get(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+
+        head_response = self.client.head('/api/products/')
+        self.assertEqual(head_response.status_code, 200)
+        self.assertEqual(head_response['ETag'], response['ETag'])
+        self.assertEqual(head_response.content, b'')
+
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.post('/api/products/').status_code, 405)
+
+
+class RegisterOrderTest(TestCase):
+    def setUp(self):
+        restaurant = Restaurant.objects.create(name='Бургерная', geocode_status=Restaurant.MANUAL)
+        Product.objects.bulk_create([
+            Product(name=f'Товар {number}', price=100 + number, image='product.jpg')
+            for number in range(6)
+        ])
+        *self.products, self.unavailable_product = Product.objects.order_by('id')
+        RestaurantMenuItem.objects.bulk_create([
+            RestaurantMenuItem(restaurant=restaurant, product=product, availability=product in self.products)
+            for product in [*self.products, self.unavailable_product]
+        ])
+        invalidate_catalog()
+
+    def post(self, products):
+        return self.client.post('/api/order/', json.dumps({
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79123456789',
+            'address': 'Ленина, 5',
+            'products': [{'product': product.id, 'quantity': 2} for product in products],
+        }), content_type='application/json')
+
+    def test_unavailable_product_is_rejected(self):
+        response = self.post([self.products[0], self.unavailable_product])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('products', response.json())
+        self.assertFalse(Order.objects.exists())
+
+    def test_queries_do_not_depend_on_cart_size(self):
+        self.assertEqual(self.post(self.products[:1]).status_code, 200)
+        with CaptureQueriesContext(connection) as one_item_queries:
+            self.assertEqual(self.post(self.products[:1]).status_code, 200)
+        with CaptureQueriesContext(connection) as many_items_queries:
+            self.assertEqual(self.post(self.products).status_code, 200)
+        self.assertEqual(len(many_items_queries), len(one_item_queries))
+        self.assertEqual(Order.objects.last().items.count(), len(self.products))
+
+
+class MetricsAccessTest(TestCase):
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_need_token_or_staff(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+        self.client.force_login(User.objects.create_user('manager', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_empty_token_is_not_accepted(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        restaurant = Restaurant.objects.create(name='Бургерная', geocode_status=Restaurant.MANUAL)
+        burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        RestaurantMenuItem.objects.create(restaurant=restaurant, product=burger)
+        self.client.force_login(User.objects.create_superuser('manager', password='manager'))
+
+    def assertRequestCounted(self, url, view):
+        requests_count = REQUESTS.get(view=view, status=200)
+        sql_observations, sql_queries = REQUEST_SQL_QUERIES.get(view=view)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertGreater(len(context), 0)
+        self.assertEqual(REQUESTS.get(view=view, status=200), requests_count + 1)
+        self.assertEqual(REQUEST_SQL_QUERIES.get(view=view), (sql_observations + 1, sql_queries + len(context)))
+
+    def test_sync_view(self):
+        self.assertRequestCounted(reverse('restaurateur:ProductsView'), 'restaurateur:ProductsView')
+
+    def test_async_view(self):
+        invalidate_catalog()
+        self.assertRequestCounted('/api/products/', 'foodcartapp:foodcartapp.views.product_list_api')
+
+
+class OrderCostTest(TestCase):
+    def setUp(self):
+        Product.objects.bulk_create([
+            Product(name='Бургер', price=100, image='burger.jpg'),
+            Product(name='Шаурма', price=150, image='shawarma.jpg'),
+        ])
+        self.burger, self.shawarma = Product.objects.order_by('id')
+        self.order = Order.objects.create(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79123456789',
+            address='Ленина, 5',
+            payment_method=Order.CASH,
+        )
+        self.burger_item = OrderItem.objects.create(order=self.order, product=self.burger, quantity=2, price=100)
+        self.shawarma_item = OrderItem.objects.create(order=self.order, product=self.shawarma, quantity=1, price=150)
+        self.empty_order = Order.objects.create(
+            firstname='Пётр',
+            lastname='Иванов',
+            phonenumber='+79123456780',
+            address='Мира, 10',
+            payment_method=Order.CASH,
+            cost=50,
+        )
+
+    def get_costs(self):
+        return list(Order.objects.order_by('id').values_list('cost', flat=True))
+
+    def test_recalculate_cost(self):
+        self.assertEqual(Order.objects.recalculate_cost(), 2)
+        self.assertEqual(self.get_costs(), [Decimal('350'), Decimal('0')])
+
+    def test_migration_fills_cost_of_existing_orders(self):
+        migration = import_module('foodcartapp.migrations.0073_fill_order_cost')
+        migration.fill_orders_cost(apps, None)
+        self.assertEqual(self.get_costs(), [Decimal('350'), Decimal('0')])
+
+    def test_inline_edits_update_cost(self):
+        self.client.force_login(User.objects.create_superuser('manager', password='manager'))
+        response = self.client.post(f'/admin/foodcartapp/order/{self.order.id}/change/', {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79123456789',
+            'address': 'Ленина, 5',
+            'status': Order.RAW,
+            'payment_method': Order.CASH,
+            'comment': '',
+            'call_date_0': '',
+            'call_date_1': '',
+            'delivery_date_0': '',
+            'delivery_date_1': '',
+            'cook_in': '',
+            'items-TOTAL_FORMS': '2',
+            'items-INITIAL_FORMS': '2',
+            'items-MIN_NUM_FORMS': '0',
+            'items-MAX_NUM_FORMS': '1000',
+            'items-0-id': self.burger_item.id,
+            'items-0-order': self.order.id,
+            'items-0-product': self.burger.id,
+            'items-0-quantity': '3',
+            'items-0-price': '100',
+            'items-1-id': self.shawarma_item.id,
+            'items-1-order': self.order.id,
+            'items-1-product': self.shawarma.id,
+            'items-1-quantity': '1',
+            'items-1-price': '150',
+            'items-1-DELETE': 'on',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.cost, Decimal('300'))
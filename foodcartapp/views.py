@@ -1,67 +1,121 @@
-from django.db import transaction
-from django.http import JsonResponse
-from django.templatetags.static import static
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from phonenumber_field.serializerfields import PhoneNumberField
-from rest_framework.decorators import api_view
+from rest_framework import status
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.decorators import (
+    api_view,
+    authentication_classes,
+    parser_classes,
+    permission_classes,
+    throttle_classes,
+)
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.permissions import BasePermission
 from rest_framework.response import Response
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import ModelSerializer, PrimaryKeyRelatedField
+from rest_framework.throttling import UserRateThrottle
 
-from .models import Product
+from place.queue import enqueue_geocoding_on_commit
+
+from .catalog import dump_banners, get_available_products, get_catalog_snapshot
+from .events import record_order_events
 from .models import Order
+from .models import Product
 from .models import OrderItem
+from .publishing import get_published_response
 
 
-def banners_list_api(request):
-    # FIXME move data to db?
-    return JsonResponse([
-        {
-            'title': 'Burger',
-            'src': static('burger.jpg'),
-            'text': 'Tasty Burger at your door step',
-        },
-        {
-            'title': 'Spices',
-            'src': static('food.jpg'),
-            'text': 'All Cuisines',
-        },
-        {
-            'title': 'New York',
-            'src': static('tasty.jpg'),
-            'text': 'Food is incomplete without a tasty dessert',
-        }
-    ], safe=False, json_dumps_params={
+# Django 3.2 has no async ORM and its view decorators are sync only,
+# so the async views check the method themselves and cross into sync code once per request
+async def banners_list_api(request):
+    published_response = await sync_to_async(get_published_response, thread_sensitive=False)(request, 'banners')
+    if published_response:
+        return published_response
+    return JsonResponse(dump_banners(), safe=False, json_dumps_params={
         'ensure_ascii': False,
         'indent': 4,
     })
 
 
-@api_view(['GET'])
-def product_list_api(request):
-    products = Product.objects.select_related('category').available()
-
-    dumped_products = []
-    for product in products:
-        dumped_product = {
-            'id': product.id,
-            'name': product.name,
-            'price': product.price,
-            'special_status': product.special_status,
-            'description': product.description,
-            'category': {
-                'id': product.category.id,
-                'name': product.category.name,
-            } if product.category else None,
-            'image': product.image.url,
-            'restaurant': {
-                'id': product.id,
-                'name': product.name,
-            }
-        }
-        dumped_products.append(dumped_product)
-    return Response(dumped_products)
+def catalog_snapshot_response(request, snapshot):
+    etag = quote_etag(snapshot['etag'])
+    last_modified = int(snapshot['last_modified'].timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(snapshot['body'], content_type='application/json')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+async def product_list_api(request):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    published_response = await sync_to_async(get_published_response, thread_sensitive=False)(request, 'products')
+    if published_response:
+        return published_response
+    snapshot = await sync_to_async(get_catalog_snapshot)()
+    return catalog_snapshot_response(request, snapshot)
+
+
+MAX_ORDERS_BATCH_SIZE = 1000
+
+
+class NDJSONParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        records = []
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as error:
+                raise ParseError(f'NDJSON parse error on line {line_number} - {error}')
+        return records
+
+
+def parse_product_id(value):
+    # 3.7 or true must not turn into product 3 or 1
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+class PreloadedProductField(PrimaryKeyRelatedField):
+    default_error_messages = {
+        'does_not_exist': 'Товар "{pk_value}" не найден или сейчас не продаётся.',
+    }
+
+    def to_internal_value(self, data):
+        products = self.context.get('products')
+        if products is None:
+            return super().to_internal_value(data)
+        product_id = parse_product_id(data)
+        if product_id is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        product = products.get(product_id)
+        if product is None:
+            self.fail('does_not_exist', pk_value=data)
+        return product
 
 
 class ProductsSerializer(ModelSerializer):
+    product = PreloadedProductField(queryset=Product.objects.available())
+
     class Meta:
         model = OrderItem
         fields = ['product', 'quantity']
@@ -77,28 +131,141 @@ class OrderSerializer(ModelSerializer):
         # TODO: добавить нормализацию, если номер начинается на 8
 
 
-@api_view(['POST'])
-def register_order_api(request):
-    serializer = OrderSerializer(data=request.data)
-    serializer.is_valid(raise_exception=True)
+def get_ordered_products(records):
+    products_ids = set()
+    for record in records:
+        if not isinstance(record, dict) or not isinstance(record.get('products'), list):
+            continue
+        for item in record['products']:
+            if not isinstance(item, dict):
+                continue
+            product_id = parse_product_id(item.get('product'))
+            if product_id is not None:
+                products_ids.add(product_id)
+    return get_available_products(products_ids)
 
-    with transaction.atomic():
-        order = Order.objects.create(
-            firstname=serializer.validated_data['firstname'],
-            lastname=serializer.validated_data['lastname'],
-            phonenumber=serializer.validated_data['phonenumber'],
-            address=serializer.validated_data['address'],
-        )
-        products = serializer.validated_data['products']
-        OrderItem.objects.bulk_create(
-            [OrderItem(
-                product=product['product'],
-                quantity=product['quantity'],
-                price=product['product'].price,
-                order=order
-            ) for product in products]
+
+def build_order(validated_data):
+    products = validated_data['products']
+    order = Order(
+        firstname=validated_data['firstname'],
+        lastname=validated_data['lastname'],
+        phonenumber=validated_data['phonenumber'],
+        address=validated_data['address'],
+        cost=sum(product['product'].price * product['quantity'] for product in products),
+    )
+    items = [
+        OrderItem(
+            product=product['product'],
+            quantity=product['quantity'],
+            price=product['product'].price,
+        ) for product in products
+    ]
+    return order, items
+
+
+def save_orders(orders_with_items):
+    orders = [order for order, _ in orders_with_items]
+    if connection.features.can_return_rows_from_bulk_insert:
+        Order.objects.bulk_create(orders)
+    else:
+        for order in orders:
+            order.save()
+
+    all_items = []
+    for order, items in orders_with_items:
+        for item in items:
+            item.order = order
+        all_items.extend(items)
+    OrderItem.objects.bulk_create(all_items)
+    enqueue_geocoding_on_commit([order.address for order in orders])
+    record_order_events([order.id for order in orders])
+
+
+def create_order(payload):
+    serializer = OrderSerializer(
+        data=payload,
+        context={'products': get_ordered_products([payload])},
+    )
+    if not serializer.is_valid():
+        return JsonResponse(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST,
+            json_dumps_params={'ensure_ascii': False},
         )
 
+    order, items = build_order(serializer.validated_data)
+    with transaction.atomic():
+        save_orders([(order, items)])
 
     serializer = OrderSerializer(order)
-    return Response(serializer.data)
+    return JsonResponse(serializer.data, json_dumps_params={'ensure_ascii': False})
+
+
+async def register_order_api(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        payload = json.loads(request.body)
+    except ValueError as error:
+        return JsonResponse({'detail': f'JSON parse error - {error}'}, status=status.HTTP_400_BAD_REQUEST)
+    return await sync_to_async(create_order)(payload)
+
+
+# the API is used by the storefront without a CSRF token, as it was with DRF views
+register_order_api.csrf_exempt = True
+
+
+class IsOrdersPartner(BasePermission):
+    message = 'Нужен токен партнёра с правом добавлять заказы.'
+
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.has_perm('foodcartapp.add_order')
+
+
+class OrdersBatchThrottle(UserRateThrottle):
+    scope = 'orders_batch'
+
+    def get_rate(self):
+        return settings.ORDERS_BATCH_THROTTLE_RATE
+
+
+@api_view(['POST'])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsOrdersPartner])
+@throttle_classes([OrdersBatchThrottle])
+@parser_classes([JSONParser, NDJSONParser])
+def register_orders_batch_api(request):
+    records = request.data
+    if not isinstance(records, list):
+        raise ValidationError({'non_field_errors': ['Ожидается список заказов.']})
+    if not records:
+        raise ValidationError({'non_field_errors': ['Список заказов пуст.']})
+    if len(records) > MAX_ORDERS_BATCH_SIZE:
+        raise ValidationError({'non_field_errors': [f'Не больше {MAX_ORDERS_BATCH_SIZE} заказов за раз.']})
+
+    context = {'products': get_ordered_products(records)}
+    orders_with_items = []
+    created_indexes = []
+    errors = []
+    for index, record in enumerate(records):
+        serializer = OrderSerializer(data=record, context=context)
+        if not serializer.is_valid():
+            errors.append({'index': index, 'errors': serializer.errors})
+            continue
+        orders_with_items.append(build_order(serializer.validated_data))
+        created_indexes.append(index)
+
+    with transaction.atomic():
+        save_orders(orders_with_items)
+
+    return Response(
+        {
+            'created': [
+                {'index': index, 'id': order.id}
+                for index, (order, _) in zip(created_indexes, orders_with_items)
+            ],
+            'errors': errors,
+        },
+        status=status.HTTP_201_CREATED if orders_with_items else status.HTTP_400_BAD_REQUEST,
+    )
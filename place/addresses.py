@@ -0,0 +1,109 @@
+import re
+
+
+WORD_PATTERN = re.compile(r'\w+')
+HYPHENATED_ABBREVIATIONS = {
+    'пр-т': 'проспект',
+    'пр-кт': 'проспект',
+    'б-р': 'бульвар',
+    'р-н': 'район',
+    'мкр-н': 'микрорайон',
+}
+HYPHENATED_PATTERN = re.compile(
+    r'(?<!\w)(' + '|'.join(re.escape(abbreviation) for abbreviation in HYPHENATED_ABBREVIATIONS) + r')(?!\w)'
+)
+ABBREVIATIONS = {
+    'ул': 'улица',
+    'пр': 'проспект',
+    'просп': 'проспект',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'бул': 'бульвар',
+    'ш': 'шоссе',
+    'наб': 'набережная',
+    'мкр': 'микрорайон',
+    'мкрн': 'микрорайон',
+    'пос': 'поселок',
+    'обл': 'область',
+    'кв': 'квартира',
+    'корп': 'корпус',
+    'стр': 'строение',
+    'г': 'город',
+    'д': 'дом',
+}
+# "Ленина, 5" means the same as "ул. Ленина, д. 5", so these words do not get into the key
+OMITTED_WORDS = {'улица', 'дом', 'город'}
+# "проспект Ленина" and "переулок Ленина" are different streets, unlike "улица Ленина" and "Ленина"
+STREET_TYPES = {
+    'проспект', 'переулок', 'площадь', 'бульвар', 'шоссе', 'набережная', 'микрорайон', 'проезд', 'тупик', 'аллея',
+}
+# a letter apart from the number, as in "7 а" or "7-а", is a house letter, not an abbreviation
+HOUSE_LETTER_SEPARATOR = re.compile(r'[\s-]*')
+
+
+def get_address_tokens(address):
+    """Canonical words of an address: case folded, ё replaced, abbreviations expanded.
+
+    A house letter written apart, as in "7 а" or "7-а", is joined to the
+    number first, so "5 г" stays a house and is not taken for "город".
+    One-letter abbreviations are expanded only before a name or a number.
+    """
+    address = address.casefold().replace('ё', 'е')
+    address = HYPHENATED_PATTERN.sub(lambda match: HYPHENATED_ABBREVIATIONS[match.group(1)], address)
+    words = []
+    previous_end = 0
+    for match in WORD_PATTERN.finditer(address):
+        word = match.group()
+        separator = address[previous_end:match.start()]
+        previous_end = match.end()
+        if len(word) == 1 and word.isalpha() and words and words[-1].isdigit() \
+                and HOUSE_LETTER_SEPARATOR.fullmatch(separator):
+            words[-1] += word
+            continue
+        words.append(word)
+
+    tokens = []
+    for position, word in enumerate(words):
+        is_last = position == len(words) - 1
+        if not (len(word) == 1 and is_last):
+            word = ABBREVIATIONS.get(word, word)
+        if word in OMITTED_WORDS:
+            continue
+        tokens.append(word)
+    return tokens
+
+
+def normalize_address(address):
+    """Key of an address: equal for spellings that differ in case, punctuation or abbreviations."""
+    return ' '.join(get_address_tokens(address))
+
+
+def merge_duplicate_places(place_model):
+    """Recalculate keys of all places and leave one place per key.
+
+    The place kept is the one with coordinates and the latest request date.
+    Takes the model as an argument, so migrations can pass the historical one.
+    """
+    places_by_key = {}
+    for place in place_model.objects.order_by('id').iterator():
+        places_by_key.setdefault(normalize_address(place.address), []).append(place)
+
+    duplicates_ids = []
+    changed_places = []
+    for key, places in places_by_key.items():
+        places.sort(
+            key=lambda place: (place.lat is not None and place.lng is not None, place.request_date is None,
+                               place.request_date or 0),
+            reverse=True,
+        )
+        kept_place, *duplicates = places
+        duplicates_ids.extend(place.id for place in duplicates)
+        if kept_place.normalized_address != key:
+            kept_place.normalized_address = key
+            changed_places.append(kept_place)
+
+    place_model.objects.filter(id__in=duplicates_ids).delete()
+    # keys are cleared first, so that swapping keys between two places does not hit the unique index
+    place_model.objects.filter(id__in=[place.id for place in changed_places]).update(normalized_address=None)
+    place_model.objects.bulk_update(changed_places, ['normalized_address'], batch_size=500)
+    return len(duplicates_ids)
@@ -1,13 +1,29 @@
 from django.contrib import admin
 
-from place.models import Place
+from place.models import GeocodingTask, Place
 
 
 @admin.register(Place)
 class PlaceAdmin(admin.ModelAdmin):
     fields = [
         'address',
+        'normalized_address',
         'lng',
         'lat',
         'request_date',
     ]
+    readonly_fields = [
+        'normalized_address',
+    ]
+
+
+@admin.register(GeocodingTask)
+class GeocodingTaskAdmin(admin.ModelAdmin):
+    list_display = [
+        'address',
+        'attempts',
+        'next_attempt_at',
+    ]
+    readonly_fields = [
+        'last_error',
+    ]
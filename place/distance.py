@@ -0,0 +1,52 @@
+import numpy as np
+from geopy import distance
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_coordinates_array(coordinates):
+    # rows are (lat, lng), unknown coordinates become NaN
+    return np.array(
+        [[np.nan, np.nan] if None in point else point for point in coordinates],
+        dtype=float,
+    ).reshape(-1, 2)
+
+
+def get_haversine_matrix(origins, destinations):
+    origins = np.radians(origins)
+    destinations = np.radians(destinations)
+    origins_lat = origins[:, 0, np.newaxis]
+    origins_lng = origins[:, 1, np.newaxis]
+    destinations_lat = destinations[np.newaxis, :, 0]
+    destinations_lng = destinations[np.newaxis, :, 1]
+
+    haversine = (
+        np.sin((destinations_lat - origins_lat) / 2) ** 2
+        + np.cos(origins_lat) * np.cos(destinations_lat) * np.sin((destinations_lng - origins_lng) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(haversine, 0, 1)))
+
+
+def get_geodesic_matrix(origins, destinations):
+    matrix = np.full((len(origins), len(destinations)), np.nan)
+    known_origins = np.flatnonzero(~np.isnan(origins).any(axis=1))
+    known_destinations = np.flatnonzero(~np.isnan(destinations).any(axis=1))
+    for row in known_origins:
+        for column in known_destinations:
+            matrix[row, column] = distance.distance(origins[row], destinations[column]).km
+    return matrix
+
+
+def get_distance_matrix(origins, destinations, precise=False):
+    """Distances in km from every origin to every destination.
+
+    Points are (lat, lng) pairs, a pair with None gives NaN distances.
+    Haversine is used by default, precise=True switches to geodesic
+    distance, which is exact but computed pair by pair.
+    """
+    origins = to_coordinates_array(origins)
+    destinations = to_coordinates_array(destinations)
+    if precise:
+        return get_geodesic_matrix(origins, destinations)
+    return get_haversine_matrix(origins, destinations)
@@ -0,0 +1,127 @@
+import csv
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from place.addresses import STREET_TYPES, get_address_tokens
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SBGZ'
+VERSION = 3
+# 16 bytes, so the columns after the header stay aligned and numpy searches them in place
+HEADER = struct.Struct('<4sIQ')
+RELOAD_CHECK_INTERVAL = 10
+MIN_KEY_TOKENS = 2
+
+
+def get_key_hash(tokens):
+    return int.from_bytes(hashlib.blake2b(' '.join(tokens).encode(), digest_size=8).digest(), 'little')
+
+
+def read_gazetteer_csv(file):
+    """Yield normalized tokens and coordinates of rows with street, house, lat and lng columns."""
+    for row in csv.DictReader(file):
+        tokens = get_address_tokens(f'{row["street"]} {row["house"]}')
+        if tokens:
+            yield tokens, float(row['lat']), float(row['lng'])
+
+
+def write_gazetteer(records, path):
+    """Save records as an index file: a header and three columns sorted by the key hash.
+
+    The file is read through mmap, so a worker that opens it does not parse
+    anything and only touches the pages the binary search lands on.
+    """
+    hashes = {}
+    for tokens, lat, lng in records:
+        hashes.setdefault(get_key_hash(tokens), (lat, lng))
+    keys = np.array(sorted(hashes), dtype='<u8')
+    coordinates = np.array([hashes[key] for key in keys.tolist()], dtype='<f8').reshape(-1, 2)
+
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(keys)))
+        file.write(keys.tobytes())
+        file.write(np.ascontiguousarray(coordinates[:, 0]).tobytes())
+        file.write(np.ascontiguousarray(coordinates[:, 1]).tobytes())
+    os.replace(temporary_path, path)
+    return len(keys)
+
+
+class Gazetteer:
+    """Offline resolver of addresses of one city from an index file built by build_gazetteer.
+
+    An address is looked up by its normalized words, then without the first
+    word, and so on, so a city name or a region in front of the street does not
+    prevent a match. A street type is never dropped, so "пр. Ленина 5" does not
+    match "ул. Ленина 5". The file is reopened when it is replaced.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = None
+        self._mtime = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._index = self._mtime = None
+            return None
+        if mtime == self._mtime:
+            return self._index
+
+        with open(self.path, 'rb') as file:
+            magic, version, count = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            # an index built with other normalization rules would silently miss, so it is not used at all
+            logger.warning(
+                '%s is not a gazetteer index of version %s, rebuild it with build_gazetteer',
+                self.path,
+                VERSION,
+            )
+            count = 0
+        if count:
+            columns = np.memmap(self.path, dtype='<u8', mode='r', offset=HEADER.size, shape=(3, count))
+            self._index = (columns[0], columns[1].view('<f8'), columns[2].view('<f8'))
+        else:
+            self._index = None
+        self._mtime = mtime
+        return self._index
+
+    def get_index(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return self._index
+        with self._lock:
+            self._checked_at = now
+            return self._load()
+
+    def lookup(self, address):
+        """Return (lat, lng) of the address or None if the gazetteer does not know it."""
+        index = self.get_index()
+        if index is None:
+            return None
+        hashes, lats, lngs = index
+        tokens = get_address_tokens(address)
+        for start in range(len(tokens) - MIN_KEY_TOKENS + 1):
+            if start and tokens[start - 1] in STREET_TYPES:
+                break
+            key = np.uint64(get_key_hash(tokens[start:]))
+            position = int(np.searchsorted(hashes, key))
+            if position < len(hashes) and hashes[position] == key:
+                return float(lats[position]), float(lngs[position])
+        return None
+
+
+gazetteer = Gazetteer(settings.GAZETTEER_PATH)
@@ -0,0 +1,145 @@
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from star_burger.metrics import (
+    GEOCODER_CIRCUIT_REJECTIONS,
+    GEOCODER_CIRCUIT_TRANSITIONS,
+    GEOCODER_REQUEST_DURATION,
+    GEOCODER_REQUESTS,
+    GEOCODER_RETRIES,
+)
+
+
+YANDEX_GEOCODER_URL = 'https://geocode-maps.yandex.ru/1.x'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+
+class GeocoderClient:
+    """Client of the Yandex geocoder with a bounded response time.
+
+    Connections are kept in a pool, every attempt is limited by connect and
+    read timeouts, network errors and 5xx answers are retried with a jittered
+    backoff. After failure_threshold failed calls in a row the circuit opens:
+    for reset_timeout seconds calls fail at once with CircuitOpenError, then
+    one trial call decides whether to close the circuit again.
+    """
+
+    def __init__(self, base_url=YANDEX_GEOCODER_URL, connect_timeout=3.05, read_timeout=5, retries=2,
+                 retry_delay=0.2, failure_threshold=5, reset_timeout=30, pool_size=10, clock=time.monotonic):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if self.state != state:
+            self.state = state
+            GEOCODER_CIRCUIT_TRANSITIONS.inc(state=state)
+
+    def _before_call(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+                return
+            # while open, and while the trial call of the half open state is running, nothing goes out
+            GEOCODER_CIRCUIT_REJECTIONS.inc()
+            raise CircuitOpenError('Geocoder circuit is open')
+
+    def _on_success(self):
+        with self._lock:
+            self._failures = 0
+            self._set_state(CLOSED)
+
+    def _on_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = self.clock()
+                self._set_state(OPEN)
+
+    def get_retry_delay(self, attempt):
+        return self.retry_delay * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    def _request(self, params):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                GEOCODER_RETRIES.inc()
+                time.sleep(self.get_retry_delay(attempt - 1))
+            try:
+                with GEOCODER_REQUEST_DURATION.time():
+                    response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+                response.raise_for_status()
+            except requests.Timeout:
+                GEOCODER_REQUESTS.inc(outcome='timeout')
+                if attempt == self.retries:
+                    raise
+            except requests.ConnectionError:
+                GEOCODER_REQUESTS.inc(outcome='connection_error')
+                if attempt == self.retries:
+                    raise
+            except requests.HTTPError as error:
+                GEOCODER_REQUESTS.inc(outcome='http_error')
+                status_code = error.response.status_code
+                if attempt == self.retries or (status_code < 500 and status_code != 429):
+                    raise
+            else:
+                GEOCODER_REQUESTS.inc(outcome='ok')
+                return response.json()
+
+    def fetch_coordinates(self, apikey, address):
+        self._before_call()
+        try:
+            payload = self._request({
+                'geocode': address,
+                'apikey': apikey,
+                'format': 'json',
+            })
+            found_places = payload['response']['GeoObjectCollection']['featureMember']
+        except BaseException:
+            # any error, not only network ones, must end the trial call of the half open state
+            self._on_failure()
+            raise
+        self._on_success()
+
+        if not found_places:
+            return None, None
+
+        most_relevant = found_places[0]
+        lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
+        return lon, lat
+
+
+geocoder_client = GeocoderClient(
+    connect_timeout=settings.GEOCODER_CONNECT_TIMEOUT,
+    read_timeout=settings.GEOCODER_READ_TIMEOUT,
+    retries=settings.GEOCODER_RETRIES,
+    failure_threshold=settings.GEOCODER_CIRCUIT_FAILURES,
+    reset_timeout=settings.GEOCODER_CIRCUIT_RESET_SECONDS,
+)
@@ -0,0 +1,181 @@
+import datetime
+import threading
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from place.addresses import normalize_address
+from place.gazetteer import gazetteer
+from place.models import Place, fetch_coordinates
+from star_burger.metrics import GEOCODER_CACHE_HITS, GEOCODER_CACHE_MISSES
+
+
+# sent with normalized addresses whose coordinates were stored or changed
+coordinates_changed = Signal()
+
+
+class GeocodingCache:
+    """Coordinates of addresses cached in memory and in the Place table by normalized address.
+
+    Found coordinates live for GEOCODER_CACHE_DAYS, failed lookups are
+    remembered as a Place without coordinates for GEOCODER_NEGATIVE_CACHE_DAYS,
+    so the geocoder is not asked about a bad address on every page render.
+    Coordinates entered by hand, without request date, never expire.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_fresh(lat, lng, request_date):
+        found = lat is not None and lng is not None
+        if not request_date:
+            return found
+        ttl = settings.GEOCODER_CACHE_DAYS if found else settings.GEOCODER_NEGATIVE_CACHE_DAYS
+        return datetime.date.today() - request_date < datetime.timedelta(days=ttl)
+
+    @staticmethod
+    def fetch(address):
+        """Return coordinates of the address or None if the geocoder is unavailable."""
+        if not normalize_address(address):
+            return None, None
+        try:
+            lng, lat = fetch_coordinates(settings.YANDEX_GEOCODER_KEY, address)
+        except (requests.RequestException, KeyError, ValueError):
+            return None
+        if lat is None or lng is None:
+            return None, None
+        return float(lat), float(lng)
+
+    def _get_cached(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not self.is_fresh(*entry):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[:2]
+
+    def _remember(self, key, lat, lng, request_date):
+        with self._lock:
+            self._entries[key] = (lat, lng, request_date)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, address):
+        return self.prefetch([address])[address]
+
+    def prefetch(self, addresses, fetch_missing=True):
+        # spellings of one address share a key, so they are looked up and geocoded once
+        addresses_by_key = {}
+        for address in addresses:
+            addresses_by_key.setdefault(normalize_address(address), []).append(address)
+
+        coordinates = {'': (None, None)}
+        missing_keys = set()
+        for key in addresses_by_key:
+            if key in coordinates:
+                continue
+            cached = self._get_cached(key)
+            if cached is None:
+                missing_keys.add(key)
+            else:
+                coordinates[key] = cached
+        GEOCODER_CACHE_HITS.inc(len(coordinates) - 1)
+
+        if missing_keys:
+            self._prefetch_missing(missing_keys, addresses_by_key, coordinates, fetch_missing)
+        return {
+            address: coordinates[key]
+            for key, key_addresses in addresses_by_key.items()
+            for address in key_addresses
+        }
+
+    def _prefetch_missing(self, missing_keys, addresses_by_key, coordinates, fetch_missing):
+        places = Place.objects.in_bulk(missing_keys, field_name='normalized_address')
+        stale_places = []
+        new_places = []
+        queued_addresses = []
+        for key in missing_keys:
+            address = addresses_by_key[key][0]
+            place = places.get(key)
+            if place:
+                lat = float(place.lat) if place.lat is not None else None
+                lng = float(place.lng) if place.lng is not None else None
+                if self.is_fresh(lat, lng, place.request_date):
+                    self._remember(key, lat, lng, place.request_date)
+                    coordinates[key] = (lat, lng)
+                    GEOCODER_CACHE_HITS.inc()
+                    continue
+            GEOCODER_CACHE_MISSES.inc()
+            fetched = gazetteer.lookup(address)
+            if fetched is None and fetch_missing:
+                fetched = self.fetch(address)
+            if fetched is None:
+                # the geocoder is not asked or did not answer, the worker will try again later
+                queued_addresses.append(address)
+                coordinates[key] = (lat, lng) if place else (None, None)
+                continue
+
+            lat, lng = fetched
+            if not place:
+                place = Place(address=address, normalized_address=key)
+                new_places.append(place)
+            else:
+                stale_places.append(place)
+            place.lat, place.lng = lat, lng
+            place.request_date = datetime.date.today()
+            self._remember(key, lat, lng, place.request_date)
+            coordinates[key] = (lat, lng)
+
+        if new_places:
+            Place.objects.bulk_create(new_places, ignore_conflicts=True)
+        if stale_places:
+            Place.objects.bulk_update(stale_places, ['lat', 'lng', 'request_date'])
+        if new_places or stale_places:
+            coordinates_changed.send(
+                sender=self.__class__,
+                keys={place.normalized_address for place in new_places + stale_places},
+            )
+        if queued_addresses:
+            from place.queue import enqueue_geocoding
+
+            enqueue_geocoding(queued_addresses)
+
+    def store(self, address, lat, lng):
+        key = normalize_address(address)
+        request_date = datetime.date.today()
+        updated = Place.objects.filter(normalized_address=key).update(lat=lat, lng=lng, request_date=request_date)
+        if not updated:
+            Place.objects.bulk_create(
+                [Place(address=address, normalized_address=key, lat=lat, lng=lng, request_date=request_date)],
+                ignore_conflicts=True,
+            )
+        self._remember(key, lat, lng, request_date)
+        coordinates_changed.send(sender=self.__class__, keys={key})
+
+    def forget(self, address):
+        with self._lock:
+            self._entries.pop(normalize_address(address), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+geocoding_cache = GeocodingCache(settings.GEOCODER_LRU_SIZE)
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+def forget_changed_place(sender, instance, **kwargs):
+    geocoding_cache.forget(instance.address)
+    coordinates_changed.send(sender=sender, keys={normalize_address(instance.address)})
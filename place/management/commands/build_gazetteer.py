@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from place.gazetteer import read_gazetteer_csv, write_gazetteer
+
+
+class Command(BaseCommand):
+    help = 'Собирает индекс адресов для геокодирования без обращения к геокодеру из CSV с колонками street, house, lat, lng'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--output', default=settings.GAZETTEER_PATH, help='Куда сохранить индекс')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['csv_path'], newline='', encoding='utf-8') as file:
+                count = write_gazetteer(read_gazetteer_csv(file), options['output'])
+        except (OSError, KeyError, ValueError) as error:
+            raise CommandError(f'Не удалось собрать индекс: {error!r}')
+        self.stdout.write(f'Адресов в индексе: {count}')
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from place.queue import process_geocoding_tasks
+
+
+class Command(BaseCommand):
+    help = 'Геокодирует адреса из очереди задач в фоне'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Обработать очередь один раз и выйти')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=2, help='Пауза в секундах, когда очередь пуста')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_geocoding_tasks(options['batch_size'])
+            if processed:
+                self.stdout.write(f'Обработано адресов: {processed}')
+            if options['once']:
+                return
+            if not processed:
+                time.sleep(options['interval'])
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from place.addresses import merge_duplicate_places
+from place.geocoding import geocoding_cache
+from place.models import Place
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает нормализованные адреса мест и удаляет дубли, например после изменения правил нормализации'
+
+    def handle(self, *args, **options):
+        merged = merge_duplicate_places(Place)
+        geocoding_cache.clear()
+        self.stdout.write(f'Удалено дублей: {merged}')
@@ -0,0 +1,116 @@
+# Generated by Django 3.2 on 2026-10-18 01:46
+
+import re
+
+from django.db import migrations, models
+
+
+# A frozen copy of place.addresses as of this migration: the live rules may
+# change later, and the keys written here must not change with them.
+WORD_PATTERN = re.compile(r'\w+')
+HYPHENATED_ABBREVIATIONS = {
+    'пр-т': 'проспект',
+    'пр-кт': 'проспект',
+    'б-р': 'бульвар',
+    'р-н': 'район',
+    'мкр-н': 'микрорайон',
+}
+HYPHENATED_PATTERN = re.compile(
+    r'(?<!\w)(' + '|'.join(re.escape(abbreviation) for abbreviation in HYPHENATED_ABBREVIATIONS) + r')(?!\w)'
+)
+ABBREVIATIONS = {
+    'ул': 'улица',
+    'пр': 'проспект',
+    'просп': 'проспект',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'бул': 'бульвар',
+    'ш': 'шоссе',
+    'наб': 'набережная',
+    'мкр': 'микрорайон',
+    'мкрн': 'микрорайон',
+    'пос': 'поселок',
+    'обл': 'область',
+    'кв': 'квартира',
+    'корп': 'корпус',
+    'стр': 'строение',
+    'г': 'город',
+    'д': 'дом',
+}
+# "Ленина, 5" means the same as "ул. Ленина, д. 5", so these words do not get into the key
+OMITTED_WORDS = {'улица', 'дом', 'город'}
+
+
+def get_address_tokens(address):
+    """Canonical words of an address: case folded, ё replaced, abbreviations expanded.
+
+    A house letter written apart, as in "7 а" or "7-а", is joined to the number.
+    """
+    address = address.casefold().replace('ё', 'е')
+    address = HYPHENATED_PATTERN.sub(lambda match: HYPHENATED_ABBREVIATIONS[match.group(1)], address)
+    tokens = []
+    for word in WORD_PATTERN.findall(address):
+        word = ABBREVIATIONS.get(word, word)
+        if word in OMITTED_WORDS:
+            continue
+        if len(word) == 1 and word.isalpha() and tokens and tokens[-1].isdigit():
+            tokens[-1] += word
+            continue
+        tokens.append(word)
+    return tokens
+
+
+def normalize_address(address):
+    """Key of an address: equal for spellings that differ in case, punctuation or abbreviations."""
+    return ' '.join(get_address_tokens(address))
+
+
+def merge_duplicate_places(place_model, normalize_address=normalize_address):
+    """Recalculate keys of all places and leave one place per key.
+
+    The place kept is the one with coordinates and the latest request date.
+    Later migrations pass the rules frozen with them.
+    """
+    places_by_key = {}
+    for place in place_model.objects.order_by('id').iterator():
+        places_by_key.setdefault(normalize_address(place.address), []).append(place)
+
+    duplicates_ids = []
+    changed_places = []
+    for key, places in places_by_key.items():
+        places.sort(
+            key=lambda place: (place.lat is not None and place.lng is not None, place.request_date is None,
+                               place.request_date or 0),
+            reverse=True,
+        )
+        kept_place, *duplicates = places
+        duplicates_ids.extend(place.id for place in duplicates)
+        if kept_place.normalized_address != key:
+            kept_place.normalized_address = key
+            changed_places.append(kept_place)
+
+    place_model.objects.filter(id__in=duplicates_ids).delete()
+    # keys are cleared first, so that swapping keys between two places does not hit the unique index
+    place_model.objects.filter(id__in=[place.id for place in changed_places]).update(normalized_address=None)
+    place_model.objects.bulk_update(changed_places, ['normalized_address'], batch_size=500)
+    return len(duplicates_ids)
+
+
+def fill_normalized_addresses(apps, schema_editor):
+    merge_duplicate_places(apps.get_model('place', 'Place'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('place', '0003_geocodingtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='normalized_address',
+            field=models.CharField(editable=False, max_length=200, null=True, unique=True, verbose_name='Нормализованный адрес'),
+        ),
+        migrations.RunPython(fill_normalized_addresses, migrations.RunPython.noop),
+    ]
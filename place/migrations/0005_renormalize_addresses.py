@@ -0,0 +1,66 @@
+import re
+from importlib import import_module
+
+from django.db import migrations
+
+
+# The rules of 0004 took a house letter after the number for "город" or "дом",
+# so keys are recalculated. A frozen copy of place.addresses as of this migration.
+frozen_addresses = import_module('place.migrations.0004_place_normalized_address')
+# a letter apart from the number, as in "7 а" or "7-а", is a house letter, not an abbreviation
+HOUSE_LETTER_SEPARATOR = re.compile(r'[\s-]*')
+
+
+def get_address_tokens(address):
+    """Canonical words of an address: case folded, ё replaced, abbreviations expanded.
+
+    A house letter written apart, as in "7 а" or "7-а", is joined to the
+    number first, so "5 г" stays a house and is not taken for "город".
+    One-letter abbreviations are expanded only before a name or a number.
+    """
+    address = address.casefold().replace('ё', 'е')
+    address = frozen_addresses.HYPHENATED_PATTERN.sub(
+        lambda match: frozen_addresses.HYPHENATED_ABBREVIATIONS[match.group(1)],
+        address,
+    )
+    words = []
+    previous_end = 0
+    for match in frozen_addresses.WORD_PATTERN.finditer(address):
+        word = match.group()
+        separator = address[previous_end:match.start()]
+        previous_end = match.end()
+        if len(word) == 1 and word.isalpha() and words and words[-1].isdigit() \
+                and HOUSE_LETTER_SEPARATOR.fullmatch(separator):
+            words[-1] += word
+            continue
+        words.append(word)
+
+    tokens = []
+    for position, word in enumerate(words):
+        is_last = position == len(words) - 1
+        if not (len(word) == 1 and is_last):
+            word = frozen_addresses.ABBREVIATIONS.get(word, word)
+        if word in frozen_addresses.OMITTED_WORDS:
+            continue
+        tokens.append(word)
+    return tokens
+
+
+def normalize_address(address):
+    """Key of an address: equal for spellings that differ in case, punctuation or abbreviations."""
+    return ' '.join(get_address_tokens(address))
+
+
+def renormalize_addresses(apps, schema_editor):
+    frozen_addresses.merge_duplicate_places(apps.get_model('place', 'Place'), normalize_address)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('place', '0004_place_normalized_address'),
+    ]
+
+    operations = [
+        migrations.RunPython(renormalize_addresses, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,9 @@
-import datetime
-import requests
-
-from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
-from geopy import distance
+from django.utils import timezone
+
+from place.addresses import normalize_address
+from place.geocoder import geocoder_client
 
 
 class Place(models.Model):
@@ -13,6 +13,13 @@ class Place(models.Model):
         unique=True,
         db_index=True,
     )
+    normalized_address = models.CharField(
+        'Нормализованный адрес',
+        max_length=200,
+        unique=True,
+        null=True,
+        editable=False,
+    )
     lng = models.DecimalField(
         max_digits=17,
         decimal_places=15,
@@ -37,60 +44,61 @@ class Place(models.Model):
     def __str__(self):
         return self.address
 
+    def validate_unique(self, exclude=None):
+        super().validate_unique(exclude)
+        # normalized_address is not editable, so forms skip its unique check and the database would raise
+        if exclude and 'address' in exclude:
+            return
+        duplicate = Place.objects.filter(normalized_address=normalize_address(self.address)).exclude(pk=self.pk).first()
+        if duplicate:
+            raise ValidationError({'address': f'Место с таким адресом уже есть: {duplicate}'})
+
+    def save(self, *args, **kwargs):
+        self.normalized_address = normalize_address(self.address)
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['address']
         verbose_name = "Место"
         verbose_name_plural = "Места"
 
 
+class GeocodingTask(models.Model):
+    address = models.CharField(
+        'Адрес',
+        max_length=200,
+        unique=True,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        'Попыток',
+        default=0,
+    )
+    next_attempt_at = models.DateTimeField(
+        'Следующая попытка',
+        default=timezone.now,
+        db_index=True,
+    )
+    last_error = models.TextField(
+        'Последняя ошибка',
+        blank=True,
+    )
+
+    def __str__(self):
+        return self.address
+
+    class Meta:
+        ordering = ['next_attempt_at']
+        verbose_name = "Задача геокодирования"
+        verbose_name_plural = "Задачи геокодирования"
+
+
 def fetch_coordinates(apikey, address):
     if address == '""':
         return None, None
-    base_url = "https://geocode-maps.yandex.ru/1.x"
-    response = requests.get(base_url, params={
-        "geocode": address,
-        "apikey": apikey,
-        "format": "json",
-    })
-    response.raise_for_status()
-    found_places = response.json()['response']['GeoObjectCollection']['featureMember']
-
-    if not found_places:
-        return None, None
-
-    most_relevant = found_places[0]
-    lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
-    return lon, lat
-
-
-def add_distance_to_restaurants(suitable_restaurants, order):
-    if not any((order.lat, order.lng)):
-        order.lat, order.lng = get_or_create_place_coord(order.address)
-
-    restaurants = []
-
-    for restaurant in suitable_restaurants:
-        restaurant_coordinates = get_or_create_place_coord(restaurant.address)
-        if not any(restaurant_coordinates) or not any((order.lat, order.lng)):
-            restaurants.append({'name': f'{str(restaurant)} - Ошибка определения координат, ',
-                                    'distance': float('inf'),
-                                    })
-            continue
-        distance_to_restaurant = distance.distance((order.lat, order.lng), restaurant_coordinates).km
-        restaurants.append({'name': str(restaurant), 'distance': round(distance_to_restaurant, 3)})
-    sorted_restaurants = sorted(
-        restaurants,
-        key=lambda restaurant: restaurant["distance"],
-        reverse=False
-    )
-    return [f'{restaurant["name"]}, {restaurant["distance"] if restaurant["distance"] !=float("inf") else "-" } км.'
-            for restaurant in sorted_restaurants]
+    return geocoder_client.fetch_coordinates(apikey, address)
 
 
 def get_or_create_place_coord(address):
-        place, created = Place.objects.get_or_create(address=address)
-        if not any([place.lng, place.lat]):
-            place.lng, place.lat = fetch_coordinates(settings.YANDEX_GEOCODER_KEY, address)
-            place.request_date = datetime.date.today()
-            place.save()
-        return (place.lat, place.lng)
+    from place.geocoding import geocoding_cache
+
+    return geocoding_cache.get(address)
@@ -0,0 +1,109 @@
+import datetime
+import logging
+import random
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from place.addresses import normalize_address
+from place.gazetteer import gazetteer
+from place.geocoder import CircuitOpenError, geocoder_client
+from place.geocoding import geocoding_cache
+from place.models import GeocodingTask, Place, fetch_coordinates
+
+
+logger = logging.getLogger(__name__)
+
+CLAIM_TIMEOUT = datetime.timedelta(minutes=5)
+RETRY_BASE_DELAY = datetime.timedelta(seconds=30)
+RETRY_MAX_DELAY = datetime.timedelta(hours=6)
+MAX_ATTEMPTS = 10
+
+
+def enqueue_geocoding(addresses):
+    addresses_by_key = {normalize_address(address): address for address in addresses}
+    addresses_by_key.pop('', None)
+    GeocodingTask.objects.bulk_create(
+        [GeocodingTask(address=address) for address in addresses_by_key.values()],
+        ignore_conflicts=True,
+    )
+
+
+def enqueue_geocoding_on_commit(addresses):
+    transaction.on_commit(lambda: enqueue_geocoding(addresses))
+
+
+def get_retry_delay(attempts):
+    # the exponent is capped, a timedelta can not be multiplied by a huge number
+    delay = min(RETRY_BASE_DELAY * 2 ** min(attempts - 1, 20), RETRY_MAX_DELAY)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def describe_error(error):
+    # the request URL carries the geocoder API key, so it must not end up in the database
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return f'HTTP {error.response.status_code}'
+    return type(error).__name__
+
+
+def claim_tasks(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        tasks = list(
+            GeocodingTask.objects
+            .select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        GeocodingTask.objects.filter(id__in=[task.id for task in tasks]).update(
+            next_attempt_at=now + CLAIM_TIMEOUT,
+        )
+    return tasks
+
+
+def process_task(task):
+    place = Place.objects.filter(normalized_address=normalize_address(task.address)).first()
+    if place and geocoding_cache.is_fresh(place.lat, place.lng, place.request_date):
+        task.delete()
+        return
+
+    coordinates = gazetteer.lookup(task.address)
+    if coordinates:
+        geocoding_cache.store(task.address, *coordinates)
+        task.delete()
+        return
+
+    try:
+        lng, lat = fetch_coordinates(settings.YANDEX_GEOCODER_KEY, task.address)
+    except CircuitOpenError:
+        # the geocoder is down as a whole, this address is not to blame
+        task.next_attempt_at = timezone.now() + datetime.timedelta(seconds=geocoder_client.reset_timeout)
+        task.save(update_fields=['next_attempt_at'])
+        return
+    except (requests.RequestException, KeyError, ValueError) as error:
+        task.attempts += 1
+        task.last_error = describe_error(error)
+        if task.attempts >= MAX_ATTEMPTS:
+            logger.warning('Giving up geocoding %r: %s', task.address, task.last_error)
+            geocoding_cache.store(task.address, None, None)
+            task.delete()
+            return
+        task.next_attempt_at = timezone.now() + get_retry_delay(task.attempts)
+        task.save(update_fields=['attempts', 'last_error', 'next_attempt_at'])
+        return
+
+    geocoding_cache.store(
+        task.address,
+        float(lat) if lat is not None else None,
+        float(lng) if lng is not None else None,
+    )
+    task.delete()
+
+
+def process_geocoding_tasks(batch_size=50):
+    tasks = claim_tasks(batch_size)
+    for task in tasks:
+        process_task(task)
+    return len(tasks)
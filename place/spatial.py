@@ -0,0 +1,102 @@
+import math
+
+import numpy as np
+
+from place.distance import EARTH_RADIUS_KM, get_haversine_matrix
+
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+BRUTE_FORCE_LIMIT = 64
+
+
+class GridIndex:
+    """Points on a grid of square cells for nearest neighbour queries.
+
+    A query walks rings of cells around the cell of the point and stops as
+    soon as the k-th found distance is closer than the next ring can be.
+    Cells are sized for the highest latitude of the points, so within a city
+    a ring of cells is never closer than its number times cell_km. When few
+    points are allowed by the query, they are simply all measured.
+    """
+
+    def __init__(self, coordinates, cell_km=2.0):
+        self.coordinates = np.array(coordinates, dtype=float).reshape(-1, 2)
+        self.cell_km = cell_km
+        self.lat_step = cell_km / KM_PER_DEGREE
+        max_lat = np.abs(self.coordinates[:, 0]).max() if len(self.coordinates) else 0
+        self.lng_step = cell_km / (KM_PER_DEGREE * math.cos(math.radians(min(max_lat + 1, 89))))
+
+        self._cells = {}
+        for position, (lat, lng) in enumerate(self.coordinates):
+            self._cells.setdefault(self._get_cell(lat, lng), []).append(position)
+        self._cells = {cell: np.array(positions, dtype=int) for cell, positions in self._cells.items()}
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def _get_cell(self, lat, lng):
+        return math.floor(lat / self.lat_step), math.floor(lng / self.lng_step)
+
+    def _get_ring_cells(self, center, ring):
+        row, column = center
+        if ring == 0:
+            yield center
+            return
+        for offset in range(-ring, ring + 1):
+            yield row - ring, column + offset
+            yield row + ring, column + offset
+        for offset in range(-ring + 1, ring):
+            yield row + offset, column - ring
+            yield row + offset, column + ring
+
+    def get_distances(self, lat, lng, positions):
+        return get_haversine_matrix(np.array([[lat, lng]]), self.coordinates[positions])[0]
+
+    def nearest(self, lat, lng, count=None, radius_km=None, allowed=None):
+        """Positions of the nearest points and distances to them in km, closest first.
+
+        allowed is a boolean mask of points that may be returned.
+        """
+        if allowed is None:
+            allowed = np.ones(len(self), dtype=bool)
+        allowed_positions = np.flatnonzero(allowed)
+        if len(allowed_positions) <= BRUTE_FORCE_LIMIT or (count is None and radius_km is None):
+            return self._select(allowed_positions, self.get_distances(lat, lng, allowed_positions), count, radius_km)
+
+        center = self._get_cell(lat, lng)
+        max_ring = max(
+            max(abs(row - center[0]), abs(column - center[1]))
+            for row, column in self._cells
+        )
+        if radius_km is not None:
+            # a point in ring r is at least r - 1 cells away
+            max_ring = min(max_ring, math.floor(radius_km / self.cell_km) + 1)
+
+        found_positions = []
+        found_distances = []
+        for ring in range(max_ring + 1):
+            for cell in self._get_ring_cells(center, ring):
+                positions = self._cells.get(cell)
+                if positions is None:
+                    continue
+                positions = positions[allowed[positions]]
+                if len(positions):
+                    found_positions.append(positions)
+                    found_distances.append(self.get_distances(lat, lng, positions))
+            # everything beyond this ring is at least ring * cell_km away
+            if count is not None and found_positions:
+                distances = np.concatenate(found_distances)
+                if len(distances) >= count and np.partition(distances, count - 1)[count - 1] <= ring * self.cell_km:
+                    break
+
+        if not found_positions:
+            return np.array([], dtype=int), np.array([])
+        return self._select(np.concatenate(found_positions), np.concatenate(found_distances), count, radius_km)
+
+    @staticmethod
+    def _select(positions, distances, count, radius_km):
+        if radius_km is not None:
+            within_radius = distances <= radius_km
+            positions, distances = positions[within_radius], distances[within_radius]
+        order = np.argsort(distances, kind='stable')[:count]
+        return positions[order], distances[order]
@@ -1,3 +1,428 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from importlib import import_module
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+import numpy as np
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from place.addresses import merge_duplicate_places, normalize_address
+from place.distance import get_distance_matrix
+import place.models
+import place.queue
+from place.gazetteer import Gazetteer, read_gazetteer_csv, write_gazetteer
+from place.geocoder import CLOSED, OPEN, CircuitOpenError, GeocoderClient
+from place.geocoding import GeocodingCache, geocoding_cache
+from place.models import GeocodingTask, Place
+from place.queue import (
+    CLAIM_TIMEOUT,
+    MAX_ATTEMPTS,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    claim_tasks,
+    get_retry_delay,
+    process_geocoding_tasks,
+)
+from place.spatial import GridIndex
+
+
+FOUND_RESPONSE = {
+    'response': {
+        'GeoObjectCollection': {
+            'featureMember': [{'GeoObject': {'Point': {'pos': '92.8526 56.0106'}}}],
+        },
+    },
+}
+
+
+class StubGeocoderHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests_count += 1
+        status_code, delay = self.server.answers.pop(0) if self.server.answers else (200, 0)
+        time.sleep(delay)
+        body = json.dumps(FOUND_RESPONSE).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client has already given up on a slow answer
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def start_stub_geocoder(test_case):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubGeocoderHandler)
+    server.answers = []
+    server.requests_count = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    test_case.addCleanup(server.server_close)
+    test_case.addCleanup(server.shutdown)
+    return server
+
+
+class GeocoderClientTest(SimpleTestCase):
+    def setUp(self):
+        self.server = start_stub_geocoder(self)
+        self.clock = FakeClock()
+        self.client = GeocoderClient(
+            base_url=f'http://127.0.0.1:{self.server.server_port}/1.x',
+            read_timeout=0.2,
+            retries=2,
+            retry_delay=0.01,
+            failure_threshold=2,
+            reset_timeout=30,
+            clock=self.clock,
+        )
+
+    def test_retries_server_errors(self):
+        self.server.answers = [(503, 0), (500, 0)]
+        self.assertEqual(self.client.fetch_coordinates('key', 'Красноярск'), ('92.8526', '56.0106'))
+        self.assertEqual(self.server.requests_count, 3)
+        self.assertEqual(self.client.state, CLOSED)
+
+    def test_does_not_retry_client_errors(self):
+        self.server.answers = [(403, 0)]
+        with self.assertRaises(requests.HTTPError):
+            self.client.fetch_coordinates('key', 'Красноярск')
+        self.assertEqual(self.server.requests_count, 1)
+
+    def test_read_timeout(self):
+        self.server.answers = [(200, 0.5)] * 3
+        started_at = time.monotonic()
+        with self.assertRaises(requests.Timeout):
+            self.client.fetch_coordinates('key', 'Красноярск')
+        self.assertLess(time.monotonic() - started_at, 1.5)
+
+    def test_circuit_breaker(self):
+        self.server.answers = [(500, 0)] * 6
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                self.client.fetch_coordinates('key', 'Красноярск')
+        self.assertEqual(self.client.state, OPEN)
+
+        with self.assertRaises(CircuitOpenError):
+            self.client.fetch_coordinates('key', 'Красноярск')
+        self.assertEqual(self.server.requests_count, 6)
+
+        self.clock.now = 30
+        self.assertEqual(self.client.fetch_coordinates('key', 'Красноярск'), ('92.8526', '56.0106'))
+        self.assertEqual(self.client.state, CLOSED)
+
+    def test_failed_trial_call_opens_circuit_again(self):
+        self.server.answers = [(500, 0)] * 9
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                self.client.fetch_coordinates('key', 'Красноярск')
+
+        self.clock.now = 30
+        with self.assertRaises(requests.HTTPError):
+            self.client.fetch_coordinates('key', 'Красноярск')
+        self.assertEqual(self.client.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.client.fetch_coordinates('key', 'Красноярск')
+
+    def test_unexpected_error_in_trial_call_opens_circuit_again(self):
+        self.server.answers = [(500, 0)] * 6
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                self.client.fetch_coordinates('key', 'Красноярск')
+
+        def broken_get(*args, **kwargs):
+            raise RuntimeError('broken session')
+
+        self.client.session.get = broken_get
+        self.clock.now = 30
+        with self.assertRaises(RuntimeError):
+            self.client.fetch_coordinates('key', 'Красноярск')
+        self.assertEqual(self.client.state, OPEN)
+
+        del self.client.session.get
+        self.clock.now = 60
+        self.assertEqual(self.client.fetch_coordinates('key', 'Красноярск'), ('92.8526', '56.0106'))
+        self.assertEqual(self.client.state, CLOSED)
+
+
+GAZETTEER_CSV = """street,house,lat,lng
+улица Ленина,5,56.0106,92.8526
+улица Ленина,7а,56.0110,92.8530
+проспект Мира,10,56.0150,92.8700
+"""
+
+
+class GazetteerTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'gazetteer.idx')
+        write_gazetteer(read_gazetteer_csv(io.StringIO(GAZETTEER_CSV)), self.path)
+        self.gazetteer = Gazetteer(self.path)
+
+    def test_lookup(self):
+        self.assertEqual(self.gazetteer.lookup('Улица Ленина, 7А'), (56.011, 92.853))
+        self.assertEqual(self.gazetteer.lookup('Красноярск, проспект Мира, 10'), (56.015, 92.87))
+
+    def test_unknown_address(self):
+        self.assertIsNone(self.gazetteer.lookup('улица Ленина, 9'))
+        self.assertIsNone(Gazetteer(self.path + '.missing').lookup('улица Ленина, 5'))
+
+    def test_other_street_type_misses(self):
+        self.assertEqual(self.gazetteer.lookup('Красноярск, ул. Ленина, 5'), (56.0106, 92.8526))
+        self.assertIsNone(self.gazetteer.lookup('пр. Ленина 5'))
+        self.assertIsNone(self.gazetteer.lookup('Красноярск, переулок Ленина, 5'))
+        self.assertIsNone(self.gazetteer.lookup('ул. Мира 10'))
+
+
+class AddressNormalizationTest(TestCase):
+    def test_spellings_of_one_address(self):
+        spellings = ['ул. Ленина 5', 'Ленина, 5', '  "улица  ЛЕНИНА, д.5" ', 'Улица Ленина, дом 5']
+        self.assertEqual({normalize_address(address) for address in spellings}, {'ленина 5'})
+        self.assertEqual(normalize_address('пр-т Мира, 7 А'), normalize_address('проспект мира 7а'))
+        self.assertEqual(normalize_address('""'), '')
+
+    def test_house_letters_are_not_abbreviations(self):
+        self.assertEqual(normalize_address('Ленина 5 г'), 'ленина 5г')
+        self.assertEqual(normalize_address('Ленина 5-д'), 'ленина 5д')
+        self.assertEqual(normalize_address('Мира 7 ш'), 'мира 7ш')
+        self.assertEqual(len({normalize_address(address) for address in ['Ленина 5', 'Ленина 5 г', 'Ленина 5-д']}), 3)
+        self.assertEqual(normalize_address('г. Красноярск, ул. Ленина, д. 5'), 'красноярск ленина 5')
+        self.assertEqual(normalize_address('Ленинградское ш, 7'), 'ленинградское шоссе 7')
+
+    def test_migrations_keep_the_rules_of_their_time(self):
+        first_rules = import_module('place.migrations.0004_place_normalized_address')
+        house_letter_rules = import_module('place.migrations.0005_renormalize_addresses')
+        self.assertEqual(first_rules.normalize_address('Ленина 5 г'), 'ленина 5')
+        for address in ['Ленина 5 г', 'Ленина 5-д', 'Мира 7 ш', 'г. Красноярск, ул. Ленина, д. 5', 'пр-т Мира, 7 А']:
+            self.assertEqual(house_letter_rules.normalize_address(address), normalize_address(address))
+
+    def test_places_are_found_by_normalized_address(self):
+        Place.objects.create(address='ул. Ленина 5', lat=56.01, lng=92.85)
+        geocoding_cache.clear()
+        self.assertEqual(geocoding_cache.prefetch(['Ленина, 5'], fetch_missing=False), {'Ленина, 5': (56.01, 92.85)})
+
+    def test_admin_rejects_other_spelling_of_known_address(self):
+        Place.objects.create(address='ул. Ленина, 5')
+        self.client.force_login(User.objects.create_superuser('manager', password='manager'))
+        response = self.client.post(reverse('admin:place_place_add'), {'address': 'Ленина 5'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('address', response.context['adminform'].form.errors)
+        self.assertEqual(Place.objects.count(), 1)
+
+    def test_different_houses_are_not_merged(self):
+        Place.objects.bulk_create([Place(address='Ленина 5'), Place(address='Ленина 5 г'), Place(address='Ленина 5-д')])
+        self.assertEqual(merge_duplicate_places(Place), 0)
+        self.assertEqual(Place.objects.count(), 3)
+
+    def test_merge_duplicate_places(self):
+        Place.objects.bulk_create([
+            Place(address='ул. Ленина 5'),
+            Place(address='Ленина, 5', lat=56.01, lng=92.85),
+            Place(address='проспект Мира 10'),
+        ])
+        self.assertEqual(merge_duplicate_places(Place), 1)
+        self.assertEqual(
+            set(Place.objects.values_list('address', 'normalized_address')),
+            {('Ленина, 5', 'ленина 5'), ('проспект Мира 10', 'проспект мира 10')},
+        )
+
+
+class GeocodingCacheTest(TestCase):
+    def setUp(self):
+        self.cache = GeocodingCache(max_size=2)
+
+    def days_ago(self, days):
+        return datetime.date.today() - datetime.timedelta(days=days)
+
+    def test_least_recently_used_addresses_are_evicted(self):
+        self.cache.store('Ленина, 5', 56.01, 92.85)
+        self.cache.store('Мира, 10', 56.02, 92.87)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get('ул. Ленина 5'), (56.01, 92.85))
+        self.cache.store('Маркса, 3', 56.03, 92.89)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get('Ленина, 5'), (56.01, 92.85))
+            self.assertEqual(self.cache.get('Маркса, 3'), (56.03, 92.89))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get('Мира, 10'), (56.02, 92.87))
+
+    def test_expired_coordinates_are_kept_until_geocoded_again(self):
+        Place.objects.create(
+            address='Ленина, 5',
+            lat=56.01,
+            lng=92.85,
+            request_date=self.days_ago(settings.GEOCODER_CACHE_DAYS + 1),
+        )
+        coordinates = self.cache.prefetch(['Ленина, 5'], fetch_missing=False)
+        self.assertEqual(coordinates, {'Ленина, 5': (56.01, 92.85)})
+        self.assertEqual(list(GeocodingTask.objects.values_list('address', flat=True)), ['Ленина, 5'])
+
+    def test_failed_lookups_are_remembered_for_a_while(self):
+        Place.objects.bulk_create([
+            Place(address='Нигде, 1', normalized_address='нигде 1', request_date=self.days_ago(0)),
+            Place(
+                address='Нигде, 2',
+                normalized_address='нигде 2',
+                request_date=self.days_ago(settings.GEOCODER_NEGATIVE_CACHE_DAYS),
+            ),
+        ])
+        coordinates = self.cache.prefetch(['Нигде, 1', 'Нигде, 2'], fetch_missing=False)
+        self.assertEqual(coordinates, {'Нигде, 1': (None, None), 'Нигде, 2': (None, None)})
+        self.assertEqual(list(GeocodingTask.objects.values_list('address', flat=True)), ['Нигде, 2'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get('Нигде, 1'), (None, None))
+
+    def test_prefetch_reads_places_at_once(self):
+        Place.objects.bulk_create([
+            Place(address='Ленина, 5', normalized_address='ленина 5', lat=56.01, lng=92.85, request_date=None),
+            Place(address='Мира, 10', normalized_address='мира 10', lat=56.02, lng=92.87, request_date=None),
+        ])
+        addresses = ['Ленина, 5', 'ул. Ленина 5', 'Мира, 10', '']
+        with self.assertNumQueries(1):
+            coordinates = self.cache.prefetch(addresses, fetch_missing=False)
+        self.assertEqual(coordinates, {
+            'Ленина, 5': (56.01, 92.85),
+            'ул. Ленина 5': (56.01, 92.85),
+            'Мира, 10': (56.02, 92.87),
+            '': (None, None),
+        })
+
+
+class GeocodingQueueTest(TestCase):
+    def setUp(self):
+        self.server = start_stub_geocoder(self)
+        self.clock = FakeClock()
+        client = GeocoderClient(
+            base_url=f'http://127.0.0.1:{self.server.server_port}/1.x',
+            retries=0,
+            failure_threshold=3,
+            reset_timeout=30,
+            clock=self.clock,
+        )
+        # the queue reaches the geocoder through the shared client, here it talks to the stub
+        for module in [place.models, place.queue]:
+            self.addCleanup(setattr, module, 'geocoder_client', module.geocoder_client)
+            module.geocoder_client = client
+        geocoding_cache.clear()
+        self.addCleanup(geocoding_cache.clear)
+
+    def test_retry_delay_grows_up_to_limit(self):
+        for attempts in [1, 2, 5]:
+            delay = get_retry_delay(attempts)
+            expected_delay = RETRY_BASE_DELAY * 2 ** (attempts - 1)
+            self.assertTrue(expected_delay * 0.5 <= delay <= expected_delay * 1.5)
+        self.assertLessEqual(get_retry_delay(100), RETRY_MAX_DELAY * 1.5)
+
+    def test_failed_task_is_retried_later(self):
+        self.server.answers = [(403, 0)]
+        task = GeocodingTask.objects.create(address='Ленина, 5')
+        started_at = timezone.now()
+        self.assertEqual(process_geocoding_tasks(), 1)
+
+        task.refresh_from_db()
+        self.assertEqual((task.attempts, task.last_error), (1, 'HTTP 403'))
+        self.assertGreaterEqual(task.next_attempt_at, started_at + RETRY_BASE_DELAY * 0.5)
+        self.assertEqual(process_geocoding_tasks(), 0)
+
+        GeocodingTask.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(process_geocoding_tasks(), 1)
+        self.assertFalse(GeocodingTask.objects.exists())
+        self.assertEqual(geocoding_cache.get('Ленина, 5'), (56.0106, 92.8526))
+
+    def test_task_is_given_up_after_max_attempts(self):
+        self.server.answers = [(403, 0)]
+        GeocodingTask.objects.create(address='Нигде, 1', attempts=MAX_ATTEMPTS - 1)
+        process_geocoding_tasks()
+        self.assertFalse(GeocodingTask.objects.exists())
+        self.assertEqual(
+            list(Place.objects.values_list('address', 'lat', 'lng')),
+            [('Нигде, 1', None, None)],
+        )
+
+    def test_open_circuit_does_not_count_as_attempt(self):
+        self.server.answers = [(403, 0)] * 3
+        GeocodingTask.objects.bulk_create([GeocodingTask(address=f'Ленина, {house}') for house in range(1, 5)])
+        process_geocoding_tasks()
+        self.assertEqual(
+            sorted(GeocodingTask.objects.values_list('attempts', flat=True)),
+            [0, 1, 1, 1],
+        )
+        self.assertEqual(self.server.requests_count, 3)
+
+    def test_claimed_tasks_are_not_claimed_twice(self):
+        GeocodingTask.objects.bulk_create([GeocodingTask(address=f'Ленина, {house}') for house in range(1, 4)])
+        started_at = timezone.now()
+        self.assertEqual(len(claim_tasks(2)), 2)
+        self.assertEqual(len(claim_tasks(5)), 1)
+        self.assertEqual(claim_tasks(5), [])
+        for next_attempt_at in GeocodingTask.objects.values_list('next_attempt_at', flat=True):
+            self.assertGreaterEqual(next_attempt_at, started_at + CLAIM_TIMEOUT)
+
+
+class DistanceMatrixTest(SimpleTestCase):
+    def test_haversine_is_close_to_geodesic(self):
+        rand = random.Random(1)
+        origins = [(56 + rand.uniform(-0.2, 0.2), 92.9 + rand.uniform(-0.3, 0.3)) for _ in range(10)]
+        destinations = [(56 + rand.uniform(-0.2, 0.2), 92.9 + rand.uniform(-0.3, 0.3)) for _ in range(15)]
+        haversine = get_distance_matrix(origins, destinations)
+        geodesic = get_distance_matrix(origins, destinations, precise=True)
+        self.assertEqual(haversine.shape, (10, 15))
+        # the sphere differs from the ellipsoid by well under one percent
+        np.testing.assert_allclose(haversine, geodesic, rtol=0.005)
+
+    def test_known_distance(self):
+        # Krasnoyarsk to Moscow is about 3360 km
+        matrix = get_distance_matrix([(56.0106, 92.8526)], [(55.7558, 37.6173)], precise=True)
+        self.assertAlmostEqual(matrix[0, 0], 3360, delta=15)
+        self.assertAlmostEqual(get_distance_matrix([(56.0106, 92.8526)], [(55.7558, 37.6173)])[0, 0], 3360, delta=15)
+
+    def test_unknown_coordinates_give_nan(self):
+        origins = [(56.01, 92.85), (None, None)]
+        destinations = [(56.02, 92.87), (None, 92.87)]
+        for precise in [False, True]:
+            matrix = get_distance_matrix(origins, destinations, precise=precise)
+            self.assertEqual(np.isnan(matrix).tolist(), [[False, True], [True, True]])
+        self.assertEqual(get_distance_matrix([], destinations).shape, (0, 2))
+
+
+class GridIndexTest(SimpleTestCase):
+    def test_nearest_matches_brute_force(self):
+        rand = random.Random(0)
+        points = [(56 + rand.uniform(-0.2, 0.2), 92.9 + rand.uniform(-0.3, 0.3)) for _ in range(500)]
+        grid = GridIndex(points, cell_km=1)
+        allowed = np.array([rand.random() < 0.5 for _ in points])
+        for _ in range(20):
+            lat, lng = 56 + rand.uniform(-0.2, 0.2), 92.9 + rand.uniform(-0.3, 0.3)
+            all_distances = grid.get_distances(lat, lng, np.flatnonzero(allowed))
+            expected_distances = np.sort(all_distances)
+
+            positions, distances = grid.nearest(lat, lng, count=5, allowed=allowed)
+            np.testing.assert_allclose(distances, expected_distances[:5])
+            self.assertTrue(allowed[positions].all())
+
+            positions, distances = grid.nearest(lat, lng, radius_km=3, allowed=allowed)
+            np.testing.assert_allclose(distances, expected_distances[expected_distances <= 3])
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from foodcartapp.assignment import propose_assignments
+from foodcartapp.availability import availability_matrix
+from foodcartapp.capabilities import capability_index
+from foodcartapp.catalog import reset_available_products
+from foodcartapp.locations import restaurant_locations
+from foodcartapp.models import (
+    Order,
+    OrderItem,
+    Product,
+    ProductCategory,
+    Restaurant,
+    RestaurantMenuItem,
+)
+from place.addresses import normalize_address
+from place.geocoding import geocoding_cache
+from place.models import Place
+from star_burger.asgi import application as asgi_application
+
+
+# the generated catalog and indexes must not get into the cache the site is served from
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    },
+}
+CITY_CENTER = (56.0106, 92.8526)
+CITY_RADIUS = 0.1
+
+
+def reset_process_indexes():
+    capability_index.reset()
+    restaurant_locations.reset()
+    availability_matrix.reset()
+    reset_available_products()
+    geocoding_cache.clear()
+
+
+def get_random_coordinates(rand):
+    return (
+        round(CITY_CENTER[0] + rand.uniform(-CITY_RADIUS, CITY_RADIUS), 6),
+        round(CITY_CENTER[1] + rand.uniform(-CITY_RADIUS, CITY_RADIUS), 6),
+    )
+
+
+def generate_data(restaurants=10, products=50, orders=200, availability=0.8, items_per_order=3, seed=0):
+    rand = random.Random(seed)
+
+    ProductCategory.objects.bulk_create(
+        [ProductCategory(name=f'Категория {number}') for number in range(5)]
+    )
+    categories = list(ProductCategory.objects.all())
+    Product.objects.bulk_create([
+        Product(
+            name=f'Товар {number}',
+            category=rand.choice(categories),
+            price=Decimal(rand.randrange(100, 1000)),
+            image='benchmark.jpg',
+        )
+        for number in range(products)
+    ])
+    Restaurant.objects.bulk_create([
+        Restaurant(
+            name=f'Ресторан {number}',
+            address=f'Бенчмарк, ресторан {number}',
+            contact_phone='+79000000000',
+            lat=lat,
+            lng=lng,
+            geocode_status=Restaurant.FOUND,
+        )
+        for number, (lat, lng) in enumerate(get_random_coordinates(rand) for _ in range(restaurants))
+    ])
+    all_products = list(Product.objects.order_by('id'))
+    all_restaurants = list(Restaurant.objects.order_by('id'))
+
+    RestaurantMenuItem.objects.bulk_create([
+        RestaurantMenuItem(
+            restaurant=restaurant,
+            product=product,
+            availability=rand.random() < availability,
+        )
+        for restaurant in all_restaurants
+        for product in all_products
+    ])
+
+    new_orders = [
+        Order(
+            firstname=f'Имя {number}',
+            lastname=f'Фамилия {number}',
+            phonenumber='+79123456789',
+            address=f'Бенчмарк, заказ {number}',
+            payment_method=rand.choice([Order.CASH, Order.ELECTRONIC]),
+            status=rand.choice([Order.RAW, Order.RAW, Order.DURING]),
+        )
+        for number in range(orders)
+    ]
+    for order in new_orders:
+        order.save()
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, quantity=rand.randint(1, 3), price=product.price)
+        for order in new_orders
+        for product in rand.sample(all_products, min(items_per_order, len(all_products)))
+    ])
+    Order.objects.recalculate_cost()
+
+    Place.objects.bulk_create([
+        Place(address=address, normalized_address=normalize_address(address), lat=lat, lng=lng)
+        for address, (lat, lng) in (
+            (address, get_random_coordinates(rand))
+            for address in [order.address for order in new_orders]
+        )
+    ])
+    return {
+        'restaurants': restaurants,
+        'products': products,
+        'orders': orders,
+        'availability': availability,
+        'items_per_order': items_per_order,
+    }
+
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percentile / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def check_response(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f'{response.status_code}: {response.content[:200]}')
+
+
+def measure(make_request, runs):
+    timings = []
+    queries = []
+    for _ in range(runs):
+        with CaptureQueriesContext(connection) as context:
+            started_at = time.perf_counter()
+            response = make_request()
+            timings.append(time.perf_counter() - started_at)
+        check_response(response)
+        queries.append(len(context))
+
+    # tracemalloc slows everything down, so memory is measured in a separate run
+    tracemalloc.start()
+    check_response(make_request())
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'runs': runs,
+        'p50_ms': round(get_percentile(timings, 50) * 1000, 2),
+        'p95_ms': round(get_percentile(timings, 95) * 1000, 2),
+        'mean_ms': round(statistics.mean(timings) * 1000, 2),
+        'queries_max': max(queries),
+        'queries_median': statistics.median(queries),
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+    }
+
+
+def get_order_payload(rand, products_ids):
+    return json.dumps({
+        'products': [
+            {'product': product_id, 'quantity': rand.randint(1, 3)}
+            for product_id in rand.sample(products_ids, min(3, len(products_ids)))
+        ],
+        'firstname': 'Бенчмарк',
+        'lastname': 'Бенчмарк',
+        'phonenumber': '+79123456789',
+        'address': 'Бенчмарк, заказ 0',
+    })
+
+
+def run_benchmarks(runs=20, seed=0):
+    rand = random.Random(seed)
+    manager = User.objects.create_user('benchmark', password='benchmark', is_staff=True)
+    client = Client()
+    manager_client = Client()
+    manager_client.force_login(manager)
+    available_products_ids = list(Product.objects.available().values_list('id', flat=True))
+
+    return {
+        'product_list_api': measure(lambda: client.get('/api/products/'), runs),
+        'register_order_api': measure(
+            lambda: client.post(
+                '/api/order/',
+                get_order_payload(rand, available_products_ids),
+                content_type='application/json',
+            ),
+            runs,
+        ),
+        'view_products': measure(lambda: manager_client.get(reverse('restaurateur:ProductsView')), runs),
+        'view_orders': measure(lambda: manager_client.get(reverse('restaurateur:view_orders')), runs),
+    }
+
+
+def measure_wsgi_throughput(url, requests, concurrency):
+    def make_request(_):
+        return Client().get(url)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        responses = list(executor.map(make_request, range(requests)))
+    duration = time.perf_counter() - started_at
+    for response in responses:
+        check_response(response)
+    return round(requests / duration, 1)
+
+
+async def get_asgi_response(url):
+    """GET the url from the application a server such as uvicorn runs.
+
+    The test AsyncClient has its own handler, so it would not measure what
+    star_burger.asgi wraps around the requests.
+    """
+    path, _, query_string = url.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'testserver')],
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 0),
+    }
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    disconnected = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    response = SimpleNamespace(status_code=None, content=b'')
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response.status_code = message['status']
+        elif message['type'] == 'http.response.body':
+            response.content += message.get('body', b'')
+
+    await asgi_application(scope, receive, send)
+    disconnected.set()
+    return response
+
+
+def measure_asgi_throughput(url, requests, concurrency):
+    async def make_requests():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def make_request():
+            async with semaphore:
+                return await get_asgi_response(url)
+
+        return await asyncio.gather(*(make_request() for _ in range(requests)))
+
+    started_at = time.perf_counter()
+    responses = asyncio.run(make_requests())
+    duration = time.perf_counter() - started_at
+    for response in responses:
+        check_response(response)
+    return round(requests / duration, 1)
+
+
+def compare_handlers(requests=200, concurrency=10):
+    return {
+        url: {
+            'concurrency': concurrency,
+            'requests': requests,
+            'wsgi_rps': measure_wsgi_throughput(url, requests, concurrency),
+            'asgi_rps': measure_asgi_throughput(url, requests, concurrency),
+        }
+        for url in ['/api/products/', '/api/banners/']
+    }
+
+
+def measure_assignment(runs=5):
+    orders_count = Order.objects.filter(status=Order.RAW, cook_in__isnull=True).count()
+    restaurants_count = Restaurant.objects.count()
+    # with barely enough capacity the nearest restaurants overflow and orders have to be moved between them
+    capacity = orders_count // max(restaurants_count, 1) + 1
+    timings = []
+    with override_settings(RESTAURANT_MAX_ACTIVE_ORDERS=capacity):
+        for _ in range(runs):
+            started_at = time.perf_counter()
+            proposal = propose_assignments(Order.objects.all())
+            timings.append(time.perf_counter() - started_at)
+    return {
+        'orders': orders_count,
+        'restaurants': restaurants_count,
+        'capacity': capacity,
+        'assigned': sum(restaurant is not None for _, restaurant, _ in proposal),
+        'p50_ms': round(get_percentile(timings, 50) * 1000, 2),
+        'max_ms': round(max(timings) * 1000, 2),
+    }
@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from restaurateur.benchmarks import (
+    BENCHMARK_CACHES,
+    compare_handlers,
+    generate_data,
+    measure_assignment,
+    reset_process_indexes,
+    run_benchmarks,
+)
+
+
+class Command(BaseCommand):
+    help = 'Замеряет скорость витрины и страниц менеджера на сгенерированных данных во временной БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=10)
+        parser.add_argument('--products', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=200)
+        parser.add_argument('--availability', type=float, default=0.8, help='Доля товаров в продаже в каждом ресторане')
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--runs', type=int, default=20, help='Сколько раз запрашивать каждую страницу')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=200, help='Сколько запросов к API отправить через WSGI и ASGI')
+        parser.add_argument('--concurrency', type=int, default=10, help='Сколько запросов к API выполнять одновременно')
+        parser.add_argument('--output', help='Сохранить отчёт в JSON-файл')
+
+    def handle(self, *args, **options):
+        with override_settings(CACHES=BENCHMARK_CACHES):
+            reset_process_indexes()
+            try:
+                report = self.run_benchmarks(options)
+            finally:
+                reset_process_indexes()
+
+        dumped_report = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(dumped_report)
+        self.stdout.write(dumped_report)
+
+    def run_benchmarks(self, options):
+        setup_test_environment()
+        old_database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            return {
+                'data': generate_data(
+                    restaurants=options['restaurants'],
+                    products=options['products'],
+                    orders=options['orders'],
+                    availability=options['availability'],
+                    items_per_order=options['items_per_order'],
+                    seed=options['seed'],
+                ),
+                'results': run_benchmarks(runs=options['runs'], seed=options['seed']),
+                'handlers': compare_handlers(requests=options['requests'], concurrency=options['concurrency']),
+                'assignment': measure_assignment(),
+            }
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            teardown_test_environment()
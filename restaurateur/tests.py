@@ -1,3 +1,247 @@
+import datetime
+import difflib
+import json
+import random
+import re
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import F
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from foodcartapp.availability import availability_matrix
+from foodcartapp.capabilities import capability_index
+from foodcartapp.catalog import invalidate_catalog
+from foodcartapp.events import ORDER_EVENTS_GRACE, get_last_order_event_id
+from foodcartapp.locations import restaurant_locations
+from foodcartapp.models import Order, OrderEvent, Product, ProductCategory, Restaurant
+from place.geocoding import geocoding_cache
+from place.models import Place
+from restaurateur.benchmarks import generate_data
+from restaurateur.views import ORDERS_PER_PAGE
+
+
+SMALL_SCALE = {'restaurants': 2, 'products': 5, 'orders': 3, 'items_per_order': 1}
+LARGE_SCALE = {'restaurants': 6, 'products': 15, 'orders': 12, 'items_per_order': 4}
+
+
+def normalize_sql(sql):
+    sql = re.sub(r'"s\d+_x\d+"', '"savepoint"', sql)
+    return re.sub(r'\b\d+\b', '?', sql)
+
+
+class QueryBudgetTest(TestCase):
+    def setUp(self):
+        self.manager = User.objects.create_superuser('manager', password='manager')
+        self.client.force_login(self.manager)
+
+    def seed(self, scale):
+        Order.objects.all().delete()
+        Restaurant.objects.all().delete()
+        Product.objects.all().delete()
+        ProductCategory.objects.all().delete()
+        Place.objects.all().delete()
+        generate_data(availability=1, **scale)
+        # assigned orders render their restaurant, a manual choice keeps them on the manager page
+        restaurant = Restaurant.objects.order_by('id').first()
+        for order in Order.objects.order_by('id')[::2]:
+            order.status = Order.DURING
+            order.cook_in = restaurant
+            order.dispatch_status = Order.DISPATCH_MANUAL
+            order.save()
+        capability_index.rebuild()
+        restaurant_locations.invalidate()
+        availability_matrix.invalidate()
+        invalidate_catalog()
+
+    def request(self, url, get_payload=None):
+        if get_payload is None:
+            return self.client.get(url)
+        return self.client.post(url, json.dumps(get_payload()), content_type='application/json')
+
+    def capture_queries(self, scale, get_url, get_payload=None):
+        self.seed(scale)
+        url = get_url()
+        self.request(url, get_payload)
+        geocoding_cache.clear()
+        invalidate_catalog()
+        with CaptureQueriesContext(connection) as context:
+            response = self.request(url, get_payload)
+        self.assertIn(response.status_code, [200, 201])
+        return [normalize_sql(query['sql']) for query in context.captured_queries]
+
+    def assertConstantQueries(self, get_url, get_payload=None):
+        small_queries = self.capture_queries(SMALL_SCALE, get_url, get_payload)
+        large_queries = self.capture_queries(LARGE_SCALE, get_url, get_payload)
+        if len(small_queries) != len(large_queries):
+            diff = '\n'.join(difflib.unified_diff(
+                small_queries,
+                large_queries,
+                fromfile='small scale',
+                tofile='large scale',
+                lineterm='',
+            ))
+            self.fail(
+                f'{get_url()}: {len(small_queries)} queries on small data, '
+                f'{len(large_queries)} on large data\n{diff}'
+            )
+
+    def test_view_orders(self):
+        self.assertConstantQueries(lambda: reverse('restaurateur:view_orders'))
+
+    def test_view_products(self):
+        self.assertConstantQueries(lambda: reverse('restaurateur:ProductsView'))
+
+    def test_view_restaurants(self):
+        self.assertConstantQueries(lambda: reverse('restaurateur:RestaurantView'))
+
+    def test_order_admin_change_page(self):
+        self.assertConstantQueries(lambda: reverse(
+            'admin:foodcartapp_order_change',
+            args=[Order.objects.order_by('id').first().id],
+        ))
+
+    def test_order_admin_changelist(self):
+        self.assertConstantQueries(lambda: reverse('admin:foodcartapp_order_changelist'))
+
+    def test_restaurant_admin_change_page(self):
+        self.assertConstantQueries(lambda: reverse(
+            'admin:foodcartapp_restaurant_change',
+            args=[Restaurant.objects.order_by('id').first().id],
+        ))
+
+    def test_product_admin_change_page(self):
+        self.assertConstantQueries(lambda: reverse(
+            'admin:foodcartapp_product_change',
+            args=[Product.objects.order_by('id').first().id],
+        ))
+
+    def test_product_list_api(self):
+        self.assertConstantQueries(lambda: '/api/products/')
+
+    def test_register_order_api(self):
+        self.assertConstantQueries(lambda: '/api/order/', lambda: {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79123456789',
+            'address': 'Бенчмарк, заказ 0',
+            'products': [{'product': Product.objects.order_by('id').first().id, 'quantity': 2}],
+        })
+
+
+class OrdersUpdatesTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('manager', password='manager'))
+        with self.captureOnCommitCallbacks(execute=True):
+            generate_data(availability=1, **SMALL_SCALE)
+        capability_index.rebuild()
+        restaurant_locations.invalidate()
+
+    def age_events(self):
+        OrderEvent.objects.update(created_at=F('created_at') - ORDER_EVENTS_GRACE)
+
+    def get_updates(self, after):
+        response = self.client.get(reverse('restaurateur:view_orders_updates'), {'after': after})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_changed_and_removed_orders(self):
+        cursor = get_last_order_event_id()
+        self.assertEqual(self.get_updates(cursor), {'cursor': cursor, 'rows': [], 'removed': []})
+
+        changed_order, processed_order = Order.objects.order_by('id')[:2]
+        with self.captureOnCommitCallbacks(execute=True):
+            changed_order.comment = 'Позвонить за час'
+            changed_order.save()
+            processed_order.status = Order.PROCESSED
+            processed_order.save()
+
+        fresh_updates = self.get_updates(cursor)
+        self.assertEqual(fresh_updates['cursor'], cursor)
+        self.age_events()
+        updates = self.get_updates(cursor)
+        self.assertEqual(updates['rows'], fresh_updates['rows'])
+        self.assertGreater(updates['cursor'], cursor)
+        self.assertEqual([row['id'] for row in updates['rows']], [changed_order.id])
+        self.assertIn('Позвонить за час', updates['rows'][0]['html'])
+        self.assertEqual(updates['removed'], [processed_order.id])
+        self.assertEqual(self.get_updates(updates['cursor'])['rows'], [])
+
+    def test_event_committed_late_is_not_skipped(self):
+        _, late_order, last_order = Order.objects.order_by('id')[:3]
+        self.age_events()
+        cursor = get_last_order_event_id()
+        # the late event took its id first, but is committed after the next one was read
+        OrderEvent.objects.create(id=cursor + 2, order_id=last_order.id)
+        updates = self.get_updates(cursor)
+        self.assertEqual([row['id'] for row in updates['rows']], [last_order.id])
+
+        OrderEvent.objects.create(id=cursor + 1, order_id=late_order.id)
+        self.age_events()
+        updates = self.get_updates(updates['cursor'])
+        self.assertEqual({row['id'] for row in updates['rows']}, {late_order.id, last_order.id})
+        self.assertEqual(updates['cursor'], cursor + 2)
+
+    def test_requires_manager(self):
+        self.client.logout()
+        response = self.client.get(reverse('restaurateur:view_orders_updates'), {'after': 0})
+        self.assertEqual(response.status_code, 403)
+
+
+class OrdersPaginationTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('manager', password='manager'))
+        started_at = timezone.now()
+        generator = random.Random(5)
+        # few distinct dates, so orders of one status often share a date and are told apart by id
+        Order.objects.bulk_create([
+            Order(
+                firstname='Иван',
+                lastname='Петров',
+                phonenumber='+79123456789',
+                address='Ленина, 5',
+                payment_method=Order.CASH,
+                status=generator.choice([Order.RAW, Order.DURING, Order.PROCESSED]),
+                registration_date=started_at + datetime.timedelta(minutes=generator.randrange(20)),
+            )
+            for _ in range(ORDERS_PER_PAGE * 3)
+        ])
+
+    def get_all_pages(self, **params):
+        orders_url = reverse('restaurateur:view_orders')
+        response = self.client.get(orders_url, params)
+        orders_ids = [order.id for order in response.context['orders']]
+        while response.context['next_page_url']:
+            response = self.client.get(orders_url + response.context['next_page_url'])
+            orders_ids.extend(order.id for order in response.context['orders'])
+        return orders_ids
+
+    def test_pages_go_by_status_first(self):
+        expected_ids = list(
+            Order.objects
+            .exclude(status=Order.PROCESSED)
+            .order_by('-status', 'registration_date', 'id')
+            .values_list('id', flat=True)
+        )
+        orders_ids = self.get_all_pages()
+        self.assertEqual(orders_ids, expected_ids)
+        statuses = dict(Order.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[orders_ids[0]], Order.RAW)
+        self.assertEqual(statuses[orders_ids[-1]], Order.DURING)
+
+    def test_pages_of_one_status(self):
+        expected_ids = list(
+            Order.objects
+            .filter(status=Order.PROCESSED)
+            .order_by('registration_date', 'id')
+            .values_list('id', flat=True)
+        )
+        self.assertEqual(self.get_all_pages(status=Order.PROCESSED), expected_ids)
 
-# Create your tests here.
+    def test_broken_cursor_gives_first_page(self):
+        response = self.client.get(reverse('restaurateur:view_orders'), {'cursor': 'bm90LWEtY3Vyc29y'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['orders']), ORDERS_PER_PAGE)
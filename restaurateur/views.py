@@ -1,15 +1,32 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
 from django import forms
-from django.db.models import OuterRef, Subquery, Sum, F
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.http import HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
 from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
 from django.views import View
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.contrib.auth.decorators import user_passes_test
 
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import views as auth_views
 
+from foodcartapp.availability import availability_matrix
+from foodcartapp.events import ORDER_EVENTS_GRACE, get_changed_orders_ids, get_last_order_event_id
+from foodcartapp.loads import get_restaurants_load
 from foodcartapp.models import Product, Restaurant, Order
-from place.models import Place
+
+
+ORDERS_PER_PAGE = 50
+PRODUCTS_PER_PAGE = 100
+ORDERS_POLL_INTERVAL = 1
+ALL_DISPATCH_STATUSES = 'all'
 
 
 class Login(forms.Form):
@@ -64,50 +81,208 @@ def is_manager(user):
     return user.is_staff  # FIXME replace with specific permission
 
 
+class ProductsFilter(forms.Form):
+    restaurants = forms.TypedMultipleChoiceField(
+        label='Рестораны',
+        required=False,
+        coerce=int,
+        widget=forms.SelectMultiple(attrs={'class': 'form-control'}),
+    )
+
+    def __init__(self, *args, restaurants, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['restaurants'].choices = [(restaurant.id, restaurant.name) for restaurant in restaurants]
+
+
 @user_passes_test(is_manager, login_url='restaurateur:login')
 def view_products(request):
     restaurants = list(Restaurant.objects.order_by('name'))
-    products = list(Product.objects.prefetch_related('menu_items'))
+    filter_form = ProductsFilter(request.GET, restaurants=restaurants)
+    filter_form.is_valid()
+    selected_restaurants_ids = set(filter_form.cleaned_data.get('restaurants') or [])
+    if selected_restaurants_ids:
+        restaurants = [restaurant for restaurant in restaurants if restaurant.id in selected_restaurants_ids]
 
-    default_availability = {restaurant.id: False for restaurant in restaurants}
-    products_with_restaurants = []
-    for product in products:
-        availability = {
-            **default_availability,
-            **{item.restaurant_id: item.availability for item in product.menu_items.all()},
-        }
-        orderer_availability = [availability[restaurant.id] for restaurant in restaurants]
-
-        products_with_restaurants.append(
-            (product, orderer_availability)
-        )
+    products = Paginator(
+        Product.objects.select_related('category').order_by('id'),
+        PRODUCTS_PER_PAGE,
+    ).get_page(request.GET.get('page'))
+    availability = availability_matrix.get_rows(
+        [product.id for product in products],
+        [restaurant.id for restaurant in restaurants],
+    )
+    products_with_restaurants = [(product, availability[product.id]) for product in products]
 
+    page_params = request.GET.copy()
+    page_params.pop('page', None)
     return render(request, template_name="products_list.html", context={
         'products_with_restaurants': products_with_restaurants,
         'restaurants': restaurants,
+        'filter_form': filter_form,
+        'page': products,
+        'page_params': page_params.urlencode(),
     })
 
 
 @user_passes_test(is_manager, login_url='restaurateur:login')
 def view_restaurants(request):
+    loads = get_restaurants_load()
     return render(request, template_name="restaurants_list.html", context={
-        'restaurants': Restaurant.objects.all(),
+        'restaurants_with_load': [
+            (restaurant, loads.get(restaurant.id, 0))
+            for restaurant in Restaurant.objects.all()
+        ],
     })
 
 
+class OrderFilter(forms.Form):
+    status = forms.ChoiceField(
+        label='Статус',
+        required=False,
+        choices=[('', 'Все необработанные'), *Order.STATUS_CHOICES],
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    payment_method = forms.ChoiceField(
+        label='Способ оплаты',
+        required=False,
+        choices=[('', 'Любой'), *Order.PAYMENT_METHOD_CHOICES],
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    dispatch_status = forms.ChoiceField(
+        label='Назначение',
+        required=False,
+        choices=[('', 'Требуют менеджера'), (ALL_DISPATCH_STATUSES, 'Любое'), *Order.DISPATCH_CHOICES],
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    restaurant = forms.ModelChoiceField(
+        label='Ресторан',
+        required=False,
+        queryset=Restaurant.objects.order_by('name'),
+        empty_label='Любой',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    cursor = forms.CharField(
+        required=False,
+        widget=forms.HiddenInput,
+    )
+
+    def clean_cursor(self):
+        cursor = self.cleaned_data['cursor']
+        if not cursor:
+            return None
+        try:
+            status, registration_date, order_id = urlsafe_base64_decode(cursor).decode().split(',')
+            registration_date = parse_datetime(registration_date)
+            order_id = int(order_id)
+        except ValueError:
+            raise forms.ValidationError('Неверный курсор')
+        if not registration_date or status not in dict(Order.STATUS_CHOICES):
+            raise forms.ValidationError('Неверный курсор')
+        return status, registration_date, order_id
+
+
+def encode_orders_cursor(order):
+    return urlsafe_base64_encode(f'{order.status},{order.registration_date.isoformat()},{order.id}'.encode())
+
+
+def filter_orders(filters):
+    # the rows show the restaurant that cooks the order
+    orders = Order.objects.order_by_status().select_related('cook_in')
+    if filters.get('status'):
+        orders = orders.filter(status=filters['status'])
+    else:
+        orders = orders.exclude(status=Order.PROCESSED)
+    if filters.get('payment_method'):
+        orders = orders.filter(payment_method=filters['payment_method'])
+    # orders the dispatcher has assigned need no manager, so by default only the rest are shown
+    if not filters.get('dispatch_status'):
+        orders = orders.exclude(dispatch_status=Order.DISPATCH_AUTO)
+    elif filters['dispatch_status'] != ALL_DISPATCH_STATUSES:
+        orders = orders.filter(dispatch_status=filters['dispatch_status'])
+    if filters.get('restaurant'):
+        orders = orders.filter(cook_in=filters['restaurant'])
+    return orders
+
+
 @user_passes_test(is_manager, login_url='restaurateur:login')
 def view_orders(request):
-    places = Place.objects.filter(address=OuterRef('address'))
+    filter_form = OrderFilter(request.GET)
+    filter_form.is_valid()
+    filters = filter_form.cleaned_data
+
+    # taken before the orders, so a change made while the page renders comes with the first update
+    last_event_id = get_last_order_event_id()
+    orders = filter_orders(filters)
+    if filters.get('cursor'):
+        orders = orders.after(*filters['cursor'])
+
+    page_orders = (
+        orders
+        .prefetch_related('items')
+        [:ORDERS_PER_PAGE]
+        .add_restaurants_with_distance()
+    )
+    next_page_url = None
+    last_order = page_orders[-1] if page_orders else None
+    if last_order and orders.after(last_order.status, last_order.registration_date, last_order.id).exists():
+        next_page_params = request.GET.copy()
+        next_page_params['cursor'] = encode_orders_cursor(last_order)
+        next_page_url = f'?{next_page_params.urlencode()}'
 
     return render(request, template_name='order_items.html', context={
-        'orders': Order.objects
-                  .exclude(status=Order.PROCESSED)
-                  .prefetch_related('items')
-                  .order_by('-status')
-                  .annotate(
-                    order_cost=Sum(F('items__quantity') * F('items__price')),
-                    lat=Subquery(places.values('lat')),
-                    lng=Subquery(places.values('lng')),
-                  )
-                  .add_restaurants_with_distance(),
+        'orders': page_orders,
+        'filter_form': filter_form,
+        'next_page_url': next_page_url,
+        'last_event_id': last_event_id,
+        'return_url': request.get_full_path(),
+        'long_poll_seconds': settings.ORDERS_LONG_POLL_SECONDS,
+    })
+
+
+def get_orders_updates(request, after):
+    filter_form = OrderFilter(request.GET)
+    filter_form.is_valid()
+    changed_orders_ids, last_event_id = get_changed_orders_ids(after)
+    if not changed_orders_ids:
+        return JsonResponse({'cursor': last_event_id, 'rows': [], 'removed': []})
+
+    orders = (
+        filter_orders(filter_form.cleaned_data)
+        .filter(id__in=changed_orders_ids)
+        .prefetch_related('items')
+        .add_restaurants_with_distance()
+    )
+    return_url = request.GET.get('return_url') or reverse('restaurateur:view_orders')
+    return JsonResponse({
+        'cursor': last_event_id,
+        'rows': [
+            {
+                'id': order.id,
+                'html': render_to_string('order_row.html', {'order': order, 'return_url': return_url}, request),
+            }
+            for order in orders
+        ],
+        'removed': sorted(changed_orders_ids - {order.id for order in orders}),
     })
+
+
+async def view_orders_updates(request):
+    """Changes of orders after the event cursor as rendered rows.
+
+    The request is held up to ORDERS_LONG_POLL_SECONDS while nothing
+    changes, the wait only reads the id of the last event from the cache.
+    """
+    if not await sync_to_async(lambda: is_manager(request.user))():
+        return HttpResponseForbidden()
+    try:
+        after = int(request.GET.get('after', ''))
+    except ValueError:
+        return HttpResponseBadRequest('after должен быть номером события')
+
+    deadline = time.monotonic() + settings.ORDERS_LONG_POLL_SECONDS
+    while time.monotonic() < deadline and await sync_to_async(get_last_order_event_id)() <= after:
+        await asyncio.sleep(ORDERS_POLL_INTERVAL)
+    if time.monotonic() < deadline:
+        # the cursor stays before fresh events, let them settle so the page does not ask again at once
+        await asyncio.sleep(ORDER_EVENTS_GRACE.total_seconds())
+    return await sync_to_async(get_orders_updates)(request, after)
@@ -0,0 +1,23 @@
+"""
+ASGI config for Django project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from asgiref.sync import ThreadSensitiveContext
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "star_burger.settings")
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    # Django 3.2 runs the sync code of all requests, middleware included, in one
+    # thread per process; later versions give each request a thread of its own
+    async with ThreadSensitiveContext():
+        await django_application(scope, receive, send)
@@ -0,0 +1,258 @@
+import asyncio
+import contextvars
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.decorators import sync_and_async_middleware
+
+
+DEFAULT_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped_labels = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(escaped_labels) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{format_labels(labels)} {value}'
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            observations = self._values[key]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    observations['buckets'][index] += 1
+            observations['sum'] += value
+            observations['count'] += 1
+
+    def get(self, **labels):
+        """Count and sum of the values observed with the labels."""
+        with self._lock:
+            observations = self._values.get(tuple(sorted(labels.items())), {'sum': 0, 'count': 0})
+            return observations['count'], observations['sum']
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def collect(self):
+        with self._lock:
+            values = {
+                key: {'buckets': list(observations['buckets']), 'sum': observations['sum'], 'count': observations['count']}
+                for key, observations in self._values.items()
+            }
+        for labels, observations in sorted(values.items()):
+            for bound, count in zip(self.buckets, observations['buckets']):
+                yield f'{self.name}_bucket{format_labels(labels + (("le", bound),))} {count}'
+            yield f'{self.name}_bucket{format_labels(labels + (("le", "+Inf"),))} {observations["count"]}'
+            yield f'{self.name}_sum{format_labels(labels)} {observations["sum"]}'
+            yield f'{self.name}_count{format_labels(labels)} {observations["count"]}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+# metrics are kept per process, so with several workers every one of them has to be scraped
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    'http_requests_total',
+    'Number of handled requests by URL name and status code.',
+))
+REQUEST_DURATION = registry.register(Histogram(
+    'http_request_duration_seconds',
+    'Request latency by URL name.',
+))
+RESPONSE_SIZE = registry.register(Histogram(
+    'http_response_size_bytes',
+    'Response body size by URL name.',
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+))
+REQUEST_SQL_QUERIES = registry.register(Histogram(
+    'http_request_sql_queries',
+    'Number of SQL queries per request by URL name.',
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+))
+REQUEST_SQL_DURATION = registry.register(Histogram(
+    'http_request_sql_duration_seconds',
+    'Total time spent in SQL queries per request by URL name.',
+))
+GEOCODER_CACHE_HITS = registry.register(Counter(
+    'geocoder_cache_hits_total',
+    'Addresses resolved from the in-memory cache or the Place table.',
+))
+GEOCODER_CACHE_MISSES = registry.register(Counter(
+    'geocoder_cache_misses_total',
+    'Addresses that had to be geocoded or queued for geocoding.',
+))
+GEOCODER_REQUEST_DURATION = registry.register(Histogram(
+    'geocoder_request_duration_seconds',
+    'Latency of requests to the geocoder API.',
+))
+GEOCODER_REQUESTS = registry.register(Counter(
+    'geocoder_requests_total',
+    'Requests to the geocoder API by outcome: ok, timeout, connection_error or http_error.',
+))
+GEOCODER_RETRIES = registry.register(Counter(
+    'geocoder_retries_total',
+    'Requests to the geocoder API repeated after a failure.',
+))
+GEOCODER_CIRCUIT_REJECTIONS = registry.register(Counter(
+    'geocoder_circuit_rejections_total',
+    'Geocoder calls refused without a request because the circuit breaker is open.',
+))
+GEOCODER_CIRCUIT_TRANSITIONS = registry.register(Counter(
+    'geocoder_circuit_transitions_total',
+    'Circuit breaker state changes by new state: open, half_open or closed.',
+))
+RESTAURANT_MATCHING_DURATION = registry.register(Histogram(
+    'restaurant_matching_duration_seconds',
+    'Time spent matching a page of orders with restaurants and distances.',
+))
+
+
+def get_view_name(request):
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return '<unresolved>'
+    return resolver_match.view_name
+
+
+current_sql_stats = contextvars.ContextVar('current_sql_stats', default=None)
+
+
+def record_sql_query(execute, sql, params, many, context):
+    sql_stats = current_sql_stats.get()
+    if sql_stats is None:
+        return execute(sql, params, many, context)
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sql_stats['count'] += 1
+        sql_stats['duration'] += time.perf_counter() - started_at
+
+
+@receiver(connection_created)
+def install_sql_recorder(sender, connection, **kwargs):
+    # a context variable reaches the threads of sync_to_async, so queries of async views are counted too
+    if record_sql_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql_query)
+
+
+def observe_response(request, response, started_at, sql_stats):
+    view_name = get_view_name(request)
+    REQUESTS.inc(view=view_name, status=response.status_code)
+    REQUEST_DURATION.observe(time.perf_counter() - started_at, view=view_name)
+    REQUEST_SQL_QUERIES.observe(sql_stats['count'], view=view_name)
+    REQUEST_SQL_DURATION.observe(sql_stats['duration'], view=view_name)
+    if not response.streaming:
+        RESPONSE_SIZE.observe(len(response.content), view=view_name)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            sql_stats = {'count': 0, 'duration': 0}
+            token = current_sql_stats.set(sql_stats)
+            started_at = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                current_sql_stats.reset(token)
+            observe_response(request, response, started_at, sql_stats)
+            return response
+    else:
+        def middleware(request):
+            install_sql_recorder(None, connection)
+            sql_stats = {'count': 0, 'duration': 0}
+            token = current_sql_stats.set(sql_stats)
+            started_at = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                current_sql_stats.reset(token)
+            observe_response(request, response, started_at, sql_stats)
+            return response
+    return middleware
+
+
+def has_metrics_token(request):
+    # behind a proxy every request comes from its address, so the client IP proves nothing
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return bool(settings.METRICS_TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(
+        token.encode(), settings.METRICS_TOKEN.encode(),
+    )
+
+
+def metrics_view(request):
+    if not has_metrics_token(request) and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
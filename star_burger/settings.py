@@ -31,12 +31,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'debug_toolbar',
     'phonenumber_field',
     'rest_framework',
+    'rest_framework.authtoken',
 ]
 
 MIDDLEWARE = [
+    'star_burger.metrics.metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -44,10 +45,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
     'rollbar.contrib.django.middleware.RollbarNotifierMiddlewareExcluding404',
 ]
 
+if DEBUG:
+    # the toolbar middleware is sync only, in production it would make async views run in a thread
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(-1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'star_burger.urls'
 
 DEBUG_TOOLBAR_PANELS = [
@@ -84,12 +89,15 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'star_burger.wsgi.application'
+ASGI_APPLICATION = 'star_burger.asgi.application'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
 DATABASES = {'default': dj_database_url.parse(env.str('DATABASE_URL'))}
 
+CACHES = {'default': env.dj_cache_url('CACHE_URL', default='locmem://')}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -133,3 +141,26 @@ ROLLBAR = {
     'environment': 'production' if env.bool('ROLLBAR_PRODUCTION_ENVIRONMENT') else 'development',
     'root': BASE_DIR,
 }
+
+GEOCODER_CACHE_DAYS = env.int('GEOCODER_CACHE_DAYS', 90)
+GEOCODER_NEGATIVE_CACHE_DAYS = env.int('GEOCODER_NEGATIVE_CACHE_DAYS', 1)
+GEOCODER_CONNECT_TIMEOUT = env.float('GEOCODER_CONNECT_TIMEOUT', 3.05)
+GEOCODER_READ_TIMEOUT = env.float('GEOCODER_READ_TIMEOUT', 5)
+GEOCODER_RETRIES = env.int('GEOCODER_RETRIES', 2)
+GEOCODER_CIRCUIT_FAILURES = env.int('GEOCODER_CIRCUIT_FAILURES', 5)
+GEOCODER_CIRCUIT_RESET_SECONDS = env.float('GEOCODER_CIRCUIT_RESET_SECONDS', 30)
+GEOCODER_LRU_SIZE = env.int('GEOCODER_LRU_SIZE', 2048)
+METRICS_TOKEN = env.str('METRICS_TOKEN', '')
+GAZETTEER_PATH = env.str('GAZETTEER_PATH', os.path.join(BASE_DIR, 'gazetteer.idx'))
+ORDERS_BATCH_THROTTLE_RATE = env.str('ORDERS_BATCH_THROTTLE_RATE', '30/min')
+ORDERS_LONG_POLL_SECONDS = env.int('ORDERS_LONG_POLL_SECONDS', 0)
+NEAREST_RESTAURANTS_COUNT = env.int('NEAREST_RESTAURANTS_COUNT', 10)
+DELIVERY_RADIUS_KM = env.float('DELIVERY_RADIUS_KM', 0)
+RESTAURANTS_GRID_CELL_KM = env.float('RESTAURANTS_GRID_CELL_KM', 2)
+PRECISE_DISTANCES = env.bool('PRECISE_DISTANCES', False)
+RESTAURANT_MAX_ACTIVE_ORDERS = env.int('RESTAURANT_MAX_ACTIVE_ORDERS', 0)
+DISPATCH_KM_PER_ACTIVE_ORDER = env.float('DISPATCH_KM_PER_ACTIVE_ORDER', 0.5)
+DISPATCH_MAX_WAIT_SECONDS = env.int('DISPATCH_MAX_WAIT_SECONDS', 120)
+
+PUBLISHED_API_MODE = env.str('PUBLISHED_API_MODE', '')
+CACHE_AVAILABLE_PRODUCTS = env.bool('CACHE_AVAILABLE_PRODUCTS', True)